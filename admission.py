@@ -0,0 +1,179 @@
+import io
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+# Stima della memoria di picco di una conversione, misurata (RSS) con benchmarks/bench_admission.py:
+# il backend docx tiene in memoria l'albero lxml dell'intero documento (~38 volte il JSON),
+# il backend stream solo il messaggio corrente più strutture che crescono con i messaggi
+COST_BASE_BYTES = 16 * 1024 * 1024
+COST_PER_INPUT_BYTE = {'docx': 40, 'stream': 1}
+COST_PER_MESSAGE = {'docx': 0, 'stream': 2048}
+
+# Ogni messaggio ha esattamente una chiave "role": dentro le stringhe JSON le virgolette
+# sono sempre precedute da una barra, quindi il conteggio dei byte è esatto
+_ROLE_KEY = b'"role"'
+
+MEASURE_CHUNK_SIZE = 1024 * 1024
+
+# Byte del JSON letti per la stima: oltre, dimensione e messaggi vengono estrapolati
+MEASURE_PREFIX_BYTES = 4 * 1024 * 1024
+
+# Limiti del Retry-After suggerito ai client respinti (secondi)
+RETRY_AFTER_MIN = 1
+RETRY_AFTER_MAX = 120
+
+
+def measure_input(fp, prefix_bytes=MEASURE_PREFIX_BYTES):
+    """
+    (byte, messaggi) stimati del JSON letto da fp, leggendone senza decodificarlo al più
+    prefix_bytes byte. Se il JSON sta nel prefisso la misura è esatta; altrimenti i messaggi
+    contati nel prefisso vengono estrapolati alla dimensione totale, quella del file o, per
+    un upload compresso, quella stimata dal rapporto di compressione del prefisso. fp torna
+    alla posizione iniziale: per un upload compresso si decomprime di nuovo solo il prefisso,
+    non l'intero file, prima che la conversione sia ammessa.
+    """
+    start = fp.tell()
+    size = messages = 0
+    tail = b''
+    try:
+        while size < prefix_bytes:
+            data = fp.read(min(MEASURE_CHUNK_SIZE, prefix_bytes - size))
+            if not data:
+                return size, messages
+            size += len(data)
+            # La chiave può essere spezzata tra due blocchi
+            window = tail + data
+            messages += window.count(_ROLE_KEY)
+            tail = window[-(len(_ROLE_KEY) - 1):]
+        total = _total_size(fp, start, size)
+        return total, round(messages * total / size)
+    finally:
+        fp.seek(start)
+
+
+def _total_size(fp, start, prefix):
+    # Dimensione del JSON intero dopo averne letto prefix byte da start
+    progress = fp.compressed_progress() if hasattr(fp, 'compressed_progress') else None
+    if progress is not None:
+        compressed_read, compressed_size = progress
+        return max(prefix, round(prefix * compressed_size / max(compressed_read, 1)))
+    try:
+        return max(prefix, fp.seek(0, io.SEEK_END) - start)
+    except (OSError, ValueError):
+        # Né la dimensione né il rapporto di compressione sono noti: resta il prefisso
+        return prefix
+
+
+def conversion_cost(input_bytes, messages, backend='docx'):
+    """Memoria stimata (byte) di una conversione di input_bytes byte e messages messaggi."""
+    if backend not in COST_PER_INPUT_BYTE:
+        backend = 'docx'
+    return COST_BASE_BYTES + input_bytes * COST_PER_INPUT_BYTE[backend] + messages * COST_PER_MESSAGE[backend]
+
+
+class Overloaded(RuntimeError):
+    """Conversione non ammessa: coda piena o attesa scaduta. retry_after in secondi."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Ammissione delle conversioni contro un budget globale di memoria. Una conversione entra
+    subito se il suo costo stimato rientra nel budget ancora libero, altrimenti attende in
+    una coda FIFO limitata (al più queue_timeout secondi); a coda piena o ad attesa scaduta
+    viene respinta con Overloaded. Una conversione più grande dell'intero budget viene
+    ammessa solo quando non ne è in corso nessun'altra.
+    """
+
+    def __init__(self, budget_bytes, max_queue=16, queue_timeout=30.0):
+        self.budget_bytes = budget_bytes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._in_flight_bytes = 0
+        self._running = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._counters = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timeouts': 0}
+        # Durata media (mobile) delle conversioni ammesse, per il Retry-After
+        self._average_seconds = None
+
+    def _fits(self, cost):
+        return self._in_flight_bytes + cost <= self.budget_bytes
+
+    def _take(self, cost):
+        self._in_flight_bytes += cost
+        self._running += 1
+        self._counters['admitted'] += 1
+
+    def retry_after(self):
+        """Secondi suggeriti prima di riprovare: la durata media delle conversioni per la coda."""
+        average = self._average_seconds or RETRY_AFTER_MIN
+        waiting = len(self._queue) + 1
+        estimate = average * waiting / max(self._running, 1)
+        return min(max(math.ceil(estimate), RETRY_AFTER_MIN), RETRY_AFTER_MAX)
+
+    def acquire(self, cost):
+        """Riserva cost byte del budget, attendendo in coda se serve; restituisce il costo riservato."""
+        cost = min(cost, self.budget_bytes)
+        # L'eventuale attesa in coda compare nel Server-Timing come fase admission
+        with metrics.stage('admission'), self._cond:
+            if not self._queue and self._fits(cost):
+                self._take(cost)
+                return cost
+            if len(self._queue) >= self.max_queue:
+                self._counters['rejected'] += 1
+                raise Overloaded("Server occupato: troppe conversioni in attesa", self.retry_after())
+            ticket = object()
+            self._queue.append(ticket)
+            self._counters['queued'] += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                # FIFO: solo la prima in coda può entrare, così le conversioni grandi non restano indietro
+                while not (self._queue[0] is ticket and self._fits(cost)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise Overloaded("Server occupato: attesa in coda scaduta", self.retry_after())
+                    self._cond.wait(remaining)
+                self._take(cost)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+            return cost
+
+    def release(self, cost, seconds=None):
+        with self._cond:
+            self._in_flight_bytes -= cost
+            self._running -= 1
+            if seconds is not None:
+                self._average_seconds = (seconds if self._average_seconds is None
+                                         else 0.8 * self._average_seconds + 0.2 * seconds)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost):
+        """Contesto che tiene riservato il costo della conversione finché è in corso."""
+        reserved = self.acquire(cost)
+        start = time.perf_counter()
+        try:
+            yield reserved
+        finally:
+            self.release(reserved, time.perf_counter() - start)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats['budget_bytes'] = self.budget_bytes
+            stats['in_flight_bytes'] = self._in_flight_bytes
+            stats['running'] = self._running
+            stats['queue_depth'] = len(self._queue)
+            stats['max_queue'] = self.max_queue
+            return stats
@@ -1,579 +1,278 @@
-import os
-import re
+import io
 import json
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+import metrics
+from admission import AdmissionController, Overloaded, conversion_cost, measure_input
+from flask import (Flask, Request, Response, after_this_request, render_template, request, send_file, flash, redirect,
+                   url_for, jsonify)
+from batch import Batch, stream_zip
+from cache import ConversionCache, FragmentCache, cache_key, hash_stream
+from converter import BACKENDS, TRANSLATIONS, preload, write_docx
+from json_stream import index_conversations, is_multi_conversation
+from branches import ACTIVE
+from jobs import DONE, FAILED, JobManager
+from preview import PREVIEW_MAX_MESSAGES, PREVIEW_MESSAGES, render_preview
+from reasoning import REASONING_MODES
+from uploads import DECOMPRESSED_MAX_BYTES, UPLOAD_CHUNK_BYTES, ChunkOffsetError, UploadStore, is_json_upload, open_upload
+
+# Upload e documenti generati restano in memoria fino a questa soglia (byte);
+# oltre passano su un file temporaneo anonimo, eliminato alla chiusura
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+def spooled_buffer():
+    return tempfile.SpooledTemporaryFile(max_size=app.config['SPOOL_MAX_SIZE'], mode='w+b')
+
+class SpooledRequest(Request):
+    # Werkzeug passa su disco ogni upload oltre 500 KB: qui la soglia è configurabile
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return spooled_buffer()
 
 app = Flask(__name__)
+app.request_class = SpooledRequest
 app.secret_key = 'chiave_segreta_per_sessioni'
+app.config['SPOOL_MAX_SIZE'] = SPOOL_MAX_SIZE
+
+# Cache dei documenti convertiti: memoria sempre attiva, disco solo se CACHE_DIR è impostata
+app.config['CACHE_MEMORY_BYTES'] = 64 * 1024 * 1024
+app.config['CACHE_DIR'] = None
+app.config['CACHE_DISK_BYTES'] = 512 * 1024 * 1024
+# XML dei singoli messaggi, riusato quando la stessa conversazione viene riesportata
+app.config['FRAGMENT_CACHE_BYTES'] = 128 * 1024 * 1024
+
+# Conversioni asincrone: processi del pool e durata dei risultati (secondi)
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_TTL'] = 3600
+app.config['JOB_DIR'] = None
+app.config['BATCH_MAX_FILES'] = 1000
+# Processi per il rendering parallelo dei messaggi di una singola conversazione
+# in /convert (0 = disattivato, rendering nel processo della richiesta)
+app.config['RENDER_WORKERS'] = 0
+# Tempi per fase e contatori delle conversioni (header Server-Timing e /metrics)
+app.config['METRICS_ENABLED'] = True
+# Limite delle richieste (byte): oltre questa dimensione si usano upload compressi o a blocchi
+app.config['MAX_CONTENT_LENGTH'] = 1024 ** 3
+# Controllo di ammissione di /convert: budget di memoria condiviso dalle conversioni
+# in corso (stimato per ciascuna da dimensione e messaggi), conversioni in attesa
+# al massimo e attesa massima in coda (secondi) prima del 503
+app.config['ADMISSION_BUDGET_BYTES'] = 2 * 1024 ** 3
+app.config['ADMISSION_MAX_QUEUE'] = 16
+app.config['ADMISSION_QUEUE_TIMEOUT'] = 30
+# Upload a blocchi riprendibili: durata senza attività (secondi), cartella e dimensione massima
+app.config['UPLOAD_TTL'] = 24 * 3600
+app.config['UPLOAD_DIR'] = None
+app.config['UPLOAD_MAX_BYTES'] = 2 * 1024 ** 3
+# Limite del JSON decompresso da un .json.gz/.bz2/.xz (protezione dalle "zip bomb")
+app.config['DECOMPRESSED_MAX_BYTES'] = DECOMPRESSED_MAX_BYTES
+
+# Documento base e template preparati all'import: con gunicorn --preload il lavoro
+# avviene una volta nel master e i worker lo ereditano con il fork
+preload()
+
+_conversion_cache = None
+_fragment_cache = None
+_job_manager = None
+_upload_store = None
+_admission_controller = None
+_render_executor = None
+_metrics_registry = None
+
+def conversion_cache():
+    # Creata al primo uso, così la configurazione può essere cambiata dopo l'import
+    global _conversion_cache
+    if _conversion_cache is None:
+        _conversion_cache = ConversionCache(
+            app.config['CACHE_MEMORY_BYTES'],
+            disk_dir=app.config['CACHE_DIR'],
+            disk_max_bytes=app.config['CACHE_DISK_BYTES'],
+        )
+    return _conversion_cache
+
+def fragment_cache():
+    global _fragment_cache
+    if _fragment_cache is None:
+        _fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_BYTES'])
+    return _fragment_cache
+
+def job_manager():
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager(app.config['JOB_WORKERS'], app.config['JOB_TTL'], app.config['JOB_DIR'])
+    return _job_manager
+
+def upload_store():
+    global _upload_store
+    if _upload_store is None:
+        _upload_store = UploadStore(app.config['UPLOAD_TTL'], app.config['UPLOAD_DIR'], app.config['UPLOAD_MAX_BYTES'])
+    return _upload_store
+
+def admission_controller():
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(
+            app.config['ADMISSION_BUDGET_BYTES'],
+            app.config['ADMISSION_MAX_QUEUE'],
+            app.config['ADMISSION_QUEUE_TIMEOUT'],
+        )
+    return _admission_controller
+
+def admission_gauges():
+    stats = admission_controller().stats()
+    return {
+        'admission_in_flight_bytes': stats['in_flight_bytes'],
+        'admission_budget_bytes': stats['budget_bytes'],
+        'admission_running': stats['running'],
+        'admission_queue_depth': stats['queue_depth'],
+    }
 
-# Carica le traduzioni
-with open('translations.json', 'r', encoding='utf-8') as f:
-    TRANSLATIONS = json.load(f)
-
-# Cartelle temporanee
-UPLOAD_FOLDER = tempfile.gettempdir()
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+def metrics_registry():
+    global _metrics_registry
+    if _metrics_registry is None:
+        _metrics_registry = metrics.MetricsRegistry()
+        _metrics_registry.register_gauges(admission_gauges)
+    return _metrics_registry
 
-ALLOWED_EXTENSIONS = {'json'}
+def render_executor():
+    global _render_executor
+    if _render_executor is None and app.config['RENDER_WORKERS'] > 0:
+        _render_executor = ProcessPoolExecutor(max_workers=app.config['RENDER_WORKERS'])
+    return _render_executor
 
+# .json, anche compresso (.json.gz, .json.bz2, .json.xz)
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return is_json_upload(filename)
 
-def format_timestamp(ts):
-    try:
-        dt = datetime.fromtimestamp(ts / 1000)
-        return dt.strftime("%d/%m/%Y %H:%M:%S")
-    except:
-        return str(ts)
-
-def get_text(key, lang='it'):
-    return TRANSLATIONS.get(lang, TRANSLATIONS['it']).get(key, key)
-
-# Rimuove i blocchi di reasoning content generati dal modello
-def strip_reasoning_content(text):
-    if not text:
-        return ""
-    # Rimuove blocchi del tipo <<<reasoning_content_start>>>...<<<reasoning_content_end>>>
-    text = re.sub(r'<<<reasoning_content_start>>>.*?<<<reasoning_content_end>>>', '', text, flags=re.DOTALL)
-    # Rimuove eventuali tag rimasti senza chiusura (fino a fine stringa)
-    text = re.sub(r'<<<reasoning_content_start>>>.*', '', text, flags=re.DOTALL)
-    return text.strip()
-
-# Funzione per pulire il testo (mantenuta per compatibilità, ora non rimuove più i marcatori markdown)
-def clean_text(text):
-    if not text:
-        return ""
-    text = strip_reasoning_content(text)
-    return text
-
-# Converte le espressioni LaTeX in simboli Unicode leggibili
-LATEX_SYMBOLS = {
-    r'\Psi': 'Ψ', r'\psi': 'ψ', r'\Phi': 'Φ', r'\phi': 'φ',
-    r'\alpha': 'α', r'\beta': 'β', r'\gamma': 'γ', r'\delta': 'δ',
-    r'\Delta': 'Δ', r'\Gamma': 'Γ', r'\Lambda': 'Λ', r'\lambda': 'λ',
-    r'\mu': 'μ', r'\nu': 'ν', r'\pi': 'π', r'\Pi': 'Π',
-    r'\rho': 'ρ', r'\sigma': 'σ', r'\Sigma': 'Σ', r'\tau': 'τ',
-    r'\theta': 'θ', r'\Theta': 'Θ', r'\omega': 'ω', r'\Omega': 'Ω',
-    r'\epsilon': 'ε', r'\eta': 'η', r'\xi': 'ξ', r'\zeta': 'ζ',
-    r'\chi': 'χ', r'\kappa': 'κ', r'\iota': 'ι', r'\upsilon': 'υ',
-    r'\infty': '∞', r'\partial': '∂', r'\nabla': '∇',
-    r'\sum': '∑', r'\prod': '∏', r'\int': '∫',
-    r'\sqrt': '√', r'\pm': '±', r'\mp': '∓',
-    r'\times': '×', r'\div': '÷', r'\cdot': '·',
-    r'\leq': '≤', r'\geq': '≥', r'\neq': '≠',
-    r'\approx': '≈', r'\equiv': '≡', r'\sim': '∼',
-    r'\in': '∈', r'\notin': '∉', r'\subset': '⊂', r'\supset': '⊃',
-    r'\cup': '∪', r'\cap': '∩', r'\emptyset': '∅',
-    r'\forall': '∀', r'\exists': '∃', r'\neg': '¬',
-    r'\wedge': '∧', r'\vee': '∨', r'\oplus': '⊕',
-    r'\rightarrow': '→', r'\leftarrow': '←', r'\Rightarrow': '⇒',
-    r'\Leftarrow': '⇐', r'\leftrightarrow': '↔', r'\Leftrightarrow': '⇔',
-    r'\uparrow': '↑', r'\downarrow': '↓',
-    r'\hbar': 'ℏ', r'\ell': 'ℓ', r'\Re': 'ℜ', r'\Im': 'ℑ',
-    r'\circ': '∘', r'\bullet': '•', r'\ldots': '…', r'\cdots': '⋯',
-    r'\^': '^', r'\_': '_',
-}
-
-def latex_to_unicode(text):
-    """Converte espressioni LaTeX $...$ in testo Unicode leggibile."""
-    def convert_expr(expr):
-        # Sostituisce comandi LaTeX noti con simboli Unicode
-        for cmd, sym in sorted(LATEX_SYMBOLS.items(), key=lambda x: -len(x[0])):
-            expr = expr.replace(cmd, sym)
-        # Gestisce ^{...} → apici (usa caratteri superscript dove possibile)
-        sup_map = {'0':'⁰','1':'¹','2':'²','3':'³','4':'⁴','5':'⁵','6':'⁶','7':'⁷','8':'⁸','9':'⁹','+':'⁺','-':'⁻','n':'ⁿ'}
-        def sup_replace(m):
-            content = m.group(1)
-            return ''.join(sup_map.get(c, c) for c in content)
-        expr = re.sub(r'\^\{([^}]+)\}', sup_replace, expr)
-        expr = re.sub(r'\^(\w)', lambda m: ''.join({'0':'⁰','1':'¹','2':'²','3':'³','4':'⁴','5':'⁵','6':'⁶','7':'⁷','8':'⁸','9':'⁹'}.get(c,c) for c in m.group(1)), expr)
-        # Gestisce _{...} → pedici
-        sub_map = {'0':'₀','1':'₁','2':'₂','3':'₃','4':'₄','5':'₅','6':'₆','7':'₇','8':'₈','9':'₉','+':'₊','-':'₋','n':'ₙ'}
-        def sub_replace(m):
-            content = m.group(1)
-            return ''.join(sub_map.get(c, c) for c in content)
-        expr = re.sub(r'_\{([^}]+)\}', sub_replace, expr)
-        expr = re.sub(r'_(\w)', lambda m: ''.join(sub_map.get(c,c) for c in m.group(1)), expr)
-        # Gestisce \frac{a}{b} → a/b
-        expr = re.sub(r'\\frac\{([^}]+)\}\{([^}]+)\}', r'\1/\2', expr)
-        # Rimuove \left \right e altri comandi di dimensionamento
-        expr = re.sub(r'\\(left|right|big|Big|bigg|Bigg)', '', expr)
-        # Rimuove eventuali {} rimasti
-        expr = expr.replace('{', '').replace('}', '')
-        # Rimuove backslash rimasti seguiti da spazio o fine
-        expr = re.sub(r'\\(?=\s|$)', '', expr)
-        return expr.strip()
-
-    # Sostituisce $...$  (inline math) con il testo convertito
-    result = re.sub(r'\$\$(.+?)\$\$', lambda m: convert_expr(m.group(1)), text, flags=re.DOTALL)
-    result = re.sub(r'\$(.+?)\$', lambda m: convert_expr(m.group(1)), result)
-    return result
-
-# Parsa il markdown inline (grassetto e corsivo) e aggiunge run formattati al paragrafo
-def add_inline_markdown(paragraph, text, base_size=11, base_bold=False, base_italic=False, color=None):
-    # Prima converti il LaTeX in Unicode
-    text = latex_to_unicode(text)
-    # Pattern per **bold**, *italic*, ***bold+italic***
-    pattern = re.compile(r'(\*\*\*(.+?)\*\*\*|\*\*(.+?)\*\*|\*(.+?)\*)')
-    last_end = 0
-    for m in pattern.finditer(text):
-        # Testo prima del match
-        if m.start() > last_end:
-            run = paragraph.add_run(text[last_end:m.start()])
-            run.font.size = Pt(base_size)
-            run.font.bold = base_bold
-            run.font.italic = base_italic
-            if color:
-                run.font.color.rgb = color
-        # Testo formattato
-        if m.group(2):  # ***bold+italic***
-            run = paragraph.add_run(m.group(2))
-            run.font.bold = True
-            run.font.italic = True
-        elif m.group(3):  # **bold**
-            run = paragraph.add_run(m.group(3))
-            run.font.bold = True
-            run.font.italic = base_italic
-        elif m.group(4):  # *italic*
-            run = paragraph.add_run(m.group(4))
-            run.font.bold = base_bold
-            run.font.italic = True
-        run.font.size = Pt(base_size)
-        if color:
-            run.font.color.rgb = color
-        last_end = m.end()
-    # Testo rimanente
-    if last_end < len(text):
-        run = paragraph.add_run(text[last_end:])
-        run.font.size = Pt(base_size)
-        run.font.bold = base_bold
-        run.font.italic = base_italic
-        if color:
-            run.font.color.rgb = color
-
-# Aggiunge una riga di testo al doc gestendo heading markdown e inline markdown
-def add_markdown_line(doc, line, indent=None, italic=False):
-    stripped = line.strip()
-    if not stripped:
-        return
-
-    # Heading 1: # testo
-    if re.match(r'^#{1}\s+', stripped) and not re.match(r'^#{2,}', stripped):
-        heading_text = re.sub(r'^#+\s+', '', stripped)
-        heading_text = latex_to_unicode(heading_text)
-        p = doc.add_heading(heading_text, level=1)
-        return
-
-    # Heading 2: ## testo
-    if re.match(r'^#{2}\s+', stripped) and not re.match(r'^#{3,}', stripped):
-        heading_text = re.sub(r'^#+\s+', '', stripped)
-        heading_text = latex_to_unicode(heading_text)
-        p = doc.add_heading(heading_text, level=2)
-        return
-
-    # Heading 3+: ### testo
-    if re.match(r'^#{3,}\s+', stripped):
-        heading_text = re.sub(r'^#+\s+', '', stripped)
-        heading_text = latex_to_unicode(heading_text)
-        p = doc.add_heading(heading_text, level=3)
-        return
-
-    # Punto elenco: "* testo" o "- testo" o "• testo"
-    bullet_match = re.match(r'^(\*|-|•)\s+(.+)$', stripped)
-    if bullet_match:
-        bullet_text = bullet_match.group(2)
-        p = doc.add_paragraph(style='List Bullet')
-        p.paragraph_format.space_before = Pt(2)
-        p.paragraph_format.space_after = Pt(2)
-        if indent:
-            p.paragraph_format.left_indent = indent
-        add_inline_markdown(p, bullet_text, base_size=11, base_italic=italic)
-        return p
-
-    # Punto elenco numerato: "1. testo" o "1) testo"
-    numbered_match = re.match(r'^\d+[.)]\s+(.+)$', stripped)
-    if numbered_match:
-        item_text = numbered_match.group(1)
-        p = doc.add_paragraph(style='List Number')
-        p.paragraph_format.space_before = Pt(2)
-        p.paragraph_format.space_after = Pt(2)
-        if indent:
-            p.paragraph_format.left_indent = indent
-        add_inline_markdown(p, item_text, base_size=11, base_italic=italic)
-        return p
-
-    # Paragrafo normale con inline markdown
-    p = doc.add_paragraph()
-    p.paragraph_format.space_before = Pt(3)
-    p.paragraph_format.space_after = Pt(3)
-    if indent:
-        p.paragraph_format.left_indent = indent
-    add_inline_markdown(p, stripped, base_size=11, base_italic=italic)
-    return p
-
-# Funzione per rilevare e parsare tabelle Markdown
-def is_markdown_table(line):
-    return line.strip().startswith('|') and line.strip().endswith('|')
-
-def parse_markdown_table(content):
+def uploaded_source():
     """
-    Rileva se il contenuto contiene tabelle Markdown e le парсит.
-    Restituisce una lista di dizionari: {'type': 'table', 'data': [...]}
-    oppure {'type': 'text', 'data': ...}
+    JSON della richiesta: il file del campo 'file' o un upload a blocchi completato
+    indicato da 'upload_id'. Restituisce (stream binario così come caricato, nome del file,
+    sha256 già verificato o None); ValueError se manca.
     """
-    if not content:
-        return [{'type': 'text', 'data': content}]
-    
-    lines = content.split('\n')
-    result = []
-    current_text_lines = []
-    i = 0
-    
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # Rileva inizio tabella Markdown
-        if is_markdown_table(line):
-            # Salva il testo accumulato prima della tabella
-            if current_text_lines:
-                text_block = '\n'.join(current_text_lines).strip()
-                if text_block:
-                    result.append({'type': 'text', 'data': text_block})
-                current_text_lines = []
-            
-            # Parsa la tabella
-            table_data = []
-            # Leggi le righe della tabella fino a quando ci sono righe che iniziano con |
-            while i < len(lines) and is_markdown_table(lines[i]):
-                row = [cell.strip() for cell in lines[i].strip().split('|')[1:-1]]  # Rimuovi primo e ultimo elemento vuoto
-                
-                # Salta la riga di separazione (---|---|)
-                if all(cell.strip() in ('', '-', ':', '---', ':--', '--:', ':-:', ':---', '---:', ':---:') for cell in row):
-                    i += 1
-                    continue
-                
-                if row:
-                    table_data.append(row)
-                i += 1
-            
-            if table_data:
-                result.append({'type': 'table', 'data': table_data})
-            
-            # Continua il ciclo senza incrementare i perché già fatto nel while
-            continue
-        else:
-            if line:  # Solo linee non vuote
-                current_text_lines.append(lines[i])
-            elif current_text_lines:
-                # Linea vuota: salva il testo accumulato
-                text_block = '\n'.join(current_text_lines).strip()
-                if text_block:
-                    result.append({'type': 'text', 'data': text_block})
-                current_text_lines = []
+    upload_id = request.form.get('upload_id', '').strip()
+    if upload_id:
+        upload = upload_store().get(upload_id)
+        stream = upload_store().open(upload_id)
+        if upload is None or stream is None:
+            raise ValueError('Upload non trovato, scaduto o non completato')
         
-        i += 1
+        @after_this_request
+        def close_upload(response):
+            stream.close()
+            return response
+        return stream, upload['filename'], upload['sha256']
     
-    # Salva eventuale testo rimanente
-    if current_text_lines:
-        text_block = '\n'.join(current_text_lines).strip()
-        if text_block:
-            result.append({'type': 'text', 'data': text_block})
-    
-    # Se non è stata trovata nessuna tabella, restituisci tutto come testo
-    if not any(block['type'] == 'table' for block in result):
-        return [{'type': 'text', 'data': content}]
-    
-    return result
+    if 'file' not in request.files:
+        raise ValueError('Nessun file caricato')
+    file = request.files['file']
+    if file.filename == '':
+        raise ValueError('Nessun file selezionato')
+    return file.stream, file.filename, None
 
-# Funzione per aggiungere una tabella al documento Word
-def add_table_to_doc(doc, table_data, style='Table Grid'):
-    if not table_data:
-        return
-    
-    # La prima riga è l'intestazione
-    headers = table_data[0]
-    rows = table_data[1:] if len(table_data) > 1 else []
-    
-    # Crea la tabella
-    num_rows = len(rows) + 1
-    num_cols = len(headers)
-    
-    table = doc.add_table(rows=num_rows, cols=num_cols)
-    table.style = style
-    
-    # Aggiungi l'intestazione
-    for col_idx, header in enumerate(headers):
-        cell = table.rows[0].cells[col_idx]
-        cell.text = header
-        # Formatta l'intestazione
-        for paragraph in cell.paragraphs:
-            for run in paragraph.runs:
-                run.font.bold = True
-                run.font.size = Pt(11)
-    
-    # Aggiungi le righe dati
-    for row_idx, row_data in enumerate(rows):
-        for col_idx, cell_data in enumerate(row_data):
-            if col_idx < num_cols:
-                cell = table.rows[row_idx + 1].cells[col_idx]
-                cell.text = cell_data
-                for paragraph in cell.paragraphs:
-                    for run in paragraph.runs:
-                        run.font.size = Pt(10)
-
-def convert_json_to_docx(json_data, doc, options, lang):
-    t = lambda k: get_text(k, lang)
-    
-    # Informazioni sulla conversazione
-    conv = json_data.get('conv', {})
-    
-    # Titolo del documento
-    title = doc.add_heading(t('doc_title'), 0)
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    
-    # Informazioni della conversazione
-    doc.add_paragraph()
-    p_info = doc.add_paragraph()
-    run = p_info.add_run(t('doc_info'))
-    run.bold = True
-    run.font.size = Pt(14)
-    
-    # Tabella metadati
-    table_meta = doc.add_table(rows=4, cols=2)
-    table_meta.style = 'Table Grid'
-    
-    meta_data = [
-        (t('conv_id'), conv.get('id', 'N/A')),
-        (t('conv_name'), conv.get('name', 'N/A')),
-        (t('conv_last_mod'), format_timestamp(conv.get('lastModified', 0))),
-        (t('conv_node'), conv.get('currNode', 'N/A')[:20] + '...' if len(conv.get('currNode', '')) > 20 else conv.get('currNode', 'N/A'))
-    ]
-    
-    for i, (label, value) in enumerate(meta_data):
-        row = table_meta.rows[i]
-        row.cells[0].text = label
-        row.cells[1].text = value
-        for cell in row.cells:
-            if cell.paragraphs and cell.paragraphs[0].runs:
-                cell.paragraphs[0].runs[0].font.bold = True
-
-    if options.get('show_divider'):
-        doc.add_paragraph()
-        doc.add_paragraph('━' * 60)
-        doc.add_paragraph()
-
-    # Processa i messaggi
-    messages = json_data.get('messages', [])
-    
-    # Determina nomi personalizzati o default
-    user_label = options.get('custom_user_name', '').strip() or t('default_user')
-    assistant_label = options.get('custom_assistant_name', '').strip() or t('default_assistant')
-
-    for idx, msg in enumerate(messages, 1):
-        role = msg.get('role', 'unknown')
-        content = msg.get('content', '')
-        msg_type = msg.get('type', 'text')
-        timestamp = msg.get('timestamp', 0)
-        
-        if not content and msg_type != 'text':
-            continue
-        
-        # Colori
-        if role == 'user':
-            role_display = user_label
-            role_color = RGBColor(33, 150, 243)
-        elif role == 'assistant':
-            role_display = assistant_label
-            role_color = RGBColor(76, 175, 80)
-        else:
-            role_display = f"📋 {role.upper()}"
-            role_color = RGBColor(158, 158, 158)
-        
-        # Intestazione del messaggio
-        doc.add_paragraph()
-        p = doc.add_paragraph()
-        
-        # Numero messaggio
-        if options.get('show_numbers'):
-            run_num = p.add_run(f"[{idx}] ")
-            run_num.font.size = Pt(10)
-            run_num.font.color.rgb = RGBColor(158, 158, 158)
-        
-        run_role = p.add_run(f"{role_display}")
-        run_role.font.size = Pt(12)
-        run_role.font.bold = True
-        run_role.font.color.rgb = role_color
-        
-        # Data e Ora
-        if options.get('show_date'):
-            run_time = p.add_run(f" • {format_timestamp(timestamp)}")
-            run_time.font.size = Pt(9)
-            run_time.font.color.rgb = RGBColor(158, 158, 158)
-        
-        # Modello AI
-        if options.get('show_model') and role == 'assistant' and msg.get('model'):
-            p_model = doc.add_paragraph()
-            run_model = p_model.add_run(f"   📡 {msg.get('model')}")
-            run_model.font.size = Pt(9)
-            run_model.font.italic = True
-            run_model.font.color.rgb = RGBColor(158, 158, 158)
-        
-        # Contenuto del messaggio
-        if content:
-            content_clean = content.replace('\\n', '\n').replace('\\t', '\t')
-            content_clean = clean_text(content_clean)
-            
-            # Parse del contenuto per rilevare tabelle
-            content_blocks = parse_markdown_table(content_clean)
-            
-            for block in content_blocks:
-                if block['type'] == 'table':
-                    # Aggiungi la tabella
-                    add_table_to_doc(doc, block['data'])
-                else:
-                    # Testo normale con supporto markdown
-                    for line in block['data'].split('\n'):
-                        if line.strip():
-                            add_markdown_line(doc, line)
-        
-        # Contenuto Extra
-        extra = msg.get('extra', [])
-        if extra:
-            doc.add_paragraph()
-            p_extra = doc.add_paragraph()
-            run_extra = p_extra.add_run(t('extra_content'))
-            run_extra.font.bold = True
-            run_extra.font.size = Pt(10)
-            
-            for item in extra:
-                if isinstance(item, dict):
-                    if item.get('type') == 'TEXT' and item.get('name') == 'Pasted':
-                        extra_content = item.get('content', '')
-                        if extra_content:
-                            extra_clean = extra_content.replace('\\n', '\n')
-                            extra_clean = clean_text(extra_clean)
-                            
-                            # Anche per l'extra content, rileva tabelle
-                            extra_blocks = parse_markdown_table(extra_clean)
-                            
-                            for block in extra_blocks:
-                                if block['type'] == 'table':
-                                    add_table_to_doc(doc, block['data'])
-                                else:
-                                    for line in block['data'].split('\n'):
-                                        if line.strip():
-                                            add_markdown_line(doc, line, indent=Inches(0.3), italic=True)
-        
-        # Dati Prompt (Timing)
-        if options.get('show_prompt'):
-            timings = msg.get('timings', {})
-            if timings and role == 'assistant':
-                p_timing = doc.add_paragraph()
-                run_timing = p_timing.add_run("⏱️ ")
-                run_timing.font.size = Pt(9)
-                
-                timing_text = f"Prompt: {timings.get('prompt_n', 'N/A')} token ({timings.get('prompt_ms', 0):.1f}ms) | "
-                timing_text += f"Output: {timings.get('predicted_n', 'N/A')} token ({timings.get('predicted_ms', 0):.1f}ms)"
-                
-                run_timing_val = p_timing.add_run(timing_text)
-                run_timing_val.font.size = Pt(9)
-                run_timing_val.font.color.rgb = RGBColor(158, 158, 158)
-        
-        # Separatore finale
-        if options.get('show_divider'):
-            doc.add_paragraph()
-            p_sep = doc.add_paragraph('─' * 60)
-            p_sep.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-def process_json(json_file_path, options, lang):
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    doc = Document()
-    
-    for section in doc.sections:
-        section.top_margin = Inches(1)
-        section.bottom_margin = Inches(1)
-        section.left_margin = Inches(1)
-        section.right_margin = Inches(1)
-    
-    convert_json_to_docx(data, doc, options, lang)
-    
-    doc.add_paragraph()
-    if options.get('show_divider'):
-        doc.add_paragraph('━' * 60)
-    p_footnote = doc.add_paragraph()
-    run_footnote = p_footnote.add_run("📄 " + get_text('generated_at', lang))
-    run_footnote.font.size = Pt(9)
-    run_footnote.font.italic = True
-    run_footnote.font.color.rgb = RGBColor(158, 158, 158)
-    
-    return doc
+def json_source(stream, filename):
+    # JSON decompresso al volo se l'upload è compresso
+    return open_upload(stream, filename, app.config['DECOMPRESSED_MAX_BYTES'])
 
 @app.route('/')
 def index():
     # Passa le lingue disponibili al template
     return render_template('index.html', languages=TRANSLATIONS.keys())
 
+# Estrai opzioni dal form (condivise da /convert e /convert/batch)
+def parse_options(form):
+    options = {
+        'show_date': form.get('show_date') == 'on',
+        'show_divider': form.get('show_divider') == 'on',
+        'show_model': form.get('show_model') == 'on',
+        'show_prompt': form.get('show_prompt') == 'on',
+        'show_numbers': form.get('show_numbers') == 'on',
+        'custom_user_name': form.get('custom_user_name', ''),
+        'custom_assistant_name': form.get('custom_assistant_name', ''),
+        'backend': form.get('backend', 'docx'),
+        'reasoning': form.get('reasoning', 'discard'),
+        # 'active', 'all' o l'id dell'ultimo messaggio del ramo da esportare
+        'branch': form.get('branch', '').strip() or ACTIVE,
+        # Negli export con più conversazioni: id o parti del nome separati da virgole
+        'conversations': form.get('conversations', '').strip()
+    }
+    if options['backend'] not in BACKENDS:
+        options['backend'] = 'docx'
+    if options['reasoning'] not in REASONING_MODES:
+        options['reasoning'] = 'discard'
+    return options
+
 @app.route('/convert', methods=['POST'])
 def convert():
     try:
-        if 'file' not in request.files:
-            flash('❌ Nessun file caricato', 'error')
-            return redirect(url_for('index'))
-        
-        file = request.files['file']
-        
-        if file.filename == '':
-            flash('❌ Nessun file selezionato', 'error')
+        try:
+            stream, filename, digest = uploaded_source()
+        except ValueError as e:
+            flash(f'❌ {e}', 'error')
             return redirect(url_for('index'))
         
-        if file and allowed_file(file.filename):
-            # Estrai opzioni
-            options = {
-                'show_date': request.form.get('show_date') == 'on',
-                'show_divider': request.form.get('show_divider') == 'on',
-                'show_model': request.form.get('show_model') == 'on',
-                'show_prompt': request.form.get('show_prompt') == 'on',
-                'show_numbers': request.form.get('show_numbers') == 'on',
-                'custom_user_name': request.form.get('custom_user_name', ''),
-                'custom_assistant_name': request.form.get('custom_assistant_name', '')
-            }
+        if allowed_file(filename):
+            options = parse_options(request.form)
             lang = request.form.get('language', 'it')
             
-            filename = f"input_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            output_filename = f"conversazione_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
             
-            try:
-                doc = process_json(filepath, options, lang)
-                
-                output_filename = f"conversazione_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
-                output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-                
-                doc.save(output_path)
-                
-                flash('✅ Conversione completata con successo!', 'success')
-                
-                return send_file(
-                    output_path,
-                    as_attachment=True,
-                    download_name=output_filename,
-                    mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-                )
+            # Modalità asincrona: il job viene accodato e si risponde subito con il suo id
+            if request.form.get('async') == 'on' or request.args.get('async') == '1':
+                job_id = job_manager().submit(stream, options, lang, output_filename, filename)
+                status_url = url_for('job_status', job_id=job_id)
+                return jsonify(job_payload(job_manager().get(job_id))), 202, {'Location': status_url}
+            
+            # Con le metriche disattivate i punti di misura del convertitore non fanno nulla
+            recorder = metrics.Recorder() if app.config['METRICS_ENABLED'] else None
+            with metrics.recording(recorder):
+                # Stesso file, stesse opzioni e stessa lingua: il documento è già pronto
+                cache = conversion_cache()
+                with metrics.stage('hash'):
+                    key = cache_key(digest or hash_stream(stream), options, lang)
+                cached = cache.get(key)
                 
-            except Exception as e:
-                flash(f'❌ Errore durante l\'elaborazione: {str(e)}', 'error')
-                return redirect(url_for('index'))
+                if cached is not None:
+                    output = io.BytesIO(cached)
+                    size = len(cached)
+                else:
+                    # Il JSON si legge direttamente dallo stream dell'upload e il .docx
+                    # si scrive in un buffer in memoria: nessun file temporaneo con nome
+                    source = json_source(stream, filename)
+                    output = spooled_buffer()
+                    try:
+                        # La conversione parte solo se la sua memoria stimata rientra nel budget
+                        with metrics.stage('admission'):
+                            cost = conversion_cost(*measure_input(source), options['backend'])
+                        with admission_controller().admit(cost):
+                            write_docx(source, output, options, lang, fragment_cache(), render_executor())
+                        size = output.tell()
+                        with metrics.stage('cache'):
+                            cache.put(key, output)
+                    except Overloaded as e:
+                        output.close()
+                        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+                    except Exception as e:
+                        output.close()
+                        flash(f'❌ Errore durante l\'elaborazione: {str(e)}', 'error')
+                        return redirect(url_for('index'))
             
-            finally:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+            flash('✅ Conversione completata con successo!', 'success')
+            
+            # Il buffer viene chiuso (ed eventualmente eliminato) al termine della risposta
+            response = send_file(
+                output,
+                as_attachment=True,
+                download_name=output_filename,
+                mimetype=DOCX_MIMETYPE
+            )
+            response.content_length = size
+            response.headers['X-Cache'] = 'HIT' if cached is not None else 'MISS'
+            if recorder is not None:
+                response.headers['Server-Timing'] = recorder.server_timing()
+                metrics_registry().observe(recorder, options['backend'], 'hit' if cached is not None else 'miss')
+            return response
         else:
             flash('❌ Formato file non consentito.', 'error')
             return redirect(url_for('index'))
@@ -582,6 +281,204 @@ def convert():
         flash(f'❌ Errore: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+@app.route('/convert/batch', methods=['POST'])
+def convert_batch():
+    """
+    Più file JSON (campo 'files', ripetibile) e/o archivi ZIP di .json in ingresso;
+    in uscita uno ZIP con un .docx per file e manifest.json con l'esito di ciascuno.
+    """
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    if not uploads:
+        return jsonify({'error': 'Nessun file caricato'}), 400
+    
+    options = parse_options(request.form)
+    lang = request.form.get('language', 'it')
+    
+    batch = Batch(app.config['BATCH_MAX_FILES'], options['conversations'], app.config['DECOMPRESSED_MAX_BYTES'])
+    try:
+        for upload in uploads:
+            batch.add_upload(upload.filename, upload.stream)
+    except ValueError as e:
+        batch.cleanup()
+        return jsonify({'error': str(e)}), 400
+    except Exception:
+        # Nessuna risposta da cui pulire alla chiusura: la cartella del batch va rimossa qui
+        batch.cleanup()
+        raise
+    
+    archive_name = f"conversazioni_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    # Lo ZIP viene inviato man mano che i documenti sono pronti
+    response = Response(
+        stream_zip(batch, job_manager().executor(), options, lang),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={archive_name}'}
+    )
+    # Pulizia anche se il client chiude prima che lo ZIP sia iniziato
+    response.call_on_close(batch.cleanup)
+    return response
+
+def job_payload(job):
+    payload = {
+        'id': job['id'],
+        'status': job['status'],
+        'done': job['done'],
+        'total': job['total'],
+        'status_url': url_for('job_status', job_id=job['id']),
+    }
+    if job['total']:
+        payload['progress'] = round(job['done'] / job['total'], 3)
+    if job['status'] == DONE:
+        payload['result_url'] = url_for('job_result', job_id=job['id'])
+    if job['status'] == FAILED:
+        payload['error'] = job['error']
+    return payload
+
+@app.route('/jobs')
+def jobs_stats():
+    return jsonify(job_manager().stats())
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job non trovato o scaduto'}), 404
+    return jsonify(job_payload(job))
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job non trovato o scaduto'}), 404
+    if job['status'] == FAILED:
+        return jsonify(job_payload(job)), 500
+    if job['status'] != DONE:
+        # Risultato non ancora pronto: il client continua a interrogare lo stato
+        return jsonify(job_payload(job)), 409
+    return send_file(
+        job['result_path'],
+        as_attachment=True,
+        download_name=job['download_name'],
+        mimetype=DOCX_MIMETYPE
+    )
+
+@app.route('/preview', methods=['POST'])
+def preview():
+    """
+    Anteprima HTML di una pagina di messaggi (offset, limit) con le opzioni del form.
+    I modelli dei messaggi restano nella cache dei frammenti: la conversione successiva
+    dello stesso file non rianalizza markdown, tabelle e LaTeX di quei messaggi.
+    """
+    try:
+        stream, filename, _ = uploaded_source()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        offset = max(int(request.values.get('offset', 0)), 0)
+        limit = min(max(int(request.values.get('limit', PREVIEW_MESSAGES)), 1), PREVIEW_MAX_MESSAGES)
+    except ValueError:
+        return jsonify({'error': 'offset e limit devono essere numeri interi'}), 400
+    options = parse_options(request.form)
+    lang = request.form.get('language', 'it')
+    
+    recorder = metrics.Recorder() if app.config['METRICS_ENABLED'] else None
+    try:
+        with metrics.recording(recorder), metrics.stage('preview'):
+            html, next_offset = render_preview(json_source(stream, filename), options, lang, offset, limit,
+                                               fragment_cache())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response = Response(html, mimetype='text/html')
+    if next_offset is not None:
+        response.headers['X-Preview-Next-Offset'] = str(next_offset)
+    if recorder is not None:
+        response.headers['Server-Timing'] = recorder.server_timing()
+    return response
+
+@app.route('/conversations', methods=['POST'])
+def list_conversations():
+    """
+    Indice di un export: id, nome, numero di messaggi e intervallo di byte di ogni
+    conversazione, senza decodificare i messaggi. Un export singolo ha una sola voce.
+    """
+    try:
+        stream, filename, _ = uploaded_source()
+        source = json_source(stream, filename)
+        if not is_multi_conversation(source):
+            return jsonify({'multi': False, 'conversations': []})
+        return jsonify({'multi': True, 'conversations': index_conversations(source)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+def upload_payload(upload):
+    payload = dict(upload)
+    payload['upload_url'] = url_for('upload_chunk', upload_id=upload['id'])
+    payload['chunk_size'] = UPLOAD_CHUNK_BYTES
+    return payload
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    Avvia un upload a blocchi: filename, size (byte) e sha256 del file, in JSON o nel form.
+    I blocchi si inviano poi con PUT /uploads/<id>?offset=N; il file completo e verificato
+    si converte passando upload_id a /convert (o a /preview) al posto di file.
+    """
+    fields = request.get_json(silent=True) or request.form
+    try:
+        upload = upload_store().create(fields.get('filename', ''), int(fields.get('size', -1)), fields.get('sha256'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    status_url = url_for('upload_status', upload_id=upload['id'])
+    return jsonify(upload_payload(upload)), 201, {'Location': status_url}
+
+@app.route('/uploads/<upload_id>')
+def upload_status(upload_id):
+    """Stato dell'upload: dopo un'interruzione si riprende dalla posizione 'received'."""
+    upload = upload_store().get(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload non trovato o scaduto'}), 404
+    return jsonify(upload_payload(upload))
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    Un blocco del file nel corpo della richiesta, alla posizione offset. L'header opzionale
+    X-Chunk-SHA256 fa verificare il blocco prima di scriverlo.
+    """
+    try:
+        offset = int(request.args.get('offset', -1))
+        upload = upload_store().append(upload_id, offset, request.stream, request.headers.get('X-Chunk-SHA256'))
+    except KeyError:
+        return jsonify({'error': 'Upload non trovato o scaduto'}), 404
+    except ChunkOffsetError as e:
+        # Il client riprende dalla posizione indicata
+        return jsonify({'error': str(e), 'received': e.received}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(upload_payload(upload))
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    if not upload_store().discard(upload_id):
+        return jsonify({'error': 'Upload non trovato o scaduto'}), 404
+    return '', 204
+
+@app.route('/admission')
+def admission_stats():
+    """Memoria stimata delle conversioni in corso, profondità della coda e contatori."""
+    return jsonify(admission_controller().stats())
+
+@app.route('/cache/stats')
+def cache_stats():
+    stats = conversion_cache().stats()
+    stats['fragments'] = fragment_cache().stats()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Istogrammi delle fasi e contatori delle conversioni nel formato testuale di Prometheus."""
+    return Response(metrics_registry().render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/sample')
 def download_sample():
     sample_json = {
@@ -611,12 +508,10 @@ def download_sample():
         ]
     }
     
-    sample_path = os.path.join(app.config['UPLOAD_FOLDER'], 'sample_conversation.json')
-    with open(sample_path, 'w', encoding='utf-8') as f:
-        json.dump(sample_json, f, indent=2, ensure_ascii=False)
+    sample_data = json.dumps(sample_json, indent=2, ensure_ascii=False).encode('utf-8')
     
     return send_file(
-        sample_path,
+        io.BytesIO(sample_data),
         as_attachment=True,
         download_name='sample_conversation.json',
         mimetype='application/json'
@@ -0,0 +1,296 @@
+import os
+import re
+import json
+import lzma
+import time
+import zlib
+import shutil
+import zipfile
+import tempfile
+import posixpath
+from concurrent.futures import as_completed
+
+from converter import iter_conversations, write_conversations
+from json_stream import (conversation_slice, index_conversations, is_multi_conversation, load_conversation,
+                         select_conversations)
+from uploads import DECOMPRESSED_MAX_BYTES, is_json_upload, json_name, open_upload
+
+# Numero massimo di file JSON accettati in un batch (upload multipli o membri dello ZIP)
+BATCH_MAX_FILES = 1000
+
+# Blocchi copiati nello ZIP di uscita tra un invio al client e il successivo
+COPY_CHUNK_SIZE = 1024 * 1024
+
+MANIFEST_NAME = 'manifest.json'
+
+# Errori di estrazione di un singolo membro dello ZIP: dati compressi danneggiati o troncati,
+# membri cifrati (RuntimeError) o con un metodo di compressione non supportato
+_MEMBER_ERRORS = (ValueError, zipfile.BadZipFile, zlib.error, lzma.LZMAError, OSError, EOFError,
+                  RuntimeError, NotImplementedError)
+
+
+def convert_file(input_path, output_path, options, lang, executor=None, entry=None):
+    """
+    Eseguita nel processo worker: converte un file e restituisce la durata
+    in secondi e il numero di messaggi letti. Con executor i messaggi vengono
+    renderizzati in parallelo sul pool (solo dal processo principale). Con entry
+    (una voce di index_conversations) si converte solo quella conversazione
+    di un export multiplo.
+    """
+    start = time.perf_counter()
+    counted = [0]
+
+    def counting(messages):
+        for msg in messages:
+            counted[0] += 1
+            yield msg
+
+    with open(input_path, 'rb') as raw, open(output_path, 'wb') as out:
+        f = open_upload(raw, input_path)
+        if entry is not None:
+            conversations = [load_conversation(conversation_slice(f, entry))]
+        else:
+            conversations = iter_conversations(f, options)
+        conversations = (dict(data, messages=counting(data['messages'])) for data in conversations)
+        write_conversations(conversations, out, options, lang, executor=executor)
+    return time.perf_counter() - start, counted[0]
+
+
+def _output_name(input_name, used):
+    # Stesso percorso relativo dell'input con estensione .docx, senza duplicati nello ZIP
+    base = posixpath.splitext(input_name)[0]
+    name = base + '.docx'
+    counter = 2
+    while name in used:
+        name = f"{base}_{counter}.docx"
+        counter += 1
+    used.add(name)
+    return name
+
+
+_UNSAFE_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+# Lunghezza massima del nome della conversazione usato come nome di file
+MAX_NAME_LENGTH = 80
+
+
+def conversation_file_stem(entry):
+    """Nome di file (senza estensione) per una conversazione di un export multiplo."""
+    name = _UNSAFE_FILENAME_CHARS.sub('_', entry['name'] or '').strip(' ._')[:MAX_NAME_LENGTH]
+    return f"{entry['index'] + 1:03d}_{name or entry['id'] or 'conversazione'}"
+
+
+def _copy_limited(src, dst, limit):
+    """Copia src in dst; ValueError appena i byte letti superano limit."""
+    copied = 0
+    for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+        copied += len(chunk)
+        if copied > limit:
+            raise ValueError(f"Il file estratto supera il limite di {limit} byte")
+        dst.write(chunk)
+    return copied
+
+
+def _safe_member_name(name):
+    # Percorso relativo normalizzato: niente percorsi assoluti o risalite con ..
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return '/'.join(parts)
+
+
+class Batch:
+    """
+    Insieme di file JSON da convertire, copiati in una cartella temporanea propria.
+    Gli input possono essere file singoli o archivi ZIP di .json. Ogni conversazione
+    scelta da un export multiplo diventa un documento separato. max_size limita i byte
+    decompressi di ogni file e quelli estratti da ogni archivio ZIP (protezione dalle "zip bomb").
+    """
+
+    def __init__(self, max_files=BATCH_MAX_FILES, selection=None, max_size=DECOMPRESSED_MAX_BYTES):
+        self.max_files = max_files
+        self.max_size = max_size
+        # Conversazioni da estrarre dagli export multipli (vedi select_conversations)
+        self.selection = selection
+        self.dir = tempfile.mkdtemp(prefix='json2docx-batch-')
+        self.inputs = []
+        self.errors = []
+        self._used_names = set()
+
+    def _new_input(self, name, output_name=None, input_path=None, conversation=None):
+        if len(self.inputs) >= self.max_files:
+            raise ValueError(f"Troppi file nel batch (massimo {self.max_files})")
+        index = len(self.inputs)
+        entry = {
+            'input': name,
+            'output': _output_name(output_name or name, self._used_names),
+            'input_path': input_path or os.path.join(self.dir, f'{index}.json'),
+            'output_path': os.path.join(self.dir, f'{index}.docx'),
+            'conversation': conversation,
+        }
+        self.inputs.append(entry)
+        return entry
+
+    def _reject(self, entry, name, error):
+        # Solo questo file viene segnalato nel manifest; il resto del batch prosegue
+        self.inputs.remove(entry)
+        self._used_names.discard(entry['output'])
+        try:
+            os.remove(entry['input_path'])
+        except FileNotFoundError:
+            # Membro dello ZIP che non è stato possibile aprire: il file non è mai stato creato
+            pass
+        self.errors.append({'input': name, 'status': 'error', 'error': str(error)})
+
+    def _split_if_multi(self, entry):
+        # Un export multiplo viene sostituito da una voce per ogni conversazione scelta,
+        # tutte lette dallo stesso file tramite il proprio intervallo di byte
+        with open(entry['input_path'], 'rb') as f:
+            if not is_multi_conversation(f):
+                return
+            try:
+                conversations = select_conversations(index_conversations(f), self.selection)
+            except ValueError as e:
+                # Export multiplo danneggiato (ad esempio un 'conv' non valido): solo nel manifest
+                error = e
+            else:
+                error = None
+        if error is not None:
+            self._reject(entry, entry['input'], error)
+            return
+        self.inputs.remove(entry)
+        self._used_names.discard(entry['output'])
+        base = posixpath.splitext(entry['input'])[0]
+        for conversation in conversations:
+            name = f"{entry['input']}#{conversation['id'] or conversation['index']}"
+            output_name = f"{base}/{conversation_file_stem(conversation)}.json"
+            self._new_input(name, output_name, entry['input_path'], conversation)
+        if not conversations:
+            os.remove(entry['input_path'])
+            self.errors.append({'input': entry['input'], 'status': 'error',
+                                'error': 'Nessuna conversazione corrisponde alla selezione'})
+
+    def add_upload(self, filename, stream):
+        """Aggiunge un upload: un .json (anche compresso) o uno .zip da cui estrarre i .json."""
+        name = _safe_member_name(os.path.basename(filename or ''))
+        lower = name.lower()
+        if lower.endswith('.zip'):
+            self._add_zip(name, stream)
+        elif is_json_upload(name):
+            entry = self._new_input(json_name(name))
+            try:
+                with open(entry['input_path'], 'wb') as f:
+                    shutil.copyfileobj(open_upload(stream, name, self.max_size), f)
+            except ValueError as e:
+                # Compressione non valida o JSON decompresso oltre max_size
+                self._reject(entry, name, e)
+                return
+            self._split_if_multi(entry)
+        else:
+            self.errors.append({'input': name, 'status': 'error', 'error': 'Formato file non consentito'})
+
+    def _add_zip(self, name, stream):
+        try:
+            archive = zipfile.ZipFile(stream)
+        except zipfile.BadZipFile:
+            self.errors.append({'input': name, 'status': 'error', 'error': 'Archivio ZIP non valido'})
+            return
+        # Byte ancora estraibili dall'archivio: la dimensione dichiarata nello ZIP non è
+        # affidabile, quindi il limite si verifica sui byte effettivamente estratti
+        remaining = self.max_size
+        with archive:
+            for info in archive.infolist():
+                member = _safe_member_name(info.filename)
+                if info.is_dir() or not member.lower().endswith('.json') or member.startswith('__MACOSX/'):
+                    continue
+                entry = self._new_input(member)
+                try:
+                    with archive.open(info) as src, open(entry['input_path'], 'wb') as dst:
+                        remaining -= _copy_limited(src, dst, remaining)
+                except _MEMBER_ERRORS as e:
+                    if isinstance(e, ValueError) and remaining < self.max_size:
+                        e = f"I file estratti dall'archivio superano il limite di {self.max_size} byte"
+                    self._reject(entry, f"{name}/{member}", e)
+                    continue
+                self._split_if_multi(entry)
+
+    def run(self, executor, options, lang):
+        """Distribuisce le conversioni sul pool e restituisce le voci man mano che terminano."""
+        futures = {
+            executor.submit(convert_file, entry['input_path'], entry['output_path'], options, lang,
+                            entry=entry['conversation']): entry
+            for entry in self.inputs
+        }
+        # Un export multiplo va eliminato solo dopo l'ultima delle sue conversazioni
+        readers = {}
+        for entry in self.inputs:
+            readers[entry['input_path']] = readers.get(entry['input_path'], 0) + 1
+        for future in as_completed(futures):
+            entry = futures[future]
+            error = future.exception()
+            if error is None:
+                seconds, messages = future.result()
+                entry['status'] = 'ok'
+                entry['seconds'] = round(seconds, 3)
+                entry['messages'] = messages
+            else:
+                entry['status'] = 'error'
+                entry['error'] = str(error)
+            readers[entry['input_path']] -= 1
+            if not readers[entry['input_path']]:
+                os.remove(entry['input_path'])
+            yield entry
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class _ChunkBuffer:
+    # Destinazione non posizionabile per zipfile: accumula i byte fino al prossimo invio
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(batch, executor, options, lang):
+    """
+    Genera lo ZIP dei documenti convertiti a blocchi, aggiungendo ogni .docx appena
+    pronto. manifest.json in coda riporta esito, errori e durata di ogni file.
+    """
+    buffer = _ChunkBuffer()
+    manifest = list(batch.errors)
+    try:
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            for entry in batch.run(executor, options, lang):
+                if entry['status'] == 'ok':
+                    # Il .docx è già compresso: viene archiviato senza ricomprimerlo
+                    info = zipfile.ZipInfo(entry['output'], date_time=time.localtime()[:6])
+                    info.file_size = os.path.getsize(entry['output_path'])
+                    with open(entry['output_path'], 'rb') as src, archive.open(info, 'w') as dst:
+                        for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+                            dst.write(chunk)
+                            yield buffer.take()
+                    os.remove(entry['output_path'])
+                    manifest.append({'input': entry['input'], 'output': entry['output'], 'status': 'ok',
+                                     'messages': entry['messages'], 'seconds': entry['seconds']})
+                else:
+                    manifest.append({'input': entry['input'], 'status': 'error', 'error': entry['error']})
+                yield buffer.take()
+            summary = {
+                'files': manifest,
+                'converted': sum(1 for item in manifest if item['status'] == 'ok'),
+                'failed': sum(1 for item in manifest if item['status'] == 'error'),
+            }
+            archive.writestr(MANIFEST_NAME, json.dumps(summary, indent=2, ensure_ascii=False))
+        yield buffer.take()
+    finally:
+        batch.cleanup()
@@ -0,0 +1,61 @@
+"""
+Controllo di ammissione: memoria di picco (RSS) misurata per conversione, in un processo
+separato per ciascuna, rispetto alla stima di admission.conversion_cost, per backend e
+forma dell'input. La stima deve restare sopra la misura senza sovrastimarla di molto.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_admission [--shapes 500x1500,2000x1500,2000x6000,8000x300]
+"""
+import io
+import os
+import sys
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import converter
+from admission import conversion_cost, measure_input
+from benchmarks.bench_document import OPTIONS
+from benchmarks.synthetic import write_conversation
+
+
+def _peak_rss(path, backend):
+    """Crescita della memoria di picco (byte) durante la conversione, misurata nel processo figlio."""
+    converter.preload()
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    buf = io.BytesIO()
+    converter.write_docx(path, buf, dict(OPTIONS, backend=backend), 'en')
+    # ru_maxrss è in KiB su Linux; il .docx in memoria non fa parte della conversione
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) * 1024 - len(buf.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shapes', default='500x1500,2000x1500,2000x6000,8000x300',
+                        help="conversazioni da misurare, come messaggi x byte per messaggio")
+    parser.add_argument('--measure', nargs=2, metavar=('PATH', 'BACKEND'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(_peak_rss(*args.measure))
+        return
+
+    print(f"{'messaggi':>8} {'input MB':>9} {'backend':>8} {'misurata MB':>12} {'stimata MB':>11} {'stima/misura':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for shape in args.shapes.split(','):
+            messages, size = (int(value) for value in shape.split('x'))
+            path = write_conversation(os.path.join(tmp, f'corpus_{shape}.json'), messages, size)
+            with open(path, 'rb') as f:
+                input_bytes, counted = measure_input(f)
+            for backend in converter.BACKENDS:
+                out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_admission', '--measure', path, backend],
+                                     capture_output=True, text=True, check=True)
+                peak = int(out.stdout.strip())
+                estimate = conversion_cost(input_bytes, counted, backend)
+                print(f"{counted:>8} {input_bytes / 2**20:>9.1f} {backend:>8} {peak / 2**20:>12.1f} "
+                      f"{estimate / 2**20:>11.1f} {estimate / max(peak, 1):>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Confronto tra i backend di rendering (python-docx e scrittura diretta in streaming):
+tempo totale e picco di memoria al crescere del numero di messaggi.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_backends [--sizes 500,2000,8000] [--message-size 1500]
+"""
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import converter
+from benchmarks.bench_document import OPTIONS
+from benchmarks.synthetic import write_conversation
+
+
+def _measure(path, out_path, backend):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with open(out_path, 'wb') as out:
+            converter.write_docx(path, out, dict(OPTIONS, backend=backend), 'en')
+        return time.perf_counter() - start, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='500,2000,8000', help="numero di messaggi per ciascun file")
+    parser.add_argument('--message-size', type=int, default=1500, help="caratteri per messaggio")
+    args = parser.parse_args()
+
+    # Il template del backend stream si prepara una volta per processo: escluso dalle misure
+    converter.stream_template()
+
+    print(f"{'messaggi':>9} {'backend':>8} {'tempo s':>8} {'picco MB':>9} {'docx MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (int(s) for s in args.sizes.split(',')):
+            path = write_conversation(os.path.join(tmp, f'conv_{n}.json'), n, args.message_size)
+            for backend in converter.BACKENDS:
+                out_path = os.path.join(tmp, f'conv_{n}_{backend}.docx')
+                elapsed, peak = _measure(path, out_path, backend)
+                size = os.path.getsize(out_path) / 2**20
+                print(f"{n:>9} {backend:>8} {elapsed:>8.2f} {peak / 2**20:>9.1f} {size:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
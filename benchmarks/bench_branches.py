@@ -0,0 +1,48 @@
+"""
+Export del solo ramo attivo contro tutti i rami su una conversazione con risposte
+rigenerate: tempo di conversione e dimensione del .docx per entrambi i backend.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_branches [--messages 1000] [--message-size 1500] [--regenerations 5]
+"""
+import io
+import os
+import time
+import argparse
+import tempfile
+
+import converter
+from branches import ACTIVE, ALL
+from benchmarks.bench_document import OPTIONS
+from benchmarks.synthetic import write_conversation
+
+
+def _convert(path, backend, branch):
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    converter.write_docx(path, buf, dict(OPTIONS, backend=backend, branch=branch), 'en')
+    return time.perf_counter() - start, len(buf.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000, help="messaggi nel ramo attivo")
+    parser.add_argument('--message-size', type=int, default=1500)
+    parser.add_argument('--regenerations', type=int, default=5, help="versioni scartate per ogni risposta")
+    args = parser.parse_args()
+
+    converter.preload()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_conversation(os.path.join(tmp, 'corpus.json'), args.messages, args.message_size,
+                                  regenerations=args.regenerations)
+        print(f"input: {os.path.getsize(path) / 2**20:.1f} MB, {args.messages} messaggi attivi, "
+              f"{args.regenerations} rigenerazioni per risposta")
+        print(f"{'backend':>8} {'ramo':>7} {'tempo s':>8} {'docx MB':>8}")
+        for backend in converter.BACKENDS:
+            for branch in (ALL, ACTIVE):
+                seconds, size = _convert(path, backend, branch)
+                print(f"{backend:>8} {branch:>7} {seconds:>8.2f} {size / 2**20:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Conversione completa di un corpus di riferimento: tempo di rendering e di salvataggio,
+dimensione di word/document.xml e del .docx risultante.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_document [--messages 2000] [--message-size 1500]
+"""
+import io
+import os
+import time
+import zipfile
+import argparse
+import tempfile
+
+import converter
+from benchmarks.synthetic import write_conversation
+
+OPTIONS = {
+    'show_date': True, 'show_divider': True, 'show_model': True, 'show_prompt': True,
+    'show_numbers': True, 'custom_user_name': '', 'custom_assistant_name': '',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--message-size', type=int, default=1500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_conversation(os.path.join(tmp, 'corpus.json'), args.messages, args.message_size)
+        start = time.perf_counter()
+        doc = converter.process_json(path, OPTIONS, 'en')
+        render = time.perf_counter() - start
+        buf = io.BytesIO()
+        start = time.perf_counter()
+        doc.save(buf)
+        save = time.perf_counter() - start
+
+    document_xml = zipfile.ZipFile(buf).getinfo('word/document.xml').file_size
+    print(f"messaggi:          {args.messages}")
+    print(f"rendering:         {render:.2f} s")
+    print(f"salvataggio:       {save:.2f} s")
+    print(f"document.xml:      {document_xml / 2**20:.1f} MB")
+    print(f"docx:              {len(buf.getvalue()) / 2**20:.2f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Immagini allegate ripetute: conversazione in cui ogni domanda rimanda uno screenshot scelto
+tra --unique immagini, confrontata con la stessa conversazione in cui gli screenshot sono
+tutti diversi. Con la deduplicazione dimensione del .docx e tempo di salvataggio seguono
+il numero di immagini distinte, non quello degli allegati.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_images [--messages 100] [--unique 3] [--width 640] [--height 400]
+"""
+import io
+import os
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import zipfile
+import argparse
+import tempfile
+
+import converter
+from benchmarks.bench_document import OPTIONS
+
+
+def make_png(width, height, seed):
+    """PNG RGB di rumore casuale: non si comprime, come uno screenshot fotografico."""
+    rng = random.Random(seed)
+    raw = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b'')
+
+
+def write_image_conversation(path, n_messages, images):
+    """Conversazione di n_messages messaggi; la domanda i allega images[i % len(images)]."""
+    urls = ['data:image/png;base64,' + base64.b64encode(png).decode('ascii') for png in images]
+    messages = []
+    for i in range(n_messages):
+        msg = {'id': str(i), 'role': 'user' if i % 2 == 0 else 'assistant', 'type': 'text',
+               'timestamp': 1700000000000 + i * 1000, 'content': f"Messaggio {i}: cosa vedi?"}
+        if i % 2 == 0:
+            msg['extra'] = [{'type': 'IMAGE', 'name': f'screenshot-{i}.png', 'base64Url': urls[(i // 2) % len(urls)]}]
+        messages.append(msg)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'conv': {'id': 'bench', 'name': 'Immagini'}, 'messages': messages}, f)
+    return path
+
+
+def _convert(path, backend):
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    converter.write_docx(path, buf, dict(OPTIONS, backend=backend), 'en')
+    elapsed = time.perf_counter() - start
+    with zipfile.ZipFile(buf) as package:
+        media = sum(1 for name in package.namelist() if name.startswith('word/media/'))
+    return elapsed, len(buf.getvalue()), media
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--unique', type=int, default=3, help="screenshot distinti nella conversazione ripetuta")
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=400)
+    args = parser.parse_args()
+
+    converter.preload()
+    attachments = (args.messages + 1) // 2
+    with tempfile.TemporaryDirectory() as tmp:
+        corpora = {
+            'ripetute': [make_png(args.width, args.height, seed) for seed in range(args.unique)],
+            'distinte': [make_png(args.width, args.height, seed) for seed in range(attachments)],
+        }
+        print(f"{attachments} allegati da {len(corpora['ripetute'][0]) / 2**20:.2f} MB")
+        print(f"{'immagini':>9} {'JSON MB':>8} {'backend':>8} {'tempo s':>8} {'docx MB':>8} {'parti':>6}")
+        for label, images in corpora.items():
+            path = write_image_conversation(os.path.join(tmp, f'{label}.json'), args.messages, images)
+            size = os.path.getsize(path) / 2**20
+            for backend in converter.BACKENDS:
+                elapsed, output, media = _convert(path, backend)
+                print(f"{label:>9} {size:>8.1f} {backend:>8} {elapsed:>8.2f} {output / 2**20:>8.2f} {media:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Riesportazione incrementale: la stessa conversazione viene convertita di nuovo dopo
+l'aggiunta di nuovi messaggi, riusando i frammenti già renderizzati (FragmentCache).
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_incremental [--messages 2000] [--new 200] [--message-size 1500]
+"""
+import io
+import os
+import time
+import argparse
+import tempfile
+
+import converter
+from cache import FragmentCache
+from benchmarks.bench_document import OPTIONS
+from benchmarks.synthetic import write_conversation
+
+
+def _convert(path, backend, fragments=None):
+    start = time.perf_counter()
+    converter.write_docx(path, io.BytesIO(), dict(OPTIONS, backend=backend), 'en', fragments)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000, help="messaggi del primo export")
+    parser.add_argument('--new', type=int, default=200, help="messaggi aggiunti prima del secondo export")
+    parser.add_argument('--message-size', type=int, default=1500)
+    args = parser.parse_args()
+
+    converter.stream_template()
+    print(f"{'backend':>8} {'senza cache s':>14} {'primo export s':>15} {'riesportazione s':>17}")
+    with tempfile.TemporaryDirectory() as tmp:
+        # Stesso seed: il secondo file estende il primo con nuovi messaggi in coda
+        first = write_conversation(os.path.join(tmp, 'first.json'), args.messages, args.message_size)
+        second = write_conversation(os.path.join(tmp, 'second.json'), args.messages + args.new, args.message_size)
+        for backend in converter.BACKENDS:
+            fragments = FragmentCache(1024 * 2**20)
+            uncached = _convert(second, backend)
+            cold = _convert(first, backend, fragments)
+            warm = _convert(second, backend, fragments)
+            print(f"{backend:>8} {uncached:>14.2f} {cold:>15.2f} {warm:>17.2f}")
+
+
+if __name__ == '__main__':
+    main()
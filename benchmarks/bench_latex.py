@@ -0,0 +1,45 @@
+"""
+Tempo di conversione LaTeX → Unicode su righe ricche di formule.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_latex [--lines 20000]
+"""
+import time
+import random
+import argparse
+
+import converter
+
+_EXPRESSIONS = [
+    r'\frac{\partial \Psi}{\partial t}', r'\sum_{i=0}^{n} x_i^2', r'\int_0^\infty e^{-x} dx',
+    r'\hbar \omega', r'\left( \alpha + \beta \right)^{2}', r'E = mc^2', r'\nabla \cdot \vec{E} = \rho',
+    r'\Delta x \Delta p \geq \hbar/2', r'\lambda_{n} \approx 10^{-3}', r'\sigma \in \Sigma',
+]
+
+
+def make_lines(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        f"Dalla relazione ${rng.choice(_EXPRESSIONS)}$ si ricava $${rng.choice(_EXPRESSIONS)}$$ "
+        f"e quindi ${rng.randint(0, 999)} {rng.choice(_EXPRESSIONS)}_{rng.randint(0, 9)}$."
+        for _ in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=20000)
+    args = parser.parse_args()
+
+    lines = make_lines(args.lines)
+    converter.convert_latex_expr.cache_clear()
+    for label in ('cache fredda', 'cache calda'):
+        start = time.perf_counter()
+        for line in lines:
+            converter.latex_to_unicode(line)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>13}: {elapsed:.3f} s ({elapsed / len(lines) * 1e6:.1f} µs/riga)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Confronto del picco di memoria tra json.load e il parsing incrementale
+al crescere della dimensione del file.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_memory [--sizes 1000,5000,20000] [--message-size 2000]
+"""
+import os
+import json
+import argparse
+import tempfile
+import tracemalloc
+
+from json_stream import load_conversation
+from benchmarks.synthetic import write_conversation
+
+
+def _peak(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def parse_full(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    for msg in data['messages']:
+        msg.get('content')
+
+
+def parse_stream(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = load_conversation(f)
+        for msg in data['messages']:
+            msg.get('content')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,5000,20000', help="numero di messaggi per ciascun file")
+    parser.add_argument('--message-size', type=int, default=2000, help="caratteri per messaggio")
+    args = parser.parse_args()
+
+    print(f"{'messaggi':>9} {'file MB':>9} {'json.load MB':>13} {'stream MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (int(s) for s in args.sizes.split(',')):
+            path = write_conversation(os.path.join(tmp, f'conv_{n}.json'), n, args.message_size)
+            size = os.path.getsize(path) / 2**20
+            full = _peak(lambda: parse_full(path)) / 2**20
+            stream = _peak(lambda: parse_stream(path)) / 2**20
+            print(f"{n:>9} {size:>9.1f} {full:>13.1f} {stream:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
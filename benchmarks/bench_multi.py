@@ -0,0 +1,74 @@
+"""
+Export con molte conversazioni: costo dell'indice (solo struttura) contro json.load
+dell'intero file, e conversione di una sola conversazione scelta contro l'export completo.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_multi [--conversations 200] [--messages 50] [--message-size 1500]
+"""
+import io
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import converter
+from benchmarks.bench_document import OPTIONS
+from benchmarks.synthetic import write_export
+from json_stream import index_conversations
+
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return json.load(f)
+
+
+def _index(path):
+    with open(path, 'rb') as f:
+        return index_conversations(f)
+
+
+def _convert(path, selection):
+    buf = io.BytesIO()
+    converter.write_docx(path, buf, dict(OPTIONS, conversations=selection), 'en')
+    return len(buf.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=50, help="messaggi per conversazione")
+    parser.add_argument('--message-size', type=int, default=1500)
+    args = parser.parse_args()
+
+    converter.preload()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_export(os.path.join(tmp, 'export.json'), args.conversations, args.messages, args.message_size)
+        print(f"input: {os.path.getsize(path) / 2**20:.1f} MB, {args.conversations} conversazioni "
+              f"da {args.messages} messaggi")
+        print(f"{'operazione':>22} {'tempo s':>8} {'picco MB':>9}")
+        _, seconds, peak = _measure(lambda: _load(path))
+        print(f"{'json.load':>22} {seconds:>8.3f} {peak / 2**20:>9.1f}")
+        entries, seconds, peak = _measure(lambda: _index(path))
+        print(f"{'indice':>22} {seconds:>8.3f} {peak / 2**20:>9.1f}")
+
+        # L'ultima conversazione è il caso peggiore per una selezione: tutto il file va scandito
+        last = entries[-1]['id']
+        for label, selection in (('una conversazione', last), ('export completo', '')):
+            size, seconds, peak = _measure(lambda: _convert(path, selection))
+            print(f"{label:>22} {seconds:>8.3f} {peak / 2**20:>9.1f}  ({size / 2**20:.2f} MB docx)")
+
+
+if __name__ == '__main__':
+    main()
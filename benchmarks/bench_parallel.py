@@ -0,0 +1,52 @@
+"""
+Rendering parallelo dei messaggi di una singola conversazione: tempo di conversione
+senza pool e con un pool di 1..N processi, per entrambi i backend.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_parallel [--messages 4000] [--message-size 1500] [--workers 1,2,4]
+"""
+import io
+import os
+import time
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import converter
+from benchmarks.bench_document import OPTIONS
+from benchmarks.synthetic import write_conversation
+
+
+def _convert(path, backend, executor=None):
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    converter.write_docx(path, buf, dict(OPTIONS, backend=backend), 'en', executor=executor)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=4000)
+    parser.add_argument('--message-size', type=int, default=1500)
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})),
+                        help="dimensioni del pool da provare")
+    args = parser.parse_args()
+
+    converter.stream_template()
+    print(f"core disponibili: {os.cpu_count()}")
+    print(f"{'backend':>8} {'processi':>9} {'tempo s':>8} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_conversation(os.path.join(tmp, 'corpus.json'), args.messages, args.message_size)
+        for backend in converter.BACKENDS:
+            serial = _convert(path, backend)
+            print(f"{backend:>8} {'-':>9} {serial:>8.2f} {1:>8.2f}")
+            for workers in (int(n) for n in args.workers.split(',')):
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    # Avvio dei processi escluso dalla misura
+                    executor.submit(converter.stream_template).result()
+                    elapsed = _convert(path, backend, executor)
+                print(f"{backend:>8} {workers:>9} {elapsed:>8.2f} {serial / elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Anteprima HTML contro conversione completa: tempo della prima pagina di anteprima e
+dell'export .docx, a freddo e con i modelli dei messaggi già in cache dopo l'anteprima
+di tutta la conversazione (markdown, tabelle e LaTeX non vengono rianalizzati).
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_preview [--messages 2000] [--message-size 1500] [--page 20]
+"""
+import io
+import os
+import time
+import argparse
+import tempfile
+
+import converter
+from benchmarks.bench_document import OPTIONS
+from benchmarks.synthetic import write_conversation
+from cache import FragmentCache
+from preview import PREVIEW_MAX_MESSAGES, render_preview
+
+CACHE_BYTES = 1024 ** 3
+
+# Contenuto con tabelle e LaTeX, dove l'analisi del markdown pesa di più
+MIX = {'tables': 0.2, 'latex': 0.3, 'reasoning': 0.0, 'extra': 0.2}
+
+
+def _preview_all(path, options, fragments):
+    offset = 0
+    while offset is not None:
+        with open(path, 'rb') as f:
+            _, offset = render_preview(f, options, 'en', offset, PREVIEW_MAX_MESSAGES, fragments)
+
+
+def _export(path, options, fragments):
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    converter.write_docx(path, buf, options, 'en', fragments)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--message-size', type=int, default=1500)
+    parser.add_argument('--page', type=int, default=20, help="messaggi nella pagina di anteprima")
+    args = parser.parse_args()
+
+    converter.preload()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_conversation(os.path.join(tmp, 'corpus.json'), args.messages, args.message_size, mix=MIX)
+        print(f"input: {os.path.getsize(path) / 2**20:.1f} MB, {args.messages} messaggi")
+        for backend in converter.BACKENDS:
+            options = dict(OPTIONS, backend=backend)
+            start = time.perf_counter()
+            with open(path, 'rb') as f:
+                render_preview(f, options, 'en', 0, args.page, FragmentCache(CACHE_BYTES))
+            page = time.perf_counter() - start
+            cold = _export(path, options, FragmentCache(CACHE_BYTES))
+            fragments = FragmentCache(CACHE_BYTES)
+            _preview_all(path, options, fragments)
+            warm = _export(path, options, fragments)
+            print(f"{backend:>8}: anteprima {args.page} messaggi {page * 1000:.0f} ms, "
+                  f"export a freddo {cold:.2f} s, dopo l'anteprima {warm:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
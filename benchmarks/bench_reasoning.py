@@ -0,0 +1,69 @@
+"""
+Rimozione dei blocchi di reasoning da messaggi di qualche MB: doppia sostituzione con
+regex (implementazione precedente) contro lo scanner a passata singola, sul testo intero
+e a chunk come se il contenuto arrivasse in streaming.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_reasoning [--size-mb 8] [--blocks 200] [--chunk-size 65536]
+"""
+import re
+import time
+import argparse
+
+from reasoning import END_MARKER, START_MARKER, ReasoningStripper, split_reasoning
+
+_BLOCK_RE = re.compile(re.escape(START_MARKER) + '.*?' + re.escape(END_MARKER), re.DOTALL)
+_TAIL_RE = re.compile(re.escape(START_MARKER) + '.*', re.DOTALL)
+
+
+def regex_strip(text):
+    return _TAIL_RE.sub('', _BLOCK_RE.sub('', text)).strip()
+
+
+def chunked_strip(text, chunk_size):
+    stripper = ReasoningStripper()
+    visible = []
+    for start in range(0, len(text), chunk_size):
+        visible.extend(stripper.feed(text[start:start + chunk_size]))
+    visible.extend(stripper.close())
+    return ''.join(visible).strip()
+
+
+def make_message(size, blocks):
+    # Blocchi di ragionamento alternati a testo visibile, l'ultimo lasciato aperto
+    piece = size // (2 * blocks)
+    parts = []
+    for i in range(blocks):
+        parts.append(START_MARKER + 'thinking about it ' * (piece // 18))
+        if i + 1 < blocks:
+            parts.append(END_MARKER + 'visible answer. ' * (piece // 16))
+    return ''.join(parts)
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=8)
+    parser.add_argument('--blocks', type=int, default=200)
+    parser.add_argument('--chunk-size', type=int, default=65536)
+    args = parser.parse_args()
+
+    text = make_message(int(args.size_mb * 2**20), args.blocks)
+    regex_s, expected = _time(regex_strip, text)
+    scan_s, (visible, _) = _time(split_reasoning, text, False)
+    chunk_s, chunked = _time(chunked_strip, text, args.chunk_size)
+    assert visible == expected and chunked == expected
+
+    print(f"messaggio: {len(text) / 2**20:.1f} MB, {args.blocks} blocchi di reasoning")
+    print(f"regex (due passate):   {regex_s * 1000:8.1f} ms")
+    print(f"scanner, testo intero: {scan_s * 1000:8.1f} ms")
+    print(f"scanner, chunk {args.chunk_size // 1024} KB: {chunk_s * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Tempo e picco di memoria di ogni fase della conversione, misurati separatamente su un
+corpus sintetico: lettura del JSON, clean_text, tokenizzazione del markdown (tabelle
+incluse), markdown inline e LaTeX, rendering dei blocchi di testo, add_table_to_doc e
+doc.save; in coda le conversioni complete con i due backend.
+
+I risultati possono essere salvati come baseline e confrontati nelle esecuzioni
+successive: una fase più lenta o più pesante oltre la tolleranza è una regressione
+(codice di uscita 1). La memoria allocata da lxml in C non è vista da tracemalloc:
+per le fasi che costruiscono l'XML il picco riguarda solo gli oggetti Python.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_stages [--scale small|medium|large] [--tables 0.1] [--latex 0.1]
+                                      [--reasoning 0.3] [--extra 0.2]
+                                      [--save-baseline FILE | --baseline FILE [--tolerance 0.2]]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import converter
+from json_stream import load_conversation
+from benchmarks.bench_document import OPTIONS
+from benchmarks.synthetic import add_mix_arguments, corpus_spec, write_conversation
+
+# Differenze di tempo sotto questa soglia (secondi) sono rumore di misura
+NOISE_SECONDS = 0.005
+
+# Composizione di default del corpus: un po' di tutto
+DEFAULT_MIX = {'tables': 0.1, 'latex': 0.1, 'reasoning': 0.3, 'extra': 0.2}
+
+
+def _texts(messages):
+    # Contenuti nello stesso formato in cui li riceve build_message_model
+    for msg in messages:
+        if msg.get('content'):
+            yield converter.unescape_text(msg['content']), False
+        for item in msg.get('extra', []):
+            if isinstance(item, dict) and item.get('type') == 'TEXT' and item.get('content'):
+                yield converter.unescape_text(item['content'], tabs=False), True
+
+
+def run_stages(path, measure):
+    """
+    Esegue le fasi in ordine, ognuna sull'output della precedente. `measure(name, func)`
+    esegue func e ne restituisce il risultato registrando tempo o memoria.
+    """
+    def load():
+        with open(path, 'r', encoding='utf-8') as f:
+            data = load_conversation(f)
+            return list(data['messages'])
+    messages = measure('json_load', load)
+
+    texts = list(_texts(messages))
+    cleaned = measure('clean_text', lambda: [(converter.clean_text(text), italic) for text, italic in texts])
+    tokens = measure('tokenize_markdown',
+                     lambda: [(list(converter.tokenize_markdown(text)), italic) for text, italic in cleaned])
+    blocks = measure('inline_and_latex', lambda: [converter.resolve_block(block, italic)
+                                                  for message_blocks, italic in tokens
+                                                  for block in message_blocks])
+    doc = converter.new_document()
+
+    def render_text():
+        for block in blocks:
+            if block['type'] != 'table':
+                converter.add_resolved_block(doc, block)
+    measure('add_markdown_blocks', render_text)
+
+    def render_tables():
+        text_width = converter._text_width(doc)
+        for block in blocks:
+            if block['type'] == 'table':
+                converter.add_table_to_doc(doc, block['data'], text_width=text_width)
+    measure('add_table_to_doc', render_tables)
+    measure('doc_save', lambda: doc.save(io.BytesIO()))
+
+    for backend in converter.BACKENDS:
+        options = dict(OPTIONS, backend=backend)
+        measure(f'write_docx_{backend}', lambda: converter.write_docx(path, io.BytesIO(), options, 'en'))
+
+
+def measure_time(results):
+    def measure(name, func):
+        start = time.perf_counter()
+        value = func()
+        results.setdefault(name, {})['seconds'] = round(time.perf_counter() - start, 4)
+        return value
+    return measure
+
+
+def measure_memory(results):
+    # Picco allocato durante la fase, al netto di quanto era già in memoria
+    def measure(name, func):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        value = func()
+        results.setdefault(name, {})['peak_bytes'] = tracemalloc.get_traced_memory()[1] - before
+        return value
+    return measure
+
+
+def compare(results, baseline, tolerance):
+    """Regressioni rispetto alla baseline: [(fase, metrica, baseline, attuale)]."""
+    regressions = []
+    for name, metrics in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if metric == 'seconds' and metrics[metric] - base.get(metric, 0) < NOISE_SECONDS:
+                continue
+            if base.get(metric) and metrics[metric] > base[metric] * (1 + tolerance):
+                regressions.append((name, metric, base[metric], metrics[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_mix_arguments(parser)
+    parser.set_defaults(**DEFAULT_MIX)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--save-baseline', metavar='FILE', help="salva i risultati come baseline")
+    group.add_argument('--baseline', metavar='FILE', help="confronta i risultati con una baseline salvata")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="peggioramento ammesso rispetto alla baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    n_messages, size, mix = corpus_spec(args)
+    converter.preload()
+    stages = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_conversation(os.path.join(tmp, 'corpus.json'), n_messages, size, args.seed, mix)
+        # Tempi e memoria in due passate: tracemalloc rallenterebbe i tempi
+        run_stages(path, measure_time(stages))
+        tracemalloc.start()
+        try:
+            run_stages(path, measure_memory(stages))
+        finally:
+            tracemalloc.stop()
+        input_bytes = os.path.getsize(path)
+
+    results = {
+        'corpus': {'messages': n_messages, 'message_size': size, 'seed': args.seed, 'mix': mix,
+                   'input_bytes': input_bytes},
+        'python': platform.python_version(),
+        'stages': stages,
+    }
+
+    print(f"corpus: {n_messages} messaggi, {input_bytes / 2**20:.1f} MB, mix {mix}")
+    print(f"{'fase':<22} {'tempo s':>9} {'picco MB':>9}")
+    for name, metrics in stages.items():
+        print(f"{name:<22} {metrics['seconds']:>9.3f} {metrics['peak_bytes'] / 2**20:>9.1f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline salvata in {args.save_baseline}")
+        return 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['corpus'] != results['corpus']:
+            print("attenzione: la baseline è stata misurata su un corpus diverso", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, before, after in regressions:
+            print(f"REGRESSIONE {name} {metric}: {before} -> {after}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"nessuna regressione oltre il {args.tolerance:.0%} rispetto a {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Avvio a freddo e preparazione per richiesta: import dei moduli e preload in un
+processo nuovo, poi il costo di creare il documento di ogni richiesta partendo dal
+template di python-docx (margini e stili ricreati) o copiando il documento base.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_startup [--repeat 50]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+from docx import Document
+from docx.shared import Inches
+
+import converter
+from benchmarks.synthetic import write_conversation
+
+# Eseguito in un processo nuovo: stampa i tempi (ms) di import, preload e prima richiesta
+_COLD_START = """
+import io, time
+start = time.perf_counter()
+import converter
+imported = time.perf_counter()
+converter.preload()
+preloaded = time.perf_counter()
+converter.write_docx({sample!r}, io.BytesIO(), {{'backend': 'docx'}}, 'en')
+done = time.perf_counter()
+print((imported - start) * 1000, (preloaded - imported) * 1000, (done - preloaded) * 1000)
+"""
+
+
+def _legacy_document():
+    # Preparazione precedente: template di python-docx riletto e stili ricreati ogni volta
+    doc = Document()
+    for section in doc.sections:
+        section.top_margin = section.bottom_margin = Inches(1)
+        section.left_margin = section.right_margin = Inches(1)
+    converter.ensure_custom_styles(doc)
+    return doc
+
+
+def _mean_ms(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sample = write_conversation(os.path.join(tmp, 'sample.json'), 10, 500)
+        output = subprocess.run([sys.executable, '-c', _COLD_START.format(sample=sample)],
+                                capture_output=True, text=True, check=True).stdout
+    import_ms, preload_ms, first_ms = (float(value) for value in output.split())
+    print("avvio a freddo (processo nuovo)")
+    print(f"  import converter      {import_ms:8.1f} ms")
+    print(f"  preload               {preload_ms:8.1f} ms")
+    print(f"  prima richiesta       {first_ms:8.1f} ms")
+
+    converter.preload()
+    print(f"preparazione per richiesta (media su {args.repeat})")
+    print(f"  Document() + stili    {_mean_ms(_legacy_document, args.repeat):8.2f} ms")
+    print(f"  copia documento base  {_mean_ms(converter.new_document, args.repeat):8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Tempo di costruzione delle tabelle Markdown con add_table_to_doc al crescere delle righe.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_tables [--rows 10,1000,10000] [--cols 5]
+"""
+import io
+import time
+import argparse
+
+from docx import Document
+
+from converter import add_table_to_doc
+
+
+def make_table(rows, cols):
+    header = [f"Colonna {c}" for c in range(cols)]
+    return [header] + [[f"r{r} c{c}" for c in range(cols)] for r in range(rows)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='10,1000,10000')
+    parser.add_argument('--cols', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'righe':>7} {'build s':>9} {'µs/cella':>9} {'save s':>8}")
+    for n in (int(s) for s in args.rows.split(',')):
+        data = make_table(n, args.cols)
+        doc = Document()
+        start = time.perf_counter()
+        add_table_to_doc(doc, data)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        doc.save(io.BytesIO())
+        save = time.perf_counter() - start
+        print(f"{n:>7} {build:>9.3f} {build / (len(data) * args.cols) * 1e6:>9.2f} {save:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
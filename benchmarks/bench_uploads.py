@@ -0,0 +1,66 @@
+"""
+Upload compressi: dimensione da trasferire e tempo di conversione con la decompressione
+al volo (gzip, bz2, xz) rispetto al .json non compresso, e tempo per assemblare e
+verificare un upload a blocchi.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.bench_uploads [--messages 2000] [--message-size 1500] [--chunk-mb 8]
+"""
+import io
+import os
+import time
+import hashlib
+import argparse
+import tempfile
+
+import converter
+from benchmarks.bench_document import OPTIONS
+from benchmarks.synthetic import write_conversation
+from uploads import COMPRESSIONS, UploadStore, open_upload
+
+
+def _convert(path, backend):
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    with open(path, 'rb') as raw:
+        converter.write_docx(open_upload(raw, path), buf, dict(OPTIONS, backend=backend), 'en')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--message-size', type=int, default=1500)
+    parser.add_argument('--chunk-mb', type=int, default=8, help="dimensione dei blocchi dell'upload riprendibile")
+    args = parser.parse_args()
+
+    converter.preload()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_conversation(os.path.join(tmp, 'corpus.json'), args.messages, args.message_size)
+        with open(path, 'rb') as f:
+            data = f.read()
+        paths = {'json': path}
+        for suffix, module in COMPRESSIONS.items():
+            paths[suffix] = path + suffix
+            with open(paths[suffix], 'wb') as f:
+                f.write(module.compress(data))
+
+        print(f"{'formato':>8} {'upload MB':>10} {'stream s':>9} {'docx s':>8}")
+        for name, file_path in paths.items():
+            size = os.path.getsize(file_path) / 2**20
+            print(f"{name:>8} {size:>10.2f} {_convert(file_path, 'stream'):>9.2f} {_convert(file_path, 'docx'):>8.2f}")
+
+        store = UploadStore(upload_dir=os.path.join(tmp, 'uploads'))
+        with open(paths['.gz'], 'rb') as f:
+            payload = f.read()
+        chunk = args.chunk_mb * 2**20
+        start = time.perf_counter()
+        upload = store.create('corpus.json.gz', len(payload), hashlib.sha256(payload).hexdigest())
+        for offset in range(0, len(payload), chunk):
+            upload = store.append(upload['id'], offset, io.BytesIO(payload[offset:offset + chunk]))
+        print(f"upload a blocchi da {args.chunk_mb} MB: {time.perf_counter() - start:.3f} s ({upload['status']})")
+        store.shutdown()
+
+
+if __name__ == '__main__':
+    main()
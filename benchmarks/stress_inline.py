@@ -0,0 +1,58 @@
+"""
+Stress test del parser inline su righe avversarie (molti '*' o '$' spaiati).
+Ogni riga deve essere elaborata entro la latenza massima indicata, altrimenti
+lo script termina con codice di uscita 1.
+
+Uso (dalla radice del repository):
+    python -m benchmarks.stress_inline [--length 20000] [--max-ms 250]
+"""
+import sys
+import time
+import argparse
+
+import converter
+
+
+def adversarial_lines(n):
+    return {
+        'asterischi': '*' * n,
+        'asterischi spaziati': '* ' * (n // 2),
+        'grassetto aperto': '**a' * (n // 3),
+        'triplo aperto': '***a' * (n // 4),
+        'glob di shell': 'ls *.py src/*/*.txt ' * (n // 20),
+        'dollari': '$' * n,
+        'prezzi': '$5 and ' * (n // 7),
+        'dollari e a capo': '$a\n' * (n // 3),
+        'display aperto': '$$x ' * (n // 4),
+        'misto': '*$' * (n // 2),
+        'apici aperti': '$' + '^{' * (n // 2) + '$',
+        'pedici aperti': '$' + '_{' * (n // 2) + '$',
+        'frazioni aperte': '$' + '\\frac{' * (n // 6) + '}x$',
+        'elenco di puntini': '* * * ' * (n // 6) + 'fine *',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--length', type=int, default=20000, help="lunghezza approssimativa di ogni riga")
+    parser.add_argument('--max-ms', type=float, default=250.0, help="latenza massima ammessa per riga")
+    args = parser.parse_args()
+
+    failures = []
+    for name, line in adversarial_lines(args.length).items():
+        converter.convert_latex_expr.cache_clear()
+        start = time.perf_counter()
+        converter.parse_inline_markdown(line)
+        elapsed = (time.perf_counter() - start) * 1000
+        status = 'ok' if elapsed <= args.max_ms else 'LENTO'
+        print(f"{name:>20}: {elapsed:8.2f} ms  {status}")
+        if elapsed > args.max_ms:
+            failures.append(name)
+
+    if failures:
+        print(f"Latenza massima superata: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
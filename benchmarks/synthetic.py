@@ -0,0 +1,217 @@
+import json
+import random
+import argparse
+
+# Generatore di conversazioni llama.cpp sintetiche per i benchmark
+
+_WORDS = (
+    "the model returns a result with the expected value for each input and "
+    "a short explanation of the steps used to compute it in detail"
+).split()
+
+_LATEX = (
+    r"\alpha + \beta = \gamma", r"x^2 + y^2 = z^2", r"\sum_i a_i \leq \infty",
+    r"\frac{a}{b} \cdot \sqrt{c}", r"\lambda \rightarrow \pi", r"e^{i\theta} = \cos\theta + i\sin\theta",
+)
+
+# Quota (0..1) dei blocchi o dei messaggi con ciascun tipo di contenuto: con tutte
+# le quote a zero il corpus è identico a quello delle versioni precedenti
+DEFAULT_MIX = {'tables': 0.0, 'latex': 0.0, 'reasoning': 0.0, 'extra': 0.0, 'code': 0.0}
+
+# Scale predefinite: (messaggi, caratteri per messaggio)
+SCALES = {
+    'small': (100, 800),
+    'medium': (2000, 1500),
+    'large': (10000, 2000),
+}
+
+
+def _sentence(rng, words=12):
+    return ' '.join(rng.choice(_WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _table(rng, rows=8, cols=4):
+    lines = ['| ' + ' | '.join(f"{rng.choice(_WORDS).title()} {c}" for c in range(cols)) + ' |',
+             '|' + '---|' * cols]
+    for _ in range(rows):
+        lines.append('| ' + ' | '.join(rng.choice(_WORDS) for _ in range(cols)) + ' |')
+    return '\n'.join(lines)
+
+
+def _latex_line(rng):
+    return f"{_sentence(rng, 6)} ${rng.choice(_LATEX)}$ and $${rng.choice(_LATEX)}$$"
+
+
+def _code(rng, lines=30):
+    # Codice con caratteri che il markdown inline interpreterebbe: *, **, $...$, "- ", |,
+    # e sequenze \n e \t letterali nelle stringhe, che devono restare tali
+    body = ["```python", f"def {rng.choice(_WORDS)}_{rng.randrange(100)}(*args, **kwargs):"]
+    for i in range(lines):
+        name = rng.choice(_WORDS)
+        body.append(rng.choice((
+            f"    {name}_{i} = args[{i % 3}] * kwargs.get('{name}', 2) ** 2",
+            f"    # ${name}^2$ - {_sentence(rng, 4)}",
+            f"    print(f\"| {name} | {{{name}_{i}!r}} |\")",
+            f"    - {name}_{i}",
+            f"    print(\"{name}:\\n\\t{{{name}_{i}}}\")",
+        )))
+    body.append("```")
+    return '\n'.join(body)
+
+
+def make_message_content(rng, size, mix=None):
+    """Crea un contenuto markdown di circa `size` caratteri."""
+    mix = mix or DEFAULT_MIX
+    parts = []
+    length = 0
+    while length < size:
+        block = None
+        code = mix.get('code', 0.0)
+        if mix['tables'] or mix['latex'] or code:
+            special = rng.random()
+            if special < mix['tables']:
+                block = _table(rng)
+            elif special < mix['tables'] + mix['latex']:
+                block = _latex_line(rng)
+            elif special < mix['tables'] + mix['latex'] + code:
+                block = _code(rng)
+        if block is None:
+            kind = rng.random()
+            if kind < 0.1:
+                block = f"## {_sentence(rng, 4)}"
+            elif kind < 0.3:
+                block = '\n'.join(f"- **{rng.choice(_WORDS)}**: {_sentence(rng, 6)}" for _ in range(3))
+            else:
+                block = f"{_sentence(rng)} *{rng.choice(_WORDS)}* {_sentence(rng)}"
+        parts.append(block)
+        length += len(block) + 2
+    return '\n\n'.join(parts)
+
+
+def _regenerated(rng, i, k, message_size, mix):
+    # Risposta alternativa scartata: stesso parent della risposta attiva, nessun figlio
+    return {
+        "id": f"bench-msg-{i}-alt{k}",
+        "convId": "bench-conv",
+        "parent": f"bench-msg-{i - 1}",
+        "children": [],
+        "role": "assistant",
+        "content": make_message_content(rng, message_size, mix),
+        "type": "text",
+        "timestamp": 1771702156956 + i * 1000 - (k + 1) * 100,
+        "model": "bench-model",
+    }
+
+
+def make_conversation(n_messages, message_size=1000, seed=0, mix=None, regenerations=0):
+    """
+    Restituisce un export llama.cpp con `n_messages` messaggi alternati utente/assistente
+    nel ramo attivo. `mix` indica le quote di tabelle, LaTeX e codice tra i blocchi, di blocchi di
+    reasoning tra le risposte e di contenuti incollati (`extra`) tra le domande. Con
+    `regenerations` ogni risposta ha altrettante versioni scartate, fuori dal ramo attivo.
+    """
+    mix = dict(DEFAULT_MIX, **(mix or {}))
+    rng = random.Random(seed)
+    messages = []
+    for i in range(n_messages):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        if role == 'assistant' and i and regenerations:
+            alternatives = [_regenerated(rng, i, k, message_size, mix) for k in range(regenerations)]
+            messages.extend(alternatives)
+            messages[-len(alternatives) - 1]["children"][:0] = [alt["id"] for alt in alternatives]
+        content = make_message_content(rng, message_size, mix)
+        if role == 'assistant' and mix['reasoning'] and rng.random() < mix['reasoning']:
+            reasoning = make_message_content(rng, message_size // 2, mix)
+            content = f"<<<reasoning_content_start>>>{reasoning}<<<reasoning_content_end>>>{content}"
+        msg = {
+            "id": f"bench-msg-{i}",
+            "convId": "bench-conv",
+            "parent": f"bench-msg-{i - 1}" if i else "bench-root",
+            "children": [f"bench-msg-{i + 1}"] if i + 1 < n_messages else [],
+            "role": role,
+            "content": content,
+            "type": "text",
+            "timestamp": 1771702156956 + i * 1000,
+        }
+        if role == 'user' and mix['extra'] and rng.random() < mix['extra']:
+            msg["extra"] = [{"type": "TEXT", "name": "Pasted",
+                             "content": make_message_content(rng, message_size, mix)}]
+        if role == 'assistant':
+            msg["model"] = "bench-model"
+            msg["timings"] = {"prompt_n": 10, "prompt_ms": 50.5, "predicted_n": 20, "predicted_ms": 100.2}
+        messages.append(msg)
+    return {
+        "conv": {
+            "id": "bench-conv",
+            "name": "benchmark",
+            "lastModified": 1771702156904,
+            "currNode": f"bench-msg-{n_messages - 1}",
+        },
+        "messages": messages,
+    }
+
+
+def write_conversation(path, n_messages, message_size=1000, seed=0, mix=None, regenerations=0):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(make_conversation(n_messages, message_size, seed, mix, regenerations), f, ensure_ascii=False)
+    return path
+
+
+def make_export(n_conversations, n_messages, message_size=1000, seed=0, mix=None):
+    """Export multiplo ("esporta tutto"): array di `n_conversations` conversazioni distinte."""
+    export = []
+    for c in range(n_conversations):
+        conversation = make_conversation(n_messages, message_size, seed + c, mix)
+        conversation["conv"].update({"id": f"bench-conv-{c}", "name": f"benchmark {c}"})
+        for msg in conversation["messages"]:
+            msg["id"] = f"c{c}-{msg['id']}"
+            msg["convId"] = f"bench-conv-{c}"
+            msg["parent"] = f"c{c}-{msg['parent']}"
+            msg["children"] = [f"c{c}-{child}" for child in msg["children"]]
+        conversation["conv"]["currNode"] = f"c{c}-{conversation['conv']['currNode']}"
+        export.append(conversation)
+    return export
+
+
+def write_export(path, n_conversations, n_messages, message_size=1000, seed=0, mix=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(make_export(n_conversations, n_messages, message_size, seed, mix), f, ensure_ascii=False)
+    return path
+
+
+def add_mix_arguments(parser):
+    """Opzioni comuni per scala e composizione del corpus."""
+    parser.add_argument('--scale', choices=sorted(SCALES), default='medium',
+                        help="messaggi e dimensione predefiniti")
+    parser.add_argument('--messages', type=int, help="numero di messaggi (sostituisce la scala)")
+    parser.add_argument('--message-size', type=int, help="caratteri per messaggio (sostituisce la scala)")
+    for name in DEFAULT_MIX:
+        parser.add_argument(f'--{name}', type=float, default=DEFAULT_MIX[name],
+                            help=f"quota di contenuti '{name}' (0..1)")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def corpus_spec(args):
+    """(messaggi, dimensione, mix) dagli argomenti di add_mix_arguments."""
+    messages, size = SCALES[args.scale]
+    mix = {name: getattr(args, name) for name in DEFAULT_MIX}
+    return args.messages or messages, args.message_size or size, mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un export llama.cpp sintetico.")
+    parser.add_argument('output', help="file .json da scrivere")
+    add_mix_arguments(parser)
+    parser.add_argument('--conversations', type=int, default=1,
+                        help="più di 1: export multiplo con altrettante conversazioni")
+    args = parser.parse_args()
+    messages, size, mix = corpus_spec(args)
+    if args.conversations > 1:
+        write_export(args.output, args.conversations, messages, size, args.seed, mix)
+    else:
+        write_conversation(args.output, messages, size, args.seed, mix)
+    print(f"{args.output}: {args.conversations} × {messages} messaggi da ~{size} caratteri, mix {mix}")
+
+
+if __name__ == '__main__':
+    main()
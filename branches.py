@@ -0,0 +1,68 @@
+# Selezione del ramo da esportare. Gli export llama.cpp contengono tutte le risposte
+# rigenerate e i messaggi modificati: ogni messaggio punta al precedente con 'parent'
+# e conv['currNode'] è la foglia del ramo attivo, cioè la conversazione vista dall'utente.
+
+ACTIVE = 'active'
+ALL = 'all'
+
+# Valori predefiniti dell'opzione 'branch'; qualsiasi altro valore è l'id della foglia
+# del ramo da esportare
+BRANCH_MODES = (ACTIVE, ALL)
+
+
+def index_messages(messages):
+    """
+    Legge i messaggi in una sola passata tenendo solo la struttura dei rami: restituisce
+    (indice id -> (parent, posizione nell'ordine del file), numero di messaggi).
+    """
+    index = {}
+    count = 0
+    for position, msg in enumerate(messages):
+        msg_id = msg.get('id') if isinstance(msg, dict) else None
+        if msg_id is not None:
+            index[msg_id] = (msg.get('parent'), position)
+        count = position + 1
+    return index, count
+
+
+def branch_path(index, leaf_id):
+    """Posizioni dei messaggi dalla radice a leaf_id risalendo i parent (un parent sconosciuto chiude il ramo)."""
+    path = []
+    seen = set()
+    msg_id = leaf_id
+    while msg_id in index and msg_id not in seen:
+        seen.add(msg_id)
+        parent, position = index[msg_id]
+        path.append(position)
+        msg_id = parent
+    path.reverse()
+    return path
+
+
+def select_branch(messages, conv, branch=ACTIVE, spans=None):
+    """
+    Messaggi da esportare secondo l'opzione branch: 'all' tutti, nell'ordine del file e
+    senza leggerli in anticipo; 'active' il ramo che termina in conv['currNode']; un id il
+    ramo che termina in quel messaggio. Se l'export non ha id o currNode (export vecchi o
+    creati a mano) il ramo attivo non è determinabile e si esportano tutti i messaggi.
+    Con spans (il MessageSpans di load_conversation) la prima passata tiene solo id, parent
+    e posizione di ogni messaggio e i messaggi scelti vengono riletti dal file uno alla
+    volta; senza, restano tutti in memoria fino alla scelta.
+    """
+    if branch == ALL:
+        return messages
+    if spans is None:
+        messages = list(messages)
+        read = lambda positions: [messages[position] for position in positions]
+    else:
+        read = spans.read
+    index, count = index_messages(messages)
+    if branch == ACTIVE:
+        leaf_id = conv.get('currNode')
+        if not index or leaf_id not in index:
+            return read(range(count))
+    else:
+        leaf_id = branch
+        if leaf_id not in index:
+            raise ValueError(f"Messaggio '{leaf_id}' non trovato nella conversazione")
+    return read(branch_path(index, leaf_id))
@@ -0,0 +1,292 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Versione del formato dei risultati: va incrementata quando cambia il rendering,
+# così le voci prodotte da versioni precedenti non vengono più servite
+CACHE_FORMAT_VERSION = 5
+
+# Opzioni che non cambiano l'XML di un messaggio e restano fuori dalla chiave dei frammenti:
+# i due backend producono lo stesso frammento, ma scrivono byte diversi nel .docx, quindi
+# il backend resta invece nella chiave dei documenti
+_FRAGMENT_IGNORED_OPTIONS = {'backend'}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_stream(fp):
+    """sha256 del contenuto di un file aperto in binario; riporta il file all'inizio."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    fp.seek(0)
+    return digest.hexdigest()
+
+
+def normalize_options(options, ignored=()):
+    normalized = {}
+    for name, value in options.items():
+        if name in ignored:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        normalized[name] = value
+    return normalized
+
+
+def cache_key(input_digest, options, lang):
+    """Chiave content-addressed: hash dell'input, opzioni normalizzate e lingua."""
+    payload = json.dumps({
+        'version': CACHE_FORMAT_VERSION,
+        'input': input_digest,
+        'options': normalize_options(options),
+        'lang': lang,
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ConversionCache:
+    """
+    Cache dei documenti convertiti a due livelli: memoria (LRU limitata in byte) e,
+    se è indicata una cartella, disco (LRU per data di ultimo accesso, anch'essa
+    limitata in byte). Le voci lette dal disco vengono promosse in memoria.
+    """
+
+    def __init__(self, memory_max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        # Ricostruisce l'ordine LRU del disco dalle date di accesso dei file esistenti
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.docx'):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_mtime, name[:-len('.docx')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + '.docx')
+
+    def get(self, key):
+        """Restituisce i byte del documento in cache, o None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return data
+            if key not in self._disk:
+                self._counters['misses'] += 1
+                return None
+            self._disk.move_to_end(key)
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # File rimosso dall'esterno: la voce non è più valida
+            with self._lock:
+                self._forget_disk(key)
+                self._counters['misses'] += 1
+            return None
+        with self._lock:
+            self._counters['disk_hits'] += 1
+            self._store_memory(key, data)
+        return data
+
+    def put(self, key, fp):
+        """Memorizza il documento letto da fp (aperto in binario, dall'inizio)."""
+        size = fp.seek(0, os.SEEK_END)
+        fp.seek(0)
+        data = fp.read() if size <= self.memory_max_bytes else None
+        if self.disk_dir and size <= self.disk_max_bytes:
+            fp.seek(0)
+            self._store_disk(key, fp, size)
+        fp.seek(0)
+        with self._lock:
+            self._counters['stores'] += 1
+            if data is not None:
+                self._store_memory(key, data)
+
+    def _store_memory(self, key, data):
+        if len(data) > self.memory_max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._counters['evictions'] += 1
+
+    def _store_disk(self, key, fp, size):
+        # Scrittura atomica: file temporaneo nella stessa cartella e poi rename
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(fp, out)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._forget_disk(key)
+            self._disk[key] = size
+            self._disk_bytes += size
+            self._evict_disk()
+
+    def _forget_disk(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._counters['evictions'] += 1
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+            stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+            stats['disk_entries'] = len(self._disk)
+            stats['disk_bytes'] = self._disk_bytes
+            return stats
+
+
+def fragment_digest(msg, idx, options, lang):
+    """Hash di tutto ciò che determina il rendering di un messaggio."""
+    options = normalize_options(options, _FRAGMENT_IGNORED_OPTIONS)
+    payload = json.dumps({
+        'version': CACHE_FORMAT_VERSION,
+        'message': msg,
+        # La posizione compare nel documento solo con la numerazione attiva
+        'index': idx if options.get('show_numbers') else None,
+        'options': options,
+        'lang': lang,
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def approximate_size(value):
+    """Dimensione indicativa (caratteri di testo) di un modello di messaggio."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(approximate_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(approximate_size(item) for item in value)
+    return 8
+
+
+class FragmentCache:
+    """
+    Rappresentazioni già pronte di ogni messaggio, indicizzate per id del messaggio: il
+    modello intermedio (blocchi già risolti, condiviso da anteprima e backend) e l'XML del
+    body. Ogni voce ricorda l'hash di contenuto e opzioni con cui è stata prodotta: un
+    messaggio modificato non corrisponde più e la sua voce viene sostituita. LRU limitata
+    in byte.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # chiave -> [hash, xml, modello, dimensione]; xml o modello possono mancare
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'model_hits': 0, 'model_misses': 0, 'evictions': 0}
+
+    def lookup(self, msg, idx, options, lang):
+        """Restituisce (chiave, hash, xml); xml è None se il messaggio va renderizzato."""
+        digest = fragment_digest(msg, idx, options, lang)
+        key = msg.get('id') or digest
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == digest and entry[1] is not None:
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return key, digest, entry[1]
+            self._counters['misses'] += 1
+        return key, digest, None
+
+    def lookup_model(self, msg, idx, options, lang):
+        """Come lookup, per il modello del messaggio: (chiave, hash, modello o None)."""
+        digest = fragment_digest(msg, idx, options, lang)
+        key = msg.get('id') or digest
+        return key, digest, self.model(key, digest)
+
+    def model(self, key, digest):
+        """Modello del messaggio costruito in precedenza con lo stesso hash, o None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == digest and entry[2] is not None:
+                self._entries.move_to_end(key)
+                self._counters['model_hits'] += 1
+                return entry[2]
+            self._counters['model_misses'] += 1
+        return None
+
+    def store(self, key, digest, xml):
+        self._store(key, digest, xml=xml)
+
+    def store_model(self, key, digest, model):
+        self._store(key, digest, model=model)
+
+    def _store(self, key, digest, xml=None, model=None):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[3]
+                # L'altra rappresentazione resta valida se l'hash è lo stesso
+                if old[0] == digest:
+                    xml = xml if xml is not None else old[1]
+                    model = model if model is not None else old[2]
+            size = (len(xml) if xml is not None else 0) + (approximate_size(model) if model is not None else 0)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = [digest, xml, model, size]
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+                self._counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            return stats
@@ -0,0 +1,256 @@
+"""
+Conversione da riga di comando di un albero di export llama.cpp (.json) in documenti Word,
+in parallelo su tutti i core. Le opzioni sono le stesse del form web.
+
+Uso:
+    python cli.py INPUT_DIR [-o OUTPUT_DIR] [--language en] [--no-date] [--user-name Mario]
+                  [--check mtime|hash] [--jobs N] [--render-workers N] [--force]
+                  [--conversations FILTRO] [--split-conversations]
+
+I file già aggiornati vengono saltati, quindi un'esecuzione interrotta può essere ripresa:
+con --check mtime (default) l'output è aggiornato se è più recente dell'input; con
+--check hash se l'hash di input, opzioni e lingua coincide con quello registrato nel
+manifest della cartella di output.
+
+Con --render-workers N i file vengono convertiti uno alla volta e i messaggi di ciascuno
+sono renderizzati in parallelo su N processi: conviene per poche conversazioni molto lunghe,
+mentre per molti file medi è più efficiente --jobs.
+
+Gli export con più conversazioni (un array JSON) diventano un unico documento; con
+--split-conversations ogni conversazione viene scritta in un proprio .docx, in una cartella
+con il nome dell'export. --conversations limita l'esportazione alle conversazioni indicate.
+
+Gli export compressi (.json.gz, .json.bz2, .json.xz) vengono decompressi durante la lettura.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+
+from batch import conversation_file_stem, convert_file
+from branches import ACTIVE
+from cache import cache_key, hash_stream
+from converter import BACKENDS, TRANSLATIONS, preload
+from json_stream import index_conversations, is_multi_conversation, select_conversations
+from uploads import is_json_upload, json_name, open_upload
+from reasoning import REASONING_MODES
+
+MANIFEST_NAME = '.json2docx-manifest.json'
+
+# Il manifest viene salvato al più ogni MANIFEST_SAVE_INTERVAL secondi durante la conversione
+MANIFEST_SAVE_INTERVAL = 5
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input_dir', help="cartella con gli export .json (ricorsiva)")
+    parser.add_argument('-o', '--output-dir', help="cartella dei .docx (default: accanto agli input)")
+    parser.add_argument('--language', default='it', choices=sorted(TRANSLATIONS), help="lingua del documento")
+    parser.add_argument('--date', dest='show_date', action=argparse.BooleanOptionalAction, default=True,
+                        help="data e ora dei messaggi")
+    parser.add_argument('--divider', dest='show_divider', action=argparse.BooleanOptionalAction, default=True,
+                        help="divisori orizzontali")
+    parser.add_argument('--model', dest='show_model', action=argparse.BooleanOptionalAction, default=True,
+                        help="modello AI")
+    parser.add_argument('--prompt', dest='show_prompt', action=argparse.BooleanOptionalAction, default=True,
+                        help="dati prompt (token e tempi)")
+    parser.add_argument('--numbers', dest='show_numbers', action=argparse.BooleanOptionalAction, default=True,
+                        help="numeri dei messaggi")
+    parser.add_argument('--user-name', default='', help="nome personalizzato dell'utente")
+    parser.add_argument('--assistant-name', default='', help="nome personalizzato dell'assistente")
+    parser.add_argument('--backend', default='docx', choices=BACKENDS, help="motore di rendering")
+    parser.add_argument('--branch', default=ACTIVE, metavar='active|all|ID',
+                        help="ramo da esportare: quello attivo (currNode), tutti, o quello che termina nel messaggio ID")
+    parser.add_argument('--reasoning', default='discard', choices=REASONING_MODES,
+                        help="ragionamento dei modelli: scartato o spostato in appendice")
+    parser.add_argument('--conversations', default='', metavar='FILTRO',
+                        help="negli export multipli: id o parti del nome delle conversazioni, separati da virgole")
+    parser.add_argument('--split-conversations', action='store_true',
+                        help="negli export multipli un .docx per conversazione invece di un unico documento")
+    parser.add_argument('--check', default='mtime', choices=('mtime', 'hash'),
+                        help="criterio per saltare gli output già aggiornati")
+    parser.add_argument('--force', action='store_true', help="riconverte tutto")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="processi paralleli")
+    parser.add_argument('--render-workers', type=int, default=0,
+                        help="processi per il rendering dei messaggi di ogni file (0 = disattivato)")
+    return parser.parse_args(argv)
+
+
+def build_options(args):
+    return {
+        'show_date': args.show_date,
+        'show_divider': args.show_divider,
+        'show_model': args.show_model,
+        'show_prompt': args.show_prompt,
+        'show_numbers': args.show_numbers,
+        'custom_user_name': args.user_name,
+        'custom_assistant_name': args.assistant_name,
+        'backend': args.backend,
+        'reasoning': args.reasoning,
+        'branch': args.branch,
+        'conversations': args.conversations,
+    }
+
+
+def find_inputs(input_dir):
+    """Percorsi relativi dei .json (anche compressi) sotto input_dir, in ordine stabile."""
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if is_json_upload(name) and name != MANIFEST_NAME:
+                found.append(os.path.relpath(os.path.join(root, name), input_dir))
+    return found
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    # Scrittura atomica: un'interruzione non lascia un manifest troncato
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(input_path, output_path, key, recorded_key, check):
+    if not os.path.exists(output_path):
+        return False
+    if check == 'hash':
+        return key == recorded_key
+    return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+
+def input_key(input_path, options, lang):
+    with open(input_path, 'rb') as f:
+        return cache_key(hash_stream(f), options, lang)
+
+
+def split_targets(input_dir, output_dir, rel_path, selection):
+    """
+    (rel_path, output_path, entry) da convertire per un input: uno solo per un export singolo,
+    uno per ogni conversazione scelta di un export multiplo (entry è la sua voce d'indice).
+    """
+    stem = os.path.splitext(json_name(rel_path))[0]
+    with open(os.path.join(input_dir, rel_path), 'rb') as raw:
+        f = open_upload(raw, rel_path)
+        if not is_multi_conversation(f):
+            return [(rel_path, os.path.join(output_dir, stem + '.docx'), None)]
+        entries = select_conversations(index_conversations(f), selection)
+    return [(f"{rel_path}#{entry['id'] or entry['index']}",
+             os.path.join(output_dir, stem, conversation_file_stem(entry) + '.docx'), entry)
+            for entry in entries]
+
+
+def convert_serially(pending, executor, options, lang):
+    # Un file alla volta nel processo principale, con i messaggi distribuiti sul pool:
+    # restituisce dei future già conclusi, come quelli di convert_file nel pool
+    for rel_path, input_path, output_path, key, entry, part_path in pending:
+        future = Future()
+        try:
+            future.set_result(convert_file(input_path, part_path, options, lang, executor, entry))
+        except Exception as e:
+            future.set_exception(e)
+        yield future
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    input_dir = args.input_dir
+    output_dir = args.output_dir or input_dir
+    options = build_options(args)
+    lang = args.language
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path) if args.check == 'hash' else {}
+
+    # Selezione dei file da convertire
+    pending = []
+    skipped = 0
+    failed = 0
+    for input_rel_path in find_inputs(input_dir):
+        input_path = os.path.join(input_dir, input_rel_path)
+        if args.split_conversations:
+            try:
+                targets = split_targets(input_dir, output_dir, input_rel_path, args.conversations)
+            except ValueError as e:
+                failed += 1
+                print(f"❌ {input_rel_path}: {e}", file=sys.stderr)
+                continue
+        else:
+            output_path = os.path.join(output_dir, os.path.splitext(json_name(input_rel_path))[0] + '.docx')
+            targets = [(input_rel_path, output_path, None)]
+        key = input_key(input_path, options, lang) if args.check == 'hash' else None
+        for rel_path, output_path, entry in targets:
+            if not args.force and is_up_to_date(input_path, output_path, key, manifest.get(rel_path), args.check):
+                skipped += 1
+                continue
+            pending.append((rel_path, input_path, output_path, key, entry))
+
+    converted = messages = 0
+    start = time.perf_counter()
+    last_save = start
+    if pending:
+        # Preparato prima di avviare il pool, così i processi lo ereditano
+        preload()
+        workers = args.render_workers or args.jobs
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            jobs = []
+            for rel_path, input_path, output_path, key, entry in pending:
+                os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+                # Si scrive su un file .part rinominato solo a conversione riuscita:
+                # un'interruzione non lascia output parziali che sembrerebbero aggiornati
+                jobs.append((rel_path, input_path, output_path, key, entry, output_path + '.part'))
+            if args.render_workers:
+                finished = zip(jobs, convert_serially(jobs, executor, options, lang))
+            else:
+                futures = {executor.submit(convert_file, job[1], job[5], options, lang, entry=job[4]): job
+                           for job in jobs}
+                finished = ((futures[future], future) for future in as_completed(futures))
+            try:
+                for (rel_path, input_path, output_path, key, entry, part_path), future in finished:
+                    error = future.exception()
+                    if error is None:
+                        os.replace(part_path, output_path)
+                        converted += 1
+                        messages += future.result()[1]
+                        if key is not None:
+                            manifest[rel_path] = key
+                        print(f"✅ {rel_path}")
+                    else:
+                        failed += 1
+                        if os.path.exists(part_path):
+                            os.remove(part_path)
+                        print(f"❌ {rel_path}: {error}", file=sys.stderr)
+                    if args.check == 'hash' and time.perf_counter() - last_save >= MANIFEST_SAVE_INTERVAL:
+                        save_manifest(manifest_path, manifest)
+                        last_save = time.perf_counter()
+            except KeyboardInterrupt:
+                executor.shutdown(wait=False, cancel_futures=True)
+                for part_path in (job[5] for job in jobs):
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                print("Interrotto: i file convertiti finora restano validi", file=sys.stderr)
+            finally:
+                if args.check == 'hash':
+                    save_manifest(manifest_path, manifest)
+    elapsed = time.perf_counter() - start
+
+    # Riepilogo del throughput
+    print()
+    print(f"convertiti: {converted}  saltati: {skipped}  errori: {failed}  in {elapsed:.2f} s")
+    if converted and elapsed > 0:
+        print(f"throughput: {converted / elapsed:.2f} file/s, {messages / elapsed:.0f} messaggi/s ({workers} processi)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
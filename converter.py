@@ -0,0 +1,1355 @@
+import os
+import re
+import copy
+import json
+import tempfile
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+from docx import Document
+from docx.shared import Emu, Inches, Pt, RGBColor
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import nsdecls, qn
+from docx.oxml.styles import styleId_from_name
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+import metrics
+from branches import ACTIVE, select_branch
+from json_stream import (conversation_slice, index_conversations, is_multi_conversation, load_conversation,
+                         select_conversations)
+from reasoning import split_reasoning
+from images import DocumentImages, has_images, image_extra
+from ooxml_writer import (WRITE_BUFFER_SIZE, DocxTemplate, StreamingDocxWriter, TABLE_END_XML, cell_prefix_xml,
+                          drawing_xml, paragraph_xml, run_xml, table_row_xml, table_start_xml)
+
+# Carica le traduzioni (percorso relativo al modulo, non alla cartella di lavoro)
+TRANSLATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'translations.json')
+with open(TRANSLATIONS_PATH, 'r', encoding='utf-8') as f:
+    TRANSLATIONS = json.load(f)
+
+def format_timestamp(ts):
+    try:
+        dt = datetime.fromtimestamp(ts / 1000)
+        return dt.strftime("%d/%m/%Y %H:%M:%S")
+    except:
+        return str(ts)
+
+def get_text(key, lang='it'):
+    return TRANSLATIONS.get(lang, TRANSLATIONS['it']).get(key, key)
+
+# Rimuove i blocchi di reasoning content generati dal modello
+def strip_reasoning_content(text):
+    if not text:
+        return ""
+    # Blocchi <<<reasoning_content_start>>>...<<<reasoning_content_end>>> ed eventuali
+    # aperture senza chiusura (fino a fine stringa), in un'unica scansione
+    return split_reasoning(text, keep_reasoning=False)[0]
+
+# Funzione per pulire il testo (mantenuta per compatibilità, ora non rimuove più i marcatori markdown)
+def clean_text(text):
+    if not text:
+        return ""
+    text = strip_reasoning_content(text)
+    return text
+
+# Converte le espressioni LaTeX in simboli Unicode leggibili
+LATEX_SYMBOLS = {
+    r'\Psi': 'Ψ', r'\psi': 'ψ', r'\Phi': 'Φ', r'\phi': 'φ',
+    r'\alpha': 'α', r'\beta': 'β', r'\gamma': 'γ', r'\delta': 'δ',
+    r'\Delta': 'Δ', r'\Gamma': 'Γ', r'\Lambda': 'Λ', r'\lambda': 'λ',
+    r'\mu': 'μ', r'\nu': 'ν', r'\pi': 'π', r'\Pi': 'Π',
+    r'\rho': 'ρ', r'\sigma': 'σ', r'\Sigma': 'Σ', r'\tau': 'τ',
+    r'\theta': 'θ', r'\Theta': 'Θ', r'\omega': 'ω', r'\Omega': 'Ω',
+    r'\epsilon': 'ε', r'\eta': 'η', r'\xi': 'ξ', r'\zeta': 'ζ',
+    r'\chi': 'χ', r'\kappa': 'κ', r'\iota': 'ι', r'\upsilon': 'υ',
+    r'\infty': '∞', r'\partial': '∂', r'\nabla': '∇',
+    r'\sum': '∑', r'\prod': '∏', r'\int': '∫',
+    r'\sqrt': '√', r'\pm': '±', r'\mp': '∓',
+    r'\times': '×', r'\div': '÷', r'\cdot': '·',
+    r'\leq': '≤', r'\geq': '≥', r'\neq': '≠',
+    r'\approx': '≈', r'\equiv': '≡', r'\sim': '∼',
+    r'\in': '∈', r'\notin': '∉', r'\subset': '⊂', r'\supset': '⊃',
+    r'\cup': '∪', r'\cap': '∩', r'\emptyset': '∅',
+    r'\forall': '∀', r'\exists': '∃', r'\neg': '¬',
+    r'\wedge': '∧', r'\vee': '∨', r'\oplus': '⊕',
+    r'\rightarrow': '→', r'\leftarrow': '←', r'\Rightarrow': '⇒',
+    r'\Leftarrow': '⇐', r'\leftrightarrow': '↔', r'\Leftrightarrow': '⇔',
+    r'\uparrow': '↑', r'\downarrow': '↓',
+    r'\hbar': 'ℏ', r'\ell': 'ℓ', r'\Re': 'ℜ', r'\Im': 'ℑ',
+    r'\circ': '∘', r'\bullet': '•', r'\ldots': '…', r'\cdots': '⋯',
+    r'\^': '^', r'\_': '_',
+}
+
+# Tabelle e regex del traduttore LaTeX, compilate una sola volta all'import.
+# L'alternanza è ordinata per lunghezza decrescente: a ogni posizione vince il comando
+# più lungo, come nelle sostituzioni sequenziali dal più lungo al più corto.
+_LATEX_SYMBOL_RE = re.compile('|'.join(
+    re.escape(cmd) for cmd in sorted(LATEX_SYMBOLS, key=len, reverse=True)))
+_SUP_MAP = str.maketrans({'0':'⁰','1':'¹','2':'²','3':'³','4':'⁴','5':'⁵','6':'⁶','7':'⁷','8':'⁸','9':'⁹','+':'⁺','-':'⁻','n':'ⁿ'})
+_SUP_DIGITS_MAP = str.maketrans({'0':'⁰','1':'¹','2':'²','3':'³','4':'⁴','5':'⁵','6':'⁶','7':'⁷','8':'⁸','9':'⁹'})
+_SUB_MAP = str.maketrans({'0':'₀','1':'₁','2':'₂','3':'₃','4':'₄','5':'₅','6':'₆','7':'₇','8':'₈','9':'₉','+':'₊','-':'₋','n':'ₙ'})
+_SUP_CHAR_RE = re.compile(r'\^(\w)')
+_SUB_CHAR_RE = re.compile(r'_(\w)')
+_SIZING_RE = re.compile(r'\\(left|right|big|Big|bigg|Bigg)')
+_TRAILING_BACKSLASH_RE = re.compile(r'\\(?=\s|$)')
+
+class _DelimiterIndex:
+    """
+    Trova la prossima occorrenza di un delimitatore in un testo.
+    Le ricerche arrivano con posizioni di partenza non decrescenti, quindi un risultato
+    resta valido finché non viene superato: ogni carattere è esaminato al più una volta
+    e il costo complessivo è lineare anche con migliaia di delimitatori spaiati.
+    """
+    __slots__ = ('text', 'token', 'start', 'found')
+
+    def __init__(self, text, token):
+        self.text = text
+        self.token = token
+        self.start = 0
+        self.found = None
+
+    def find(self, start):
+        if self.found is not None and start >= self.start:
+            if self.found == -1 or self.found >= start:
+                return self.found
+        self.start = start
+        self.found = self.text.find(self.token, start)
+        return self.found
+
+def _sub_braced(text, opener, groups, repl):
+    """
+    Equivalente lineare di re.sub(opener + r'\{([^}]+)\}' * groups, repl): ogni gruppo
+    arriva fino alla prima '}' successiva e non può essere vuoto.
+    """
+    openers = _DelimiterIndex(text, opener)
+    # Un indice per gruppo, così ciascuno riceve ricerche con partenza non decrescente
+    closers = [_DelimiterIndex(text, '}') for _ in range(groups)]
+    parts = []
+    last_end = 0
+    pos = openers.find(0)
+    while pos != -1:
+        content_start = pos + len(opener)
+        captured = []
+        for group_closers in closers:
+            close = group_closers.find(content_start)
+            if close <= content_start or (len(captured) + 1 < groups and text[close + 1:close + 2] != '{'):
+                break
+            captured.append(text[content_start:close])
+            content_start = close + 2
+        if len(captured) < groups:
+            pos = openers.find(pos + 1)
+            continue
+        parts.append(text[last_end:pos])
+        parts.append(repl(*captured))
+        last_end = content_start - 1
+        pos = openers.find(last_end)
+    if not parts:
+        return text
+    parts.append(text[last_end:])
+    return ''.join(parts)
+
+# Dimensione della cache LRU delle espressioni già convertite
+LATEX_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=LATEX_CACHE_SIZE)
+def convert_latex_expr(expr):
+    """Converte il contenuto di una singola espressione $...$ in Unicode."""
+    # Sostituisce comandi LaTeX noti con simboli Unicode in un'unica scansione
+    if '\\' in expr:
+        expr = _LATEX_SYMBOL_RE.sub(lambda m: LATEX_SYMBOLS[m.group(0)], expr)
+    # Gestisce ^{...} → apici (usa caratteri superscript dove possibile).
+    # L'ordine dei passaggi è mantenuto: l'output di uno può essere input del successivo.
+    if '^' in expr:
+        expr = _sub_braced(expr, '^{', 1, lambda g: g.translate(_SUP_MAP))
+        expr = _SUP_CHAR_RE.sub(lambda m: m.group(1).translate(_SUP_DIGITS_MAP), expr)
+    # Gestisce _{...} → pedici
+    if '_' in expr:
+        expr = _sub_braced(expr, '_{', 1, lambda g: g.translate(_SUB_MAP))
+        expr = _SUB_CHAR_RE.sub(lambda m: m.group(1).translate(_SUB_MAP), expr)
+    if '\\' in expr:
+        # Gestisce \frac{a}{b} → a/b
+        expr = _sub_braced(expr, '\\frac{', 2, lambda a, b: f'{a}/{b}')
+        # Rimuove \left \right e altri comandi di dimensionamento
+        expr = _SIZING_RE.sub('', expr)
+    # Rimuove eventuali {} rimasti
+    expr = expr.replace('{', '').replace('}', '')
+    # Rimuove backslash rimasti seguiti da spazio o fine
+    if '\\' in expr:
+        expr = _TRAILING_BACKSLASH_RE.sub('', expr)
+    return expr.strip()
+
+def _replace_math(text, delimiter, multiline):
+    """
+    Sostituisce le espressioni delimitate da `delimiter` (equivalente lineare di
+    re.sub(r'\$(.+?)\$') e della variante $$...$$ con DOTALL).
+    """
+    size = len(delimiter)
+    openers = _DelimiterIndex(text, delimiter)
+    closers = _DelimiterIndex(text, delimiter)
+    newlines = None if multiline else _DelimiterIndex(text, '\n')
+    parts = []
+    last_end = 0
+    pos = openers.find(0)
+    while pos != -1:
+        close = closers.find(pos + size + 1)
+        if close == -1:
+            # Nessuna chiusura più avanti: anche i delimitatori successivi restano spaiati
+            break
+        if newlines is not None:
+            nl = newlines.find(pos + size)
+            if nl != -1 and nl < close:
+                pos = openers.find(pos + 1)
+                continue
+        parts.append(text[last_end:pos])
+        parts.append(convert_latex_expr(text[pos + size:close]))
+        last_end = close + size
+        pos = openers.find(last_end)
+    if not parts:
+        return text
+    parts.append(text[last_end:])
+    return ''.join(parts)
+
+def latex_to_unicode(text):
+    """Converte espressioni LaTeX $...$ in testo Unicode leggibile."""
+    if '$' not in text:
+        return text
+    # Prima $$...$$ (anche su più righe), poi $...$ (inline math) sul risultato
+    result = _replace_math(text, '$$', multiline=True)
+    return _replace_math(result, '$', multiline=False)
+
+def parse_inline_markdown(text, base_bold=False, base_italic=False):
+    """
+    Suddivide una riga in segmenti (testo, grassetto, corsivo) riconoscendo
+    ***grassetto+corsivo***, **grassetto** e *corsivo* dopo la conversione del LaTeX.
+    Ha la stessa semantica del pattern \*\*\*(.+?)\*\*\*|\*\*(.+?)\*\*|\*(.+?)\* ma
+    tempo lineare nella lunghezza della riga anche con molti '*' spaiati.
+    """
+    # Prima converti il LaTeX in Unicode
+    text = latex_to_unicode(text)
+    if '*' not in text:
+        return [(text, base_bold, base_italic)] if text else []
+    
+    openers = _DelimiterIndex(text, '*')
+    singles = _DelimiterIndex(text, '*')
+    doubles = _DelimiterIndex(text, '**')
+    triples = _DelimiterIndex(text, '***')
+    newlines = _DelimiterIndex(text, '\n')
+    segments = []
+    last_end = 0
+    pos = openers.find(0)
+    while pos != -1:
+        # Il contenuto non può attraversare un a capo
+        nl = newlines.find(pos + 1)
+        limit = len(text) if nl == -1 else nl
+        match = None
+        if text.startswith('***', pos):
+            close = triples.find(pos + 4)
+            if close != -1 and close <= limit:
+                match = (close + 3, text[pos + 3:close], True, True)
+        if match is None and text.startswith('**', pos):
+            close = doubles.find(pos + 3)
+            if close != -1 and close <= limit:
+                match = (close + 2, text[pos + 2:close], True, base_italic)
+        if match is None:
+            close = singles.find(pos + 2)
+            if close != -1 and close <= limit:
+                match = (close + 1, text[pos + 1:close], base_bold, True)
+        if match is None:
+            pos = openers.find(pos + 1)
+            continue
+        
+        end, content, bold, italic = match
+        # Testo prima del match
+        if pos > last_end:
+            segments.append((text[last_end:pos], base_bold, base_italic))
+        segments.append((content, bold, italic))
+        last_end = end
+        pos = openers.find(end)
+    
+    # Testo rimanente
+    if last_end < len(text):
+        segments.append((text[last_end:], base_bold, base_italic))
+    return segments
+
+# Parsa il markdown inline (grassetto e corsivo) e aggiunge run al paragrafo.
+# Grassetto e corsivo arrivano dagli stili di carattere registrati da ensure_custom_styles.
+def add_inline_markdown(paragraph, text, base_size=11, base_bold=False, base_italic=False, color=None):
+    for segment, bold, italic in parse_inline_markdown(text, base_bold, base_italic):
+        run = add_styled_run(paragraph, segment, INLINE_STYLES.get((bold, italic)))
+        # Formattazione diretta solo dove differisce da quella del documento
+        if base_size != BODY_FONT_SIZE:
+            run.font.size = Pt(base_size)
+        if color:
+            run.font.color.rgb = color
+
+# Tokenizer a blocchi: una sola regex compilata classifica ogni riga del messaggio
+_BLOCK_LINE_RE = re.compile(r"""
+    (?P<hashes>\#+)\s+(?P<heading>.*)                # heading: # testo, ## testo, ### testo
+  | (?P<separator>-{3,}|\*{3,}|_{3,})\Z             # separatore: --- *** ___
+  | [*\-•]\s+(?P<bullet>.+)                          # punto elenco: * testo, - testo, • testo
+  | \d+[.)]\s+(?P<numbered>.+)                       # elenco numerato: 1. testo, 1) testo
+""", re.VERBOSE)
+
+# Celle ammesse nella riga di separazione di una tabella (---|:-:|...)
+_TABLE_SEPARATOR_CELLS = {'', '-', ':', '---', ':--', '--:', ':-:', ':---', '---:', ':---:'}
+
+def is_markdown_table(line):
+    return line.strip().startswith('|') and line.strip().endswith('|')
+
+# Apertura di un blocco di codice: ``` o ~~~ (almeno tre) seguiti dall'eventuale linguaggio
+_FENCE_RE = re.compile(r'(?P<indent>[ \t]*)(?P<fence>`{3,}|~{3,})(?P<info>[^`]*)\Z')
+
+def unescape_text(content, tabs=True):
+    """
+    Sostituisce le sequenze letterali \\n (e \\t) degli export con a capo e tabulazioni
+    veri, tranne nei blocchi di codice recintati (riconosciuti come in tokenize_markdown),
+    dove fanno parte del codice: printf("a\\n") resta su una riga.
+    """
+    if '\\' not in content:
+        return content
+    if '```' not in content and '~~~' not in content:
+        content = content.replace('\\n', '\n')
+        return content.replace('\\t', '\t') if tabs else content
+    lines = content.split('\n')
+    fence = None
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if fence is not None:
+            # Righe del codice e recinzione di chiusura restano intatte
+            if stripped[:len(fence)] == fence and not stripped.strip(fence[0]):
+                fence = None
+            continue
+        if stripped[:3] in ('```', '~~~'):
+            m = _FENCE_RE.match(line)
+            # Una recinzione seguita da \\n letterali è un export con gli a capo tutti escapati
+            if m is not None and '\\n' not in m.group('info'):
+                fence = m.group('fence')
+                continue
+        if '\\' in line:
+            line = line.replace('\\n', '\n')
+            lines[i] = line.replace('\\t', '\t') if tabs else line
+    return '\n'.join(lines)
+
+def _code_block(lines, indent, fence, info):
+    """
+    Blocco di codice dalle righe che seguono l'apertura fino alla chiusura (una riga con
+    almeno altrettanti caratteri della recinzione) o alla fine del messaggio. Le righe
+    restano intatte, salvo il rientro della recinzione stessa.
+    """
+    code = []
+    fence_char = fence[0]
+    for line in lines:
+        stripped = line.strip()
+        if stripped[:len(fence)] == fence and not stripped.strip(fence_char):
+            break
+        if indent and line.startswith(indent):
+            line = line[len(indent):]
+        # Fine riga \r\n: il \r diventerebbe un secondo a capo
+        code.append(line[:-1] if line[-1:] == '\r' else line)
+    return {'type': 'code', 'language': info.strip().split(' ', 1)[0], 'data': '\n'.join(code)}
+
+def tokenize_markdown(content):
+    """
+    Scansiona il contenuto di un messaggio una sola volta e produce un flusso di blocchi
+    tipizzati: {'type': 'heading', 'level': n, 'data': testo}, {'type': 'bullet' | 'numbered'
+    | 'paragraph', 'data': testo}, {'type': 'table', 'data': righe}, {'type': 'separator'},
+    {'type': 'code', 'language': linguaggio, 'data': codice}. Le righe dentro un blocco di
+    codice recintato (```) non passano dalle regex delle righe né dal markdown inline.
+    """
+    if not content:
+        return
+    table_data = None
+    lines = iter(content.split('\n'))
+    for line in lines:
+        stripped = line.strip()
+        
+        # Righe consecutive che iniziano e finiscono con | formano una tabella
+        if stripped[:1] == '|' and stripped[-1:] == '|':
+            row = [cell.strip() for cell in stripped.split('|')[1:-1]]
+            if table_data is None:
+                table_data = []
+            # Salta la riga di separazione (---|---|)
+            if not all(cell in _TABLE_SEPARATOR_CELLS for cell in row):
+                table_data.append(row)
+            continue
+        if table_data is not None:
+            if table_data:
+                yield {'type': 'table', 'data': table_data}
+            table_data = None
+        
+        if not stripped:
+            continue
+        if stripped[:3] in ('```', '~~~'):
+            fence = _FENCE_RE.match(line)
+            if fence is not None:
+                # Le righe del codice vengono consumate qui, senza tornare al ciclo principale
+                yield _code_block(lines, fence.group('indent'), fence.group('fence'), fence.group('info'))
+                continue
+        m = _BLOCK_LINE_RE.match(stripped)
+        if m is None:
+            yield {'type': 'paragraph', 'data': stripped}
+        elif m.group('hashes'):
+            yield {'type': 'heading', 'level': min(len(m.group('hashes')), 3), 'data': m.group('heading')}
+        elif m.group('separator'):
+            yield {'type': 'separator'}
+        elif m.group('bullet') is not None:
+            yield {'type': 'bullet', 'data': m.group('bullet')}
+        else:
+            yield {'type': 'numbered', 'data': m.group('numbered')}
+    
+    if table_data:
+        yield {'type': 'table', 'data': table_data}
+
+# Risolve un blocco del tokenizer per il rendering: LaTeX negli heading, markdown inline
+# (già suddiviso in run) per paragrafi ed elenchi. Tabelle, separatori e codice restano invariati.
+def resolve_block(block, italic=False):
+    kind = block['type']
+    if kind == 'heading':
+        return {'type': 'heading', 'level': block['level'], 'text': latex_to_unicode(block['data'])}
+    if kind in ('paragraph', 'bullet', 'numbered'):
+        runs = parse_inline_markdown(block['data'], base_italic=italic)
+        metrics.count('runs', len(runs))
+        return {'type': kind, 'runs': runs}
+    return block
+
+def build_blocks(content, italic=False):
+    return [resolve_block(block, italic) for block in tokenize_markdown(content)]
+
+# Spaziatura degli elementi di elenco e rientro del contenuto extra
+LIST_SPACING = Pt(2)
+EXTRA_INDENT = Inches(0.3)
+
+# Aggiunge al doc un blocco già risolto da resolve_block
+def add_resolved_block(doc, block, indent=None, images=None, text_width=None):
+    kind = block['type']
+    
+    if kind == 'image':
+        return append_fragment(doc, image_block_xml(block, indent, images))
+    
+    if kind == 'code':
+        # Un solo run con <w:br/> tra le righe: costruito come XML, senza passare da run.text
+        return append_fragment(doc, code_block_xml(block, indent))
+    
+    if kind == 'heading':
+        return add_body_paragraph(doc, block['text'], style=f"Heading {block['level']}")
+    
+    if kind == 'table':
+        _count_table(block['data'])
+        with metrics.stage('tables'):
+            return add_table_to_doc(doc, block['data'], text_width=text_width)
+    
+    if kind == 'separator':
+        return add_body_paragraph(doc, '─' * 60, style='Message Divider')
+    
+    # Punti elenco, elenchi numerati e paragrafi normali con inline markdown
+    if kind == 'bullet' or kind == 'numbered':
+        style = 'List Bullet' if kind == 'bullet' else 'List Number'
+        p = add_body_paragraph(doc, style=style, spacing=LIST_SPACING, indent=indent)
+    else:
+        p = add_body_paragraph(doc, style='Message Body', indent=indent)
+    for segment, bold, italic in block['runs']:
+        add_styled_run(p, segment, INLINE_STYLES.get((bold, italic)))
+    return p
+
+def _count_table(table_data):
+    if table_data:
+        metrics.count('tables')
+        metrics.count('table_cells', len(table_data) * len(table_data[0]))
+
+# Aggiunge un blocco del tokenizer al doc gestendo heading markdown e inline markdown
+def add_markdown_block(doc, block, indent=None, italic=False):
+    ensure_custom_styles(doc)
+    return add_resolved_block(doc, resolve_block(block, italic), indent=indent)
+
+# Aggiunge al doc tutto il contenuto markdown di un messaggio (testo, elenchi, tabelle)
+def add_markdown_content(doc, content, indent=None, italic=False):
+    for block in tokenize_markdown(content):
+        add_markdown_block(doc, block, indent=indent, italic=italic)
+
+# Aggiunge una riga di testo al doc gestendo heading markdown e inline markdown
+def add_markdown_line(doc, line, indent=None, italic=False):
+    for block in tokenize_markdown(line.strip()):
+        return add_markdown_block(doc, block, indent=indent, italic=italic)
+
+# Colori dell'intestazione dei messaggi e dei metadati
+USER_COLOR = RGBColor(33, 150, 243)
+ASSISTANT_COLOR = RGBColor(76, 175, 80)
+GREY = RGBColor(158, 158, 158)
+
+# Dimensione del testo del corpo: coincide con quella di default del documento (sz 22)
+BODY_FONT_SIZE = 11
+
+# Carattere a spaziatura fissa e sfondo (esadecimale) dei blocchi di codice
+CODE_FONT = 'Consolas'
+CODE_SHADING = 'F2F2F2'
+
+# Stili personalizzati registrati una sola volta per documento. I run e i paragrafi
+# li referenziano per id invece di ripetere la formattazione diretta su ogni elemento.
+CUSTOM_STYLES = [
+    {'name': 'Message Body', 'type': WD_STYLE_TYPE.PARAGRAPH, 'space_before': 3, 'space_after': 3},
+    {'name': 'Message Divider', 'type': WD_STYLE_TYPE.PARAGRAPH, 'align': WD_ALIGN_PARAGRAPH.CENTER},
+    {'name': 'Metadata Table', 'type': WD_STYLE_TYPE.PARAGRAPH, 'bold': True},
+    {'name': 'Table Header', 'type': WD_STYLE_TYPE.PARAGRAPH, 'size': 11, 'bold': True},
+    {'name': 'Table Body', 'type': WD_STYLE_TYPE.PARAGRAPH, 'size': 10},
+    {'name': 'Inline Bold', 'type': WD_STYLE_TYPE.CHARACTER, 'bold': True},
+    {'name': 'Inline Italic', 'type': WD_STYLE_TYPE.CHARACTER, 'italic': True},
+    {'name': 'Inline Bold Italic', 'type': WD_STYLE_TYPE.CHARACTER, 'bold': True, 'italic': True},
+    {'name': 'User Header', 'type': WD_STYLE_TYPE.CHARACTER, 'size': 12, 'bold': True, 'color': USER_COLOR},
+    {'name': 'Assistant Header', 'type': WD_STYLE_TYPE.CHARACTER, 'size': 12, 'bold': True, 'color': ASSISTANT_COLOR},
+    {'name': 'Role Header', 'type': WD_STYLE_TYPE.CHARACTER, 'size': 12, 'bold': True, 'color': GREY},
+    {'name': 'Message Number', 'type': WD_STYLE_TYPE.CHARACTER, 'size': 10, 'color': GREY},
+    {'name': 'Message Metadata', 'type': WD_STYLE_TYPE.CHARACTER, 'size': 9, 'color': GREY},
+    {'name': 'Metadata Note', 'type': WD_STYLE_TYPE.CHARACTER, 'size': 9, 'italic': True, 'color': GREY},
+    {'name': 'Extra Content Label', 'type': WD_STYLE_TYPE.CHARACTER, 'size': 10, 'bold': True},
+    {'name': 'Reasoning Text', 'type': WD_STYLE_TYPE.PARAGRAPH, 'space_before': 0, 'space_after': 0,
+     'size': 8, 'color': GREY},
+    {'name': 'Code Block', 'type': WD_STYLE_TYPE.PARAGRAPH, 'space_before': 3, 'space_after': 3,
+     'size': 9, 'font': CODE_FONT, 'shading': CODE_SHADING},
+]
+
+# Stile di carattere per ogni combinazione (grassetto, corsivo) del markdown inline.
+# I paragrafi non impostano mai grassetto/corsivo: sono proprietà "toggle" e si annullerebbero.
+INLINE_STYLES = {
+    (True, False): 'Inline Bold',
+    (False, True): 'Inline Italic',
+    (True, True): 'Inline Bold Italic',
+}
+
+def style_id(name):
+    return styleId_from_name(name)
+
+_INLINE_STYLE_IDS = {key: style_id(name) for key, name in INLINE_STYLES.items()}
+
+def ensure_custom_styles(doc):
+    # Il flag sulla part evita di ripetere le ricerche negli stili ad ogni chiamata
+    part = doc.part
+    if getattr(part, '_custom_styles_ready', False):
+        return
+    styles = doc.styles
+    for spec in CUSTOM_STYLES:
+        if spec['name'] in styles:
+            continue
+        style = styles.add_style(spec['name'], spec['type'])
+        if spec['type'] == WD_STYLE_TYPE.PARAGRAPH:
+            style.base_style = styles['Normal']
+            if 'shading' in spec:
+                # Prima della spaziatura: CT_PPr vuole w:shd prima di w:spacing
+                style.element.get_or_add_pPr().append(OxmlElement(
+                    'w:shd', attrs={_VAL: 'clear', qn('w:color'): 'auto', qn('w:fill'): spec['shading']}))
+            if 'space_before' in spec:
+                style.paragraph_format.space_before = Pt(spec['space_before'])
+                style.paragraph_format.space_after = Pt(spec['space_after'])
+            if 'align' in spec:
+                style.paragraph_format.alignment = spec['align']
+        if 'size' in spec:
+            style.font.size = Pt(spec['size'])
+        if 'font' in spec:
+            style.font.name = spec['font']
+        if spec.get('bold'):
+            style.font.bold = True
+        if spec.get('italic'):
+            style.font.italic = True
+        if 'color' in spec:
+            style.font.color.rgb = spec['color']
+    part._custom_styles_ready = True
+
+_SECT_PR = qn('w:sectPr')
+_VAL = qn('w:val')
+_XML_SPACE = qn('xml:space')
+_TEXT_SPECIAL_CHARS = re.compile(r'[\t\n\r]')
+
+def _append_to_body(doc, element):
+    # sectPr è sempre l'ultimo figlio del body: inserire prima di lui costa O(1),
+    # mentre doc.add_paragraph lo cerca scorrendo tutti i figli (costo quadratico sul documento)
+    # (len() su un elemento lxml scorre i figli, per questo si usa l'indice -1)
+    body = doc.element.body
+    try:
+        last = body[-1]
+    except IndexError:
+        last = None
+    if last is not None and last.tag == _SECT_PR:
+        last.addprevious(element)
+    else:
+        body.append(element)
+
+def add_body_paragraph(doc, text='', style=None, spacing=None, indent=None):
+    """
+    Come doc.add_paragraph, ma in tempo costante: il paragrafo e le sue proprietà
+    (stile, spaziatura prima/dopo, rientro sinistro) sono costruiti direttamente.
+    """
+    p = OxmlElement('w:p')
+    if style or spacing is not None or indent:
+        # Ordine degli elementi richiesto da CT_PPr: pStyle, spacing, ind
+        pPr = OxmlElement('w:pPr')
+        if style:
+            pPr.append(OxmlElement('w:pStyle', attrs={_VAL: style_id(style)}))
+        if spacing is not None:
+            twips = str(spacing.twips)
+            pPr.append(OxmlElement('w:spacing', attrs={qn('w:before'): twips, qn('w:after'): twips}))
+        if indent:
+            pPr.append(OxmlElement('w:ind', attrs={qn('w:left'): str(indent.twips)}))
+        p.append(pPr)
+    _append_to_body(doc, p)
+    paragraph = Paragraph(p, doc)
+    if text:
+        add_styled_run(paragraph, text)
+    return paragraph
+
+def add_styled_run(paragraph, text, style=None):
+    """
+    Come paragraph.add_run(text, style) ma costruisce direttamente <w:r>: run.text
+    elabora il testo carattere per carattere e la ricerca dello stile per nome è una xpath.
+    """
+    r = OxmlElement('w:r')
+    if style:
+        rPr = OxmlElement('w:rPr')
+        rPr.append(OxmlElement('w:rStyle', attrs={_VAL: style_id(style)}))
+        r.append(rPr)
+    paragraph._p.append(r)
+    run = Run(r, paragraph)
+    if _TEXT_SPECIAL_CHARS.search(text):
+        # Tabulazioni e a capo diventano <w:tab/> e <w:br/>
+        run.text = text
+    elif text:
+        t = OxmlElement('w:t')
+        t.text = text
+        if text[0].isspace() or text[-1].isspace():
+            t.set(_XML_SPACE, 'preserve')
+        r.append(t)
+    return run
+
+# Righe di tabella convertite in XML per ogni blocco (limita la stringa intermedia)
+TABLE_BATCH_ROWS = 500
+
+# Funzione per aggiungere una tabella al documento Word
+def add_table_to_doc(doc, table_data, style='Table Grid', text_width=None):
+    """
+    Costruisce la tabella in un solo passaggio generando l'XML delle righe a blocchi,
+    senza passare dai proxy riga/cella di python-docx (costo lineare in righe × colonne).
+    La formattazione di intestazione e corpo è data dagli stili di paragrafo.
+    text_width è la larghezza del testo (EMU): chi aggiunge più tabelle la calcola una volta
+    con _text_width e la passa, perché doc.sections scorre tutto il body del documento.
+    """
+    if not table_data:
+        return
+    
+    ensure_custom_styles(doc)
+    if text_width is None:
+        text_width = _text_width(doc)
+    
+    # La prima riga è l'intestazione
+    num_cols = len(table_data[0])
+    col_width = _column_width(text_width, num_cols)
+    
+    # Stesso XML di CT_Tbl.new_tbl più table.style, con gli id di stile ricavati dai nomi
+    # invece di cercarli tra gli stili del documento
+    start_xml = table_start_xml(num_cols, col_width, style_id(style))
+    tbl = parse_xml(start_xml.replace('<w:tbl>', f'<w:tbl {nsdecls("w")}>', 1) + TABLE_END_XML)
+    _append_to_body(doc, tbl)
+    
+    header_prefix = cell_prefix_xml(col_width, style_id('Table Header'))
+    body_prefix = cell_prefix_xml(col_width, style_id('Table Body'))
+    
+    for start in range(0, len(table_data), TABLE_BATCH_ROWS):
+        batch = []
+        for row_idx in range(start, min(start + TABLE_BATCH_ROWS, len(table_data))):
+            prefix = header_prefix if row_idx == 0 else body_prefix
+            batch.append(table_row_xml(table_data[row_idx], num_cols, prefix))
+        rows = parse_xml(f'<w:tbl {nsdecls("w")}>{"".join(batch)}</w:tbl>')
+        tbl.extend(list(rows))
+    
+    return Table(tbl, doc)
+
+# Nomi mostrati per utente e assistente (personalizzati o di default)
+def role_labels(options, lang):
+    user_label = options.get('custom_user_name', '').strip() or get_text('default_user', lang)
+    assistant_label = options.get('custom_assistant_name', '').strip() or get_text('default_assistant', lang)
+    return user_label, assistant_label
+
+def build_message_model(msg, idx, options, lang, labels=None):
+    """
+    Prepara un messaggio per il rendering, indipendentemente dal backend: intestazione,
+    blocchi di contenuto già risolti, contenuto extra e tempi. None se il messaggio va saltato.
+    """
+    role = msg.get('role', 'unknown')
+    content = msg.get('content', '')
+    msg_type = msg.get('type', 'text')
+    timestamp = msg.get('timestamp', 0)
+    
+    if not content and msg_type != 'text':
+        return None
+    
+    user_label, assistant_label = labels or role_labels(options, lang)
+    
+    # Colori (dagli stili di intestazione)
+    if role == 'user':
+        role_display = user_label
+        role_style = 'User Header'
+    elif role == 'assistant':
+        role_display = assistant_label
+        role_style = 'Assistant Header'
+    else:
+        role_display = f"📋 {role.upper()}"
+        role_style = 'Role Header'
+    
+    model = {
+        'number': f"[{idx}] " if options.get('show_numbers') else None,
+        'role': role_display,
+        'role_style': role_style,
+        'date': f" • {format_timestamp(timestamp)}" if options.get('show_date') else None,
+        'model': None,
+        'blocks': [],
+        'extra_label': None,
+        'extra_blocks': [],
+        'timing': None,
+        'divider': bool(options.get('show_divider')),
+        'reasoning': None,
+    }
+    
+    # Modello AI
+    if options.get('show_model') and role == 'assistant' and msg.get('model'):
+        model['model'] = f"   📡 {msg.get('model')}"
+    
+    # Contenuto del messaggio: testo, elenchi e tabelle con supporto markdown
+    if content:
+        content_clean = unescape_text(content)
+        with metrics.stage('reasoning'):
+            if options.get('reasoning') == 'appendix':
+                # Il ragionamento non compare nel messaggio ma in appendice
+                content_clean, model['reasoning'] = split_reasoning(content_clean)
+            else:
+                content_clean = clean_text(content_clean)
+        with metrics.stage('markdown'):
+            model['blocks'] = build_blocks(content_clean)
+    
+    # Contenuto Extra
+    extra = msg.get('extra', [])
+    if extra:
+        model['extra_label'] = get_text('extra_content', lang)
+        for item in extra:
+            if isinstance(item, dict):
+                if item.get('type') == 'TEXT' and item.get('name') == 'Pasted':
+                    extra_content = item.get('content', '')
+                    if extra_content:
+                        with metrics.stage('reasoning'):
+                            extra_clean = clean_text(unescape_text(extra_content, tabs=False))
+                        # Anche per l'extra content, rileva tabelle
+                        with metrics.stage('markdown'):
+                            model['extra_blocks'].extend(build_blocks(extra_clean, italic=True))
+                image = image_extra(item)
+                if image is not None:
+                    # Il base64 viene decodificato solo al rendering, nel documento di destinazione
+                    name, data_url = image
+                    model['extra_blocks'].append({'type': 'image', 'name': name, 'data': data_url})
+    
+    # Dati Prompt (Timing)
+    if options.get('show_prompt'):
+        timings = msg.get('timings', {})
+        if timings and role == 'assistant':
+            timing_text = f"Prompt: {timings.get('prompt_n', 'N/A')} token ({timings.get('prompt_ms', 0):.1f}ms) | "
+            timing_text += f"Output: {timings.get('predicted_n', 'N/A')} token ({timings.get('predicted_ms', 0):.1f}ms)"
+            model['timing'] = "⏱️ " + timing_text
+    
+    return model
+
+def conversation_metadata(conv, lang):
+    t = lambda k: get_text(k, lang)
+    return [
+        (t('conv_id'), conv.get('id', 'N/A')),
+        (t('conv_name'), conv.get('name', 'N/A')),
+        (t('conv_last_mod'), format_timestamp(conv.get('lastModified', 0))),
+        (t('conv_node'), conv.get('currNode', 'N/A')[:20] + '...' if len(conv.get('currNode', '')) > 20 else conv.get('currNode', 'N/A'))
+    ]
+
+def render_message(doc, model, images=None, text_width=None):
+    # Intestazione del messaggio
+    add_body_paragraph(doc)
+    p = add_body_paragraph(doc)
+    if model['number']:
+        add_styled_run(p, model['number'], 'Message Number')
+    add_styled_run(p, model['role'], model['role_style'])
+    if model['date']:
+        add_styled_run(p, model['date'], 'Message Metadata')
+    
+    if model['model']:
+        p_model = add_body_paragraph(doc)
+        add_styled_run(p_model, model['model'], 'Metadata Note')
+    
+    for block in model['blocks']:
+        add_resolved_block(doc, block, text_width=text_width)
+    
+    if model['extra_label']:
+        add_body_paragraph(doc)
+        p_extra = add_body_paragraph(doc)
+        add_styled_run(p_extra, model['extra_label'], 'Extra Content Label')
+        for block in model['extra_blocks']:
+            add_resolved_block(doc, block, indent=EXTRA_INDENT, images=images, text_width=text_width)
+    
+    if model['timing']:
+        p_timing = add_body_paragraph(doc)
+        add_styled_run(p_timing, model['timing'], 'Message Metadata')
+    
+    # Separatore finale
+    if model['divider']:
+        add_body_paragraph(doc)
+        add_body_paragraph(doc, '─' * 60, style='Message Divider')
+
+def convert_json_to_docx(json_data, doc, options, lang, fragments=None, executor=None, images=None):
+    with metrics.stage('render'):
+        _convert_json_to_docx(json_data, doc, options, lang, fragments, executor, images)
+
+def conversation_messages(json_data, options):
+    """Messaggi da renderizzare: il ramo scelto con options['branch'] (default il ramo attivo)."""
+    # Il tempo di decodifica incrementale dei messaggi va nella fase parse
+    messages = metrics.timed(json_data.get('messages', []), 'parse', 'messages')
+    with metrics.stage('branches'):
+        selected = select_branch(messages, json_data.get('conv') or {}, options.get('branch') or ACTIVE,
+                                 json_data.get('spans'))
+    # Anche i messaggi del ramo riletti dal file durante il rendering contano come parse
+    return selected if selected is messages else metrics.timed(selected, 'parse')
+
+def _convert_json_to_docx(json_data, doc, options, lang, fragments, executor, images):
+    t = lambda k: get_text(k, lang)
+    ensure_custom_styles(doc)
+    
+    # Informazioni sulla conversazione
+    conv = json_data.get('conv', {})
+    
+    # Titolo del documento
+    title = doc.add_heading(t('doc_title'), 0)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    # Informazioni della conversazione
+    doc.add_paragraph()
+    p_info = doc.add_paragraph()
+    run = p_info.add_run(t('doc_info'))
+    run.bold = True
+    run.font.size = Pt(DOC_INFO_SIZE)
+    
+    # Tabella metadati
+    table_meta = doc.add_table(rows=4, cols=2)
+    table_meta.style = 'Table Grid'
+    
+    for i, (label, value) in enumerate(conversation_metadata(conv, lang)):
+        row = table_meta.rows[i]
+        row.cells[0].text = label
+        row.cells[1].text = value
+        for cell in row.cells:
+            cell.paragraphs[0]._p.style = style_id('Metadata Table')
+
+    if options.get('show_divider'):
+        add_body_paragraph(doc)
+        add_body_paragraph(doc, '━' * 60)
+        add_body_paragraph(doc)
+
+    # Processa i messaggi del ramo scelto
+    messages = conversation_messages(json_data, options)
+    labels = role_labels(options, lang)
+    appendix = ReasoningAppendix(lang)
+    # Calcolata una volta: doc.sections scorre il body, che cresce con i messaggi
+    text_width = _text_width(doc)
+
+    if fragments is not None or executor is not None:
+        # Con la cache dei frammenti o il rendering parallelo i messaggi passano dal loro XML:
+        # quelli invariati rispetto a un export precedente non vengono renderizzati di nuovo
+        for xml in iter_message_fragments(messages, options, lang, text_width, fragments, executor, images):
+            body, _, reasoning = xml.partition(APPENDIX_SEPARATOR)
+            if body:
+                with metrics.stage('render'):
+                    append_fragment(doc, body)
+            appendix.add(reasoning)
+    else:
+        for idx, msg in enumerate(messages, 1):
+            model = build_message_model(msg, idx, options, lang, labels)
+            if model is not None:
+                render_message(doc, model, images, text_width)
+                if model['reasoning']:
+                    appendix.add(reasoning_xml(model))
+
+    xml = appendix.read()
+    if xml:
+        append_fragment(doc, xml)
+
+_base_document = None
+
+def base_document():
+    """Documento vuoto già configurato (margini e stili personalizzati), preparato una volta."""
+    global _base_document
+    if _base_document is None:
+        doc = Document()
+        
+        for section in doc.sections:
+            section.top_margin = Inches(1)
+            section.bottom_margin = Inches(1)
+            section.left_margin = Inches(1)
+            section.right_margin = Inches(1)
+        
+        ensure_custom_styles(doc)
+        _base_document = doc
+    return _base_document
+
+def new_document():
+    # Copia del documento base: niente rilettura del template di python-docx
+    # né creazione degli stili ad ogni richiesta
+    return copy.deepcopy(base_document())
+
+def preload():
+    """
+    Prepara documento base e template del backend stream. Va chiamata all'avvio e,
+    con un server pre-fork, prima del fork: i worker ereditano tutto già pronto.
+    """
+    base_document()
+    stream_template()
+
+# Il JSON può arrivare da un percorso o da un file già aperto (testo o binario),
+# ad esempio direttamente dallo stream dell'upload senza passare dal disco
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+def process_json(source, options, lang, fragments=None, executor=None):
+    if _is_path(source):
+        with open(source, 'rb') as f:
+            return process_json(f, options, lang, fragments, executor)
+    
+    # Parsing incrementale: i messaggi vengono letti e renderizzati uno alla volta
+    return render_conversations(iter_conversations(source, options), options, lang, fragments, executor)
+
+def iter_conversations(source, options):
+    """
+    Conversazioni da esportare, aperte con load_conversation: l'unica di un export singolo,
+    o quelle scelte con options['conversations'] da un export multiplo (array di
+    conversazioni), lette ognuna dal proprio intervallo di byte. source deve essere
+    posizionabile; ogni conversazione va consumata prima di passare alla successiva.
+    """
+    with metrics.stage('parse'):
+        multi = is_multi_conversation(source)
+        json_data = None if multi else load_conversation(source)
+    if not multi:
+        yield json_data
+        return
+    with metrics.stage('index'):
+        entries = select_conversations(index_conversations(source), options.get('conversations'))
+    if not entries:
+        raise ValueError("Nessuna conversazione corrisponde alla selezione")
+    for entry in entries:
+        with metrics.stage('parse'):
+            json_data = load_conversation(conversation_slice(source, entry))
+        yield json_data
+
+def render_document(json_data, options, lang, fragments=None, executor=None):
+    return render_conversations([json_data], options, lang, fragments, executor)
+
+def render_conversations(conversations, options, lang, fragments=None, executor=None):
+    """Documento con le conversazioni date, una dopo l'altra separate da un'interruzione di pagina."""
+    doc = new_document()
+    # python-docx copia l'immagine nella parte word/media/imageN: i file temporanei si chiudono subito dopo
+    images = DocumentImages(lambda part, image: doc.part.get_or_add_image(part)[0], _text_width(doc))
+    try:
+        for position, json_data in enumerate(conversations):
+            if position:
+                with metrics.stage('render'):
+                    doc.add_page_break()
+            convert_json_to_docx(json_data, doc, options, lang, fragments, executor, images)
+    finally:
+        images.close()
+    
+    with metrics.stage('render'):
+        add_body_paragraph(doc)
+        if options.get('show_divider'):
+            add_body_paragraph(doc, '━' * 60)
+        p_footnote = add_body_paragraph(doc)
+        add_styled_run(p_footnote, "📄 " + get_text('generated_at', lang), 'Metadata Note')
+    
+    return doc
+
+# ---------------------------------------------------------------------------
+# Backend "stream": scrive word/document.xml direttamente nello zip, messaggio per
+# messaggio, senza costruire l'albero python-docx. Stesso modello e stessi stili.
+# ---------------------------------------------------------------------------
+
+BACKENDS = ('docx', 'stream')
+
+# Dimensione del testo "Informazioni conversazione" (formattazione diretta)
+DOC_INFO_SIZE = 14
+
+_stream_template = None
+
+def stream_template():
+    """Parti fisse del documento (stili personalizzati e margini inclusi), calcolate una volta."""
+    global _stream_template
+    if _stream_template is None:
+        doc = base_document()
+        template = DocxTemplate.from_document(doc)
+        template.text_width = _text_width(doc)
+        _stream_template = template
+    return _stream_template
+
+def _column_width(text_width, num_cols):
+    # Stessa larghezza di colonna calcolata da CT_Tbl.new_tbl
+    return Emu(text_width // num_cols).twips
+
+def table_xml(table_data, text_width, cell_styles=('Table Header', 'Table Body')):
+    num_cols = len(table_data[0])
+    col_width = _column_width(text_width, num_cols)
+    header_prefix = cell_prefix_xml(col_width, style_id(cell_styles[0]))
+    body_prefix = cell_prefix_xml(col_width, style_id(cell_styles[1]))
+    parts = [table_start_xml(num_cols, col_width, style_id('Table Grid'))]
+    for row_idx, row in enumerate(table_data):
+        parts.append(table_row_xml(row, num_cols, header_prefix if row_idx == 0 else body_prefix))
+    parts.append(TABLE_END_XML)
+    return ''.join(parts)
+
+def image_block_xml(block, indent=None, images=None):
+    """
+    Paragrafo con l'immagine di un extra, registrata una sola volta nel documento di images;
+    se l'immagine non è leggibile (o manca images) resta il suo nome.
+    """
+    image = images.add(block['data'], indent or 0) if images is not None else None
+    twips = indent.twips if indent else None
+    if image is None:
+        runs = run_xml(f"🖼️ {block['name']}", _INLINE_STYLE_IDS[(False, True)])
+    else:
+        runs = drawing_xml(*image, block['name'])
+    return paragraph_xml(runs, style_id('Message Body'), indent=twips)
+
+def code_block_xml(block, indent=None):
+    """Paragrafo 'Code Block' con il codice così com'è, in un solo run (a capo come <w:br/>)."""
+    return paragraph_xml(run_xml(block['data']), style_id('Code Block'), indent=indent.twips if indent else None)
+
+def block_xml(block, text_width, indent=None, images=None):
+    """XML di un blocco già risolto, equivalente a add_resolved_block."""
+    kind = block['type']
+    
+    if kind == 'image':
+        return image_block_xml(block, indent, images)
+    
+    if kind == 'code':
+        return code_block_xml(block, indent)
+    
+    if kind == 'heading':
+        return paragraph_xml(run_xml(block['text']), style_id(f"Heading {block['level']}"))
+    
+    if kind == 'table':
+        _count_table(block['data'])
+        with metrics.stage('tables'):
+            return table_xml(block['data'], text_width) if block['data'] else ''
+    
+    if kind == 'separator':
+        return paragraph_xml(run_xml('─' * 60), style_id('Message Divider'))
+    
+    runs = ''.join(run_xml(segment, _INLINE_STYLE_IDS.get((bold, italic)))
+                   for segment, bold, italic in block['runs'])
+    indent = indent.twips if indent else None
+    if kind == 'bullet' or kind == 'numbered':
+        style = 'List Bullet' if kind == 'bullet' else 'List Number'
+        return paragraph_xml(runs, style_id(style), spacing=LIST_SPACING.twips, indent=indent)
+    return paragraph_xml(runs, style_id('Message Body'), indent=indent)
+
+def message_xml(model, text_width, images=None):
+    """XML di un messaggio, equivalente a render_message."""
+    header = ''
+    if model['number']:
+        header += run_xml(model['number'], style_id('Message Number'))
+    header += run_xml(model['role'], style_id(model['role_style']))
+    if model['date']:
+        header += run_xml(model['date'], style_id('Message Metadata'))
+    parts = [paragraph_xml(), paragraph_xml(header)]
+    
+    if model['model']:
+        parts.append(paragraph_xml(run_xml(model['model'], style_id('Metadata Note'))))
+    
+    for block in model['blocks']:
+        parts.append(block_xml(block, text_width))
+    
+    if model['extra_label']:
+        parts.append(paragraph_xml())
+        parts.append(paragraph_xml(run_xml(model['extra_label'], style_id('Extra Content Label'))))
+        for block in model['extra_blocks']:
+            parts.append(block_xml(block, text_width, indent=EXTRA_INDENT, images=images))
+    
+    if model['timing']:
+        parts.append(paragraph_xml(run_xml(model['timing'], style_id('Message Metadata'))))
+    
+    if model['divider']:
+        parts.append(paragraph_xml())
+        parts.append(paragraph_xml(run_xml('─' * 60), style_id('Message Divider')))
+    return ''.join(parts)
+
+# Separatore, dentro un frammento, tra il body del messaggio e la sua voce nell'appendice
+# dei ragionamenti: NUL non può comparire nell'XML (run_xml lo scarta)
+APPENDIX_SEPARATOR = '\x00'
+
+# Oltre questa dimensione (caratteri) l'appendice in costruzione passa su file temporaneo
+APPENDIX_SPOOL_SIZE = 4 * 1024 * 1024
+
+def reasoning_xml(model):
+    """Voce compatta dell'appendice: numero e ruolo del messaggio, poi il ragionamento riga per riga."""
+    parts = [paragraph_xml(run_xml((model['number'] or '') + model['role'], style_id('Message Number')))]
+    for line in model['reasoning'].split('\n'):
+        if line.strip():
+            parts.append(paragraph_xml(run_xml(line), style_id('Reasoning Text')))
+    return ''.join(parts)
+
+class ReasoningAppendix:
+    """
+    Voci dell'appendice dei ragionamenti raccolte durante il rendering dei messaggi e
+    aggiunte in fondo al documento. Le voci grandi finiscono su un file temporaneo,
+    così la memoria del backend stream resta limitata.
+    """
+    
+    def __init__(self, lang):
+        self.lang = lang
+        self._file = None
+    
+    def add(self, xml):
+        if not xml:
+            return
+        if self._file is None:
+            self._file = tempfile.SpooledTemporaryFile(max_size=APPENDIX_SPOOL_SIZE, mode='w+', encoding='utf-8')
+            self._file.write(paragraph_xml(run_xml(get_text('reasoning_appendix', self.lang)), style_id('Heading 1')))
+        self._file.write(xml)
+    
+    def chunks(self, size=WRITE_BUFFER_SIZE):
+        """XML dell'appendice a blocchi (niente se nessun messaggio aveva un ragionamento)."""
+        if self._file is None:
+            return
+        with self._file:
+            self._file.seek(0)
+            yield from iter(lambda: self._file.read(size), '')
+        self._file = None
+    
+    def read(self):
+        return ''.join(self.chunks())
+
+def message_model(msg, idx, options, lang, labels, fragments=None):
+    """
+    Come build_message_model, ripreso dalla cache dei frammenti se già costruito (ad esempio
+    da un'anteprima) e lì conservato: il documento esportato dopo non rianalizza il markdown.
+    """
+    # I modelli con immagini conterrebbero il base64: non vanno in cache
+    if fragments is None or has_images(msg):
+        return build_message_model(msg, idx, options, lang, labels)
+    with metrics.stage('fragments'):
+        key, digest, model = fragments.lookup_model(msg, idx, options, lang)
+    if model is None:
+        model = build_message_model(msg, idx, options, lang, labels)
+        if model is not None:
+            fragments.store_model(key, digest, model)
+    return model
+
+def message_fragment(msg, idx, options, lang, labels, text_width, fragments=None, images=None):
+    """
+    XML di un messaggio ('' se va saltato), ripreso dalla cache dei frammenti se invariato
+    o generato dal modello in cache se c'è solo quello.
+    Con il ragionamento in appendice la voce relativa segue APPENDIX_SEPARATOR.
+    I messaggi con immagini non passano dalla cache: il loro XML fa riferimento alle
+    relazioni del documento in corso (images).
+    """
+    if fragments is None or has_images(msg):
+        return _render_fragment(msg, idx, options, lang, labels, text_width, images=images)
+    with metrics.stage('fragments'):
+        key, digest, xml = fragments.lookup(msg, idx, options, lang)
+        model = fragments.model(key, digest) if xml is None else None
+    if xml is None:
+        xml = _render_fragment(msg, idx, options, lang, labels, text_width, model)
+        fragments.store(key, digest, xml)
+    return xml
+
+def _render_fragment(msg, idx, options, lang, labels, text_width, model=None, images=None):
+    with metrics.stage('render'):
+        if model is None:
+            model = build_message_model(msg, idx, options, lang, labels)
+        if model is None:
+            return ''
+        xml = message_xml(model, text_width, images)
+        if model['reasoning']:
+            xml += APPENDIX_SEPARATOR + reasoning_xml(model)
+        return xml
+
+# Messaggi inviati insieme a un processo del pool nel rendering parallelo e numero
+# massimo di blocchi in attesa di essere uniti al documento
+PARALLEL_CHUNK_MESSAGES = 64
+PARALLEL_MAX_IN_FLIGHT = 2 * (os.cpu_count() or 1)
+
+def render_fragments_chunk(items, options, lang, text_width):
+    """
+    Eseguita nel processo worker: XML dei messaggi [(idx, msg, modello), ...] nell'ordine
+    dato. Se il modello è già pronto (dalla cache) il messaggio non viene inviato.
+    """
+    labels = role_labels(options, lang)
+    return [_render_fragment(msg, idx, options, lang, labels, text_width, model) for idx, msg, model in items]
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_message_fragments(messages, options, lang, text_width, fragments=None, executor=None, images=None):
+    """
+    XML dei messaggi nell'ordine originale. Con executor (un pool di processi) i messaggi
+    sono renderizzati in parallelo a blocchi; i blocchi in volo sono limitati, quindi la
+    memoria non cresce con la lunghezza della conversazione. images raccoglie le immagini
+    del documento in corso.
+    """
+    labels = role_labels(options, lang)
+    if executor is None:
+        for idx, msg in enumerate(messages, 1):
+            yield message_fragment(msg, idx, options, lang, labels, text_width, fragments, images)
+        return
+    
+    in_flight = deque()
+    for chunk in _chunked(enumerate(messages, 1), PARALLEL_CHUNK_MESSAGES):
+        # I messaggi con immagini si renderizzano qui: le immagini vanno registrate nel documento
+        local = {idx: _render_fragment(msg, idx, options, lang, labels, text_width, images=images)
+                 for idx, msg in chunk if has_images(msg)}
+        # I messaggi già in cache non vanno al pool; di quelli con il solo modello in cache
+        # si invia il modello al posto del messaggio
+        with metrics.stage('fragments'):
+            lookups = [(None, None, local[idx]) if idx in local else
+                       fragments.lookup(msg, idx, options, lang) if fragments is not None else (None, None, None)
+                       for idx, msg in chunk]
+            missing = []
+            for (idx, msg), (key, digest, xml) in zip(chunk, lookups):
+                if xml is None:
+                    model = fragments.model(key, digest) if fragments is not None else None
+                    missing.append((idx, msg if model is None else None, model))
+        future = executor.submit(render_fragments_chunk, missing, options, lang, text_width) if missing else None
+        in_flight.append((lookups, future))
+        if len(in_flight) >= PARALLEL_MAX_IN_FLIGHT:
+            yield from _collect_chunk(*in_flight.popleft(), fragments)
+    while in_flight:
+        yield from _collect_chunk(*in_flight.popleft(), fragments)
+
+def _collect_chunk(lookups, future, fragments):
+    # L'attesa dei processi del pool conta come rendering
+    with metrics.stage('render'):
+        rendered = iter(future.result()) if future is not None else iter(())
+    for key, digest, xml in lookups:
+        if xml is None:
+            xml = next(rendered)
+            if fragments is not None:
+                fragments.store(key, digest, xml)
+        yield xml
+
+def _text_width(doc):
+    section = doc.sections[-1]
+    return section.page_width - section.left_margin - section.right_margin
+
+def append_fragment(doc, xml):
+    # Il frammento contiene più elementi di primo livello: si avvolge in un body per il parsing
+    for element in list(parse_xml(f'<w:body {nsdecls("w")}>{xml}</w:body>')):
+        _append_to_body(doc, element)
+
+def header_xml(conv, options, lang, text_width):
+    """Titolo, informazioni e tabella metadati, come all'inizio di convert_json_to_docx."""
+    t = lambda k: get_text(k, lang)
+    parts = [
+        paragraph_xml(run_xml(t('doc_title')), style_id('Title'), align='center'),
+        paragraph_xml(),
+        paragraph_xml(run_xml(t('doc_info'), rpr=f'<w:b/><w:sz w:val="{DOC_INFO_SIZE * 2}"/>')),
+    ]
+    meta = [[label, value] for label, value in conversation_metadata(conv, lang)]
+    parts.append(table_xml(meta, text_width, cell_styles=('Metadata Table', 'Metadata Table')))
+    if options.get('show_divider'):
+        parts.append(paragraph_xml())
+        parts.append(paragraph_xml(run_xml('━' * 60)))
+        parts.append(paragraph_xml())
+    return ''.join(parts)
+
+def footer_xml(options, lang):
+    parts = [paragraph_xml()]
+    if options.get('show_divider'):
+        parts.append(paragraph_xml(run_xml('━' * 60)))
+    parts.append(paragraph_xml(run_xml("📄 " + get_text('generated_at', lang), style_id('Metadata Note'))))
+    return ''.join(parts)
+
+# Interruzione di pagina tra due conversazioni, come doc.add_page_break()
+PAGE_BREAK_XML = paragraph_xml('<w:r><w:br w:type="page"/></w:r>')
+
+def stream_json_to_docx(json_data, fp, options, lang, fragments=None, executor=None):
+    """Scrive in fp il .docx della conversazione senza tenere in memoria il documento."""
+    stream_conversations_to_docx([json_data], fp, options, lang, fragments, executor)
+
+def stream_conversations_to_docx(conversations, fp, options, lang, fragments=None, executor=None):
+    """Come stream_json_to_docx, con più conversazioni separate da un'interruzione di pagina."""
+    template = stream_template()
+    text_width = template.text_width
+    # Le immagini restano nei file temporanei finché il writer non le copia nello zip, alla chiusura
+    images = DocumentImages(lambda part, image: writer.add_image(part, image.ext, image.content_type), text_width)
+    try:
+        # Compressione e scrittura nello zip corrispondono a doc.save: tutto ciò che non
+        # rientra in una fase più interna (parse, render, ...) viene contato come save
+        with metrics.stage('save'), StreamingDocxWriter(fp, template) as writer:
+            for position, json_data in enumerate(conversations):
+                if position:
+                    writer.write(PAGE_BREAK_XML)
+                with metrics.stage('render'):
+                    header = header_xml(json_data.get('conv', {}), options, lang, text_width)
+                writer.write(header)
+                messages = conversation_messages(json_data, options)
+                appendix = ReasoningAppendix(lang)
+                for xml in iter_message_fragments(messages, options, lang, text_width, fragments, executor, images):
+                    body, _, reasoning = xml.partition(APPENDIX_SEPARATOR)
+                    if body:
+                        writer.write(body)
+                    appendix.add(reasoning)
+                for chunk in appendix.chunks():
+                    writer.write(chunk)
+            writer.write(footer_xml(options, lang))
+    finally:
+        images.close()
+
+def write_docx(source, fp, options, lang, fragments=None, executor=None):
+    """
+    Converte il JSON (percorso o file aperto) e scrive il .docx in fp
+    con il backend scelto in options['backend']. fragments è un'eventuale
+    FragmentCache da cui riprendere i messaggi già renderizzati; executor un
+    pool di processi con cui renderizzare i messaggi in parallelo. Da un export
+    multiplo le conversazioni scelte finiscono tutte nello stesso documento.
+    """
+    if _is_path(source):
+        with open(source, 'rb') as f:
+            return write_docx(f, fp, options, lang, fragments, executor)
+    if metrics.active():
+        metrics.count('bytes_in', _stream_size(source))
+    write_conversations(iter_conversations(source, options), fp, options, lang, fragments, executor)
+
+def _stream_size(fp):
+    # Dimensione di un file aperto e posizionabile, senza spostarne la posizione corrente
+    try:
+        position = fp.tell()
+        size = fp.seek(0, os.SEEK_END)
+        fp.seek(position)
+        return size - position
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+def write_conversation(json_data, fp, options, lang, fragments=None, executor=None):
+    """Come write_docx, per una conversazione già aperta con load_conversation."""
+    write_conversations([json_data], fp, options, lang, fragments, executor)
+
+def write_conversations(conversations, fp, options, lang, fragments=None, executor=None):
+    """Come write_conversation, per più conversazioni nello stesso documento."""
+    start = _tell(fp) if metrics.active() else None
+    if options.get('backend') == 'stream':
+        stream_conversations_to_docx(conversations, fp, options, lang, fragments, executor)
+    else:
+        doc = render_conversations(conversations, options, lang, fragments, executor)
+        with metrics.stage('save'):
+            doc.save(fp)
+    if start is not None:
+        metrics.count('bytes_out', _tell(fp) - start)
+
+def _tell(fp):
+    try:
+        return fp.tell()
+    except (AttributeError, OSError):
+        return None
@@ -0,0 +1,119 @@
+# Immagini allegate ai messaggi (extra di tipo immagine): decodifica a blocchi del base64,
+# deduplicazione per hash del contenuto e registrazione di una sola parte per immagine nel .docx.
+import hashlib
+import binascii
+import tempfile
+
+from docx.image.exceptions import UnrecognizedImageError
+from docx.image.image import Image
+
+import metrics
+
+# Tipi degli extra immagine: webui attuale e webui React precedente
+IMAGE_EXTRA_TYPES = ('IMAGE', 'imageFile')
+
+# Caratteri base64 decodificati per blocco (multiplo di 4: i blocchi restano allineati)
+DECODE_CHUNK_CHARS = 4 * 1024 * 1024
+
+# Oltre questa dimensione (byte) un'immagine decodificata passa su file temporaneo
+IMAGE_SPOOL_SIZE = 1024 * 1024
+
+
+def image_extra(item):
+    """(nome, data URL) di un extra immagine, None per gli altri extra."""
+    if not isinstance(item, dict) or item.get('type') not in IMAGE_EXTRA_TYPES:
+        return None
+    data_url = item.get('base64Url')
+    if not isinstance(data_url, str) or not data_url:
+        return None
+    return item.get('name') or 'image', data_url
+
+
+def has_images(msg):
+    """True se il messaggio ha immagini tra gli extra (non passa dalla cache dei frammenti)."""
+    extra = msg.get('extra')
+    return bool(extra) and isinstance(extra, list) and any(image_extra(item) for item in extra)
+
+
+def _base64_payload(data_url):
+    # "data:image/png;base64,AAAA..." -> posizione del primo carattere base64
+    if data_url.startswith('data:'):
+        return data_url.index(',') + 1
+    return 0
+
+
+def _decoded_chunks(data_url):
+    """Byte dell'immagine a blocchi, senza creare la copia decodificata intera."""
+    start = _base64_payload(data_url)
+    for offset in range(start, len(data_url), DECODE_CHUNK_CHARS):
+        yield binascii.a2b_base64(data_url[offset:offset + DECODE_CHUNK_CHARS])
+
+
+class DocumentImages:
+    """
+    Immagini di un documento, ciascuna registrata una sola volta con add_part(fp, image),
+    che la aggiunge al pacchetto e ne restituisce l'rId. Le ripetizioni della stessa
+    immagine (stesso sha256 dei byte decodificati) riusano l'rId della prima, senza
+    decodificarla di nuovo su file. Le immagini più larghe di text_width (EMU) vengono
+    ridotte in proporzione. I file temporanei restano aperti fino a close().
+    """
+
+    def __init__(self, add_part, text_width):
+        self._add_part = add_part
+        self.text_width = text_width
+        self._images = {}
+        self._files = []
+        # Id dei disegni (wp:docPr), unici nel documento
+        self._next_shape_id = 1
+
+    def add(self, data_url, indent=0):
+        """
+        (rId, larghezza EMU, altezza EMU, id del disegno) di un'immagine in un paragrafo con
+        rientro indent (EMU); None se l'immagine non è leggibile.
+        """
+        with metrics.stage('images'):
+            metrics.count('images')
+            try:
+                # Prima passata: solo l'hash, così una ripetizione non costa nessuna copia
+                digest = hashlib.sha256()
+                for chunk in _decoded_chunks(data_url):
+                    digest.update(chunk)
+            except binascii.Error:
+                return None
+            digest = digest.hexdigest()
+            if digest not in self._images:
+                self._images[digest] = self._register(data_url)
+            image = self._images[digest]
+            if image is None:
+                return None
+            rid, width, height = image
+            shape_id = self._next_shape_id
+            self._next_shape_id += 1
+            return (rid,) + scaled_size(width, height, self.text_width - indent) + (shape_id,)
+
+    def _register(self, data_url):
+        fp = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE)
+        self._files.append(fp)
+        for chunk in _decoded_chunks(data_url):
+            fp.write(chunk)
+        fp.seek(0)
+        try:
+            image = Image.from_file(fp)
+        except (UnrecognizedImageError, ValueError, EOFError):
+            # Formato non supportato da python-docx (ad esempio WebP) o intestazione danneggiata
+            return None
+        fp.seek(0)
+        metrics.count('unique_images')
+        return self._add_part(fp, image), image.width, image.height
+
+    def close(self):
+        for fp in self._files:
+            fp.close()
+        self._files = []
+
+
+def scaled_size(width, height, max_width):
+    """Dimensioni (EMU) ridotte in proporzione per stare in max_width."""
+    if width <= max_width or max_width <= 0:
+        return width, height
+    return max_width, round(height * max_width / width)
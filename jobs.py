@@ -0,0 +1,201 @@
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from converter import iter_conversations, preload, write_conversations
+from json_stream import count_messages, index_conversations, is_multi_conversation, select_conversations
+from uploads import compression_of, open_upload
+
+# Intervallo minimo tra due aggiornamenti di avanzamento inviati da un worker (secondi)
+PROGRESS_INTERVAL = 0.25
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Coda dei messaggi di avanzamento, impostata in ogni processo worker
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+    # Già pronto se il processo è nato da un fork dopo il preload; altrimenti lo prepara qui
+    preload()
+
+
+def _report(job_id, status, done=0, total=None):
+    _progress_queue.put((job_id, status, done, total))
+
+
+class _Progress:
+    # Conta i messaggi man mano che il renderer li consuma, anche su più conversazioni
+    def __init__(self, job_id, total):
+        self.job_id = job_id
+        self.total = total
+        self.done = 0
+        self._last = time.monotonic()
+
+    def tracked(self, messages):
+        for msg in messages:
+            yield msg
+            self.done += 1
+            now = time.monotonic()
+            if now - self._last >= PROGRESS_INTERVAL:
+                _report(self.job_id, RUNNING, self.done, self.total)
+                self._last = now
+        _report(self.job_id, RUNNING, self.done, self.total)
+
+
+def run_job(job_id, input_path, output_path, options, lang):
+    """Eseguita nel processo worker: converte input_path e scrive il .docx in output_path."""
+    try:
+        with open(input_path, 'rb') as raw:
+            # Un upload compresso resta compresso su disco e viene decompresso durante la lettura
+            f = open_upload(raw, input_path)
+            if is_multi_conversation(f):
+                # Solo i messaggi delle conversazioni che verranno esportate
+                entries = select_conversations(index_conversations(f), options.get('conversations'))
+                total = sum(entry['messages'] for entry in entries)
+            else:
+                total = count_messages(f)
+        _report(job_id, RUNNING, 0, total)
+        progress = _Progress(job_id, total)
+        with open(input_path, 'rb') as raw, open(output_path, 'wb') as out:
+            f = open_upload(raw, input_path)
+            conversations = (dict(data, messages=progress.tracked(data['messages']))
+                             for data in iter_conversations(f, options))
+            write_conversations(conversations, out, options, lang)
+    finally:
+        os.remove(input_path)
+
+
+class JobManager:
+    """
+    Conversioni asincrone in un pool di processi locale. Ogni job ha una cartella di
+    lavoro propria (input e risultato); i job conclusi scadono dopo ttl secondi e i
+    loro file vengono eliminati.
+    """
+
+    def __init__(self, workers=2, ttl=3600, work_dir=None):
+        self.workers = workers
+        self.ttl = ttl
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix='json2docx-jobs-')
+        os.makedirs(self.work_dir, exist_ok=True)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._progress_queue = None
+
+    def _start(self):
+        # Pool e thread di raccolta dell'avanzamento partono al primo job
+        if self._executor is not None:
+            return
+        context = multiprocessing.get_context()
+        self._progress_queue = context.Queue()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context,
+            initializer=_init_worker, initargs=(self._progress_queue,))
+        threading.Thread(target=self._collect_progress, daemon=True).start()
+
+    def executor(self):
+        """Pool di processi condiviso, usato anche dalle conversioni batch."""
+        with self._lock:
+            self._start()
+        return self._executor
+
+    def _collect_progress(self):
+        while True:
+            job_id, status, done, total = self._progress_queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job['status'] in (DONE, FAILED):
+                    continue
+                job['status'] = status
+                job['done'] = done
+                if total is not None:
+                    job['total'] = total
+
+    def submit(self, upload, options, lang, download_name, upload_name='input.json'):
+        """
+        Salva l'upload (file binario aperto) nella cartella dei job e lo accoda. upload_name
+        è il nome del file caricato: un .json compresso viene copiato così com'è e
+        decompresso dal worker.
+        """
+        self.purge_expired()
+        executor = self.executor()
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.work_dir, job_id)
+        os.makedirs(job_dir)
+        input_path = os.path.join(job_dir, 'input.json' + (compression_of(upload_name) or ''))
+        output_path = os.path.join(job_dir, 'output.docx')
+        with open(input_path, 'wb') as f:
+            shutil.copyfileobj(upload, f)
+        job = {
+            'id': job_id,
+            'status': QUEUED,
+            'done': 0,
+            'total': None,
+            'error': None,
+            'created': time.time(),
+            'finished': None,
+            'dir': job_dir,
+            'result_path': output_path,
+            'download_name': download_name,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        future = executor.submit(run_job, job_id, input_path, output_path, options, lang)
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['finished'] = time.time()
+            error = future.exception()
+            if error is None:
+                job['status'] = DONE
+                if job['total'] is not None:
+                    job['done'] = job['total']
+            else:
+                job['status'] = FAILED
+                job['error'] = str(error)
+
+    def get(self, job_id):
+        """Stato del job (copia), None se sconosciuto o scaduto."""
+        self.purge_expired()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job['finished'] is not None and now - job['finished'] > self.ttl]
+            for job in expired:
+                del self._jobs[job['id']]
+        for job in expired:
+            shutil.rmtree(job['dir'], ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            stats = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                stats[job['status']] += 1
+            stats['workers'] = self.workers
+            return stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
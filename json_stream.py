@@ -0,0 +1,433 @@
+import re
+import json
+import codecs
+from array import array
+
+# Dimensione dei blocchi letti dal file durante il parsing incrementale
+CHUNK_SIZE = 64 * 1024
+
+_NON_WS = re.compile(r'[^ \t\n\r]')
+
+
+class JSONStreamReader:
+    """
+    Lettore JSON incrementale basato su JSONDecoder.raw_decode.
+    Mantiene in memoria solo il blocco corrente più il valore in decodifica,
+    quindi il picco di memoria dipende dal singolo valore più grande.
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        # Posizione nel buffer fino a cui sono stati contati i byte consumati, e il loro numero
+        # (None se fp è aperto in modalità testo e le posizioni in byte non hanno senso)
+        self._mark = 0
+        self._mark_bytes = 0
+
+    def _fill(self, min_size=0):
+        # Legge almeno un blocco (o quanto già in attesa, per crescita geometrica)
+        data = self._fp.read(max(self._chunk_size, min_size))
+        if isinstance(data, bytes):
+            data = self._utf8.decode(data, final=not data)
+        elif data:
+            self._mark_bytes = None
+        if not data:
+            self._eof = True
+        # I caratteri scartati dal buffer vanno contati prima di perderli
+        self._advance_mark()
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        self._mark = 0
+
+    def peek(self):
+        """Restituisce il prossimo carattere significativo senza consumarlo ('' a fine file)."""
+        while True:
+            m = _NON_WS.search(self._buf, self._pos)
+            if m:
+                self._pos = m.start()
+                return self._buf[self._pos]
+            self._pos = len(self._buf)
+            if self._eof:
+                return ''
+            self._fill()
+
+    def _advance_mark(self):
+        # Ogni carattere consumato viene codificato una sola volta: il conteggio resta lineare
+        if self._mark_bytes is not None:
+            self._mark_bytes += len(self._buf[self._mark:self._pos].encode('utf-8'))
+        self._mark = self._pos
+
+    def tell(self):
+        """
+        Byte consumati da fp fino alla posizione corrente, None se fp è aperto in modalità
+        testo.
+        """
+        self._advance_mark()
+        return self._mark_bytes
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON non valido: atteso '{char}', trovato '{found or 'EOF'}'")
+        self._pos += 1
+
+    def read_value(self):
+        """Decodifica il prossimo valore JSON completo."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                self._fill(len(self._buf) - self._pos)
+                continue
+            # Un numero o letterale a fine buffer potrebbe essere troncato
+            if end == len(self._buf) and not self._eof:
+                self._fill(len(self._buf) - self._pos)
+                continue
+            self._pos = end
+            return value
+
+    def next_key(self):
+        """Restituisce la prossima chiave dell'oggetto corrente, None alla chiusura '}'."""
+        char = self.peek()
+        if char == '}':
+            self._pos += 1
+            return None
+        if char == ',':
+            self._pos += 1
+            self.peek()
+        key = self.read_value()
+        if not isinstance(key, str):
+            raise ValueError("JSON non valido: chiave non stringa")
+        self.expect(':')
+        return key
+
+    def iter_array(self, on_range=None):
+        """
+        Itera gli elementi dell'array corrente decodificandoli uno alla volta. on_range, se
+        dato, riceve l'intervallo di byte (offset da tell(), lunghezza) di ogni elemento
+        prima che venga restituito.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            if on_range is None:
+                yield self.read_value()
+            else:
+                self.peek()
+                start = self.tell()
+                value = self.read_value()
+                on_range(start, self.tell() - start)
+                yield value
+            char = self.peek()
+            self._pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f"JSON non valido: atteso ',' o ']', trovato '{char or 'EOF'}'")
+
+    def skip_rest_of_object(self):
+        while self.next_key() is not None:
+            self.read_value()
+
+
+def load_conversation(fp, chunk_size=CHUNK_SIZE):
+    """
+    Legge un export llama.cpp in modo incrementale.
+    Restituisce un dizionario {'conv': ..., 'messages': ..., 'spans': ...} in cui 'messages'
+    è un generatore che decodifica i messaggi uno alla volta dal file e, se fp è un file
+    binario posizionabile, 'spans' un MessageSpans con cui rileggerne alcuni dopo averli
+    consumati (altrimenti None).
+    Il file deve restare aperto finché i messaggi non sono stati consumati.
+    """
+    source, origin = _seekable_source(fp)
+    reader = JSONStreamReader(fp, chunk_size)
+    if reader.peek() != '{':
+        raise ValueError("Formato non supportato: ci si aspetta un oggetto con 'conv' e 'messages'")
+    reader.expect('{')
+
+    conv = None
+    buffered_messages = None
+    while True:
+        key = reader.next_key()
+        if key is None:
+            break
+        if key == 'conv':
+            conv = reader.read_value()
+        elif key == 'messages':
+            if reader.peek() != '[':
+                reader.read_value()
+                continue
+            if conv is not None:
+                # Dopo la prima lettura tell() dice se fp è binario
+                spans = MessageSpans(source, origin) if source is not None and reader.tell() is not None else None
+                return {'conv': conv, 'messages': _iter_messages(reader, spans), 'spans': spans}
+            # 'messages' precede 'conv': serve conv prima dei messaggi, quindi si bufferizza
+            buffered_messages = list(reader.iter_array())
+        else:
+            reader.read_value()
+
+    return {'conv': conv or {}, 'messages': buffered_messages or [], 'spans': None}
+
+
+def _iter_messages(reader, spans=None):
+    yield from reader.iter_array(spans.add if spans is not None else None)
+    reader.skip_rest_of_object()
+
+
+def _seekable_source(fp):
+    # File posizionabile da cui legge fp (quello sotto una fetta di conversation_slice)
+    # e posizione da cui parte la lettura; (None, None) se non è posizionabile
+    source = fp._fp if isinstance(fp, _SliceReader) else fp
+    try:
+        return source, source.tell()
+    except (AttributeError, OSError, ValueError):
+        return None, None
+
+
+class MessageSpans:
+    """
+    Intervalli di byte dei messaggi di una conversazione, registrati durante la lettura
+    incrementale: dopo aver consumato i messaggi se ne possono rileggere dal file solo
+    alcuni, senza averli tenuti tutti in memoria.
+    """
+
+    def __init__(self, fp, origin):
+        self._fp = fp
+        self._origin = origin
+        # Offset (da origin) e lunghezza di ogni messaggio nell'ordine del file, in array
+        # compatti: 16 byte per messaggio anche quando non si rilegge nulla
+        self._offsets = array('q')
+        self._lengths = array('q')
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def add(self, offset, length):
+        self._offsets.append(offset)
+        self._lengths.append(length)
+
+    def read(self, positions):
+        """
+        Messaggi nelle posizioni date (indici nell'ordine del file), riletti uno alla volta
+        nell'ordine di positions. Il file viene letto solo in avanti (un file compresso
+        riparte dall'inizio a ogni salto indietro): se positions non è crescente i messaggi
+        vengono letti prima tutti, in ordine di file, e poi restituiti.
+        """
+        positions = list(positions)
+        if all(a < b for a, b in zip(positions, positions[1:])):
+            for position in positions:
+                yield self._read(position)
+            return
+        messages = {position: self._read(position) for position in sorted(set(positions))}
+        for position in positions:
+            yield messages[position]
+
+    def _read(self, position):
+        self._fp.seek(self._origin + self._offsets[position])
+        return json.loads(self._fp.read(self._lengths[position]))
+
+
+# Stringhe JSON (group 1 vuoto se il blocco finisce prima della chiusura) e parentesi
+_STRUCTURE_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(")?|[\[\]{}]')
+_MESSAGES_KEY = '"messages"'
+
+
+def count_messages(fp, chunk_size=CHUNK_SIZE):
+    """
+    Conta i messaggi di un export senza decodificarli: scansiona solo la struttura
+    (stringhe e parentesi) e conta gli oggetti di primo livello dell'array 'messages'
+    (di tutte le conversazioni, per un export multiplo). Serve a stimare l'avanzamento;
+    fp viene letto fino in fondo.
+    """
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    depth = 0
+    # Profondità delle chiavi di una conversazione: 2 se l'export è un array di conversazioni
+    key_depth = 1
+    count = 0
+    messages_depth = None
+    after_messages_key = False
+    pending = ''
+    while True:
+        # Una stringa lunga in sospeso fa crescere la lettura (crescita geometrica)
+        data = fp.read(max(chunk_size, len(pending)))
+        if isinstance(data, bytes):
+            data = utf8.decode(data, final=not data)
+        if not data:
+            return count
+        buf = pending + data
+        pending = ''
+        for m in _STRUCTURE_RE.finditer(buf):
+            start = m.start()
+            token = buf[start]
+            if token == '"':
+                if m.group(1) is None:
+                    # Stringa spezzata tra due blocchi: si riprende dal suo inizio
+                    pending = buf[start:]
+                    break
+                # Confronto senza estrarre la stringa (i contenuti possono essere lunghi)
+                after_messages_key = (depth == key_depth and m.end() - start == len(_MESSAGES_KEY)
+                                      and buf.startswith(_MESSAGES_KEY, start))
+                continue
+            if token in '[{':
+                if depth == 0 and token == '[':
+                    key_depth = 2
+                if messages_depth is not None and depth == messages_depth and token == '{':
+                    count += 1
+                if after_messages_key and token == '[':
+                    messages_depth = depth + 1
+                depth += 1
+            else:
+                depth -= 1
+                if messages_depth is not None and depth < messages_depth:
+                    messages_depth = None
+            after_messages_key = False
+
+
+# Export multipli ("esporta tutto" della web UI): un array di oggetti {'conv', 'messages'}
+
+_STRUCTURE_BYTES_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*(")?|[\[\]{}]')
+_CONV_KEY_BYTES = b'"conv"'
+_MESSAGES_KEY_BYTES = b'"messages"'
+
+
+def is_multi_conversation(fp):
+    """True se l'export è un array di conversazioni; fp torna alla posizione iniziale."""
+    start = fp.tell()
+    try:
+        while True:
+            data = fp.read(CHUNK_SIZE)
+            if not data:
+                return False
+            data = data.lstrip()
+            if data:
+                return data[:1] in ('[', b'[')
+    finally:
+        fp.seek(start)
+
+
+def index_conversations(fp, chunk_size=CHUNK_SIZE):
+    """
+    Indice di un export multiplo senza decodificare i messaggi: per ogni conversazione
+    posizione, id, nome, ultima modifica, numero di messaggi e intervallo di byte nel file
+    (offset, length), da cui la si può poi leggere da sola con conversation_slice.
+    Si scansiona solo la struttura, come in count_messages; viene decodificato solo 'conv'.
+    fp deve essere aperto in binario e posizionabile e torna alla posizione iniziale.
+    """
+    origin = fp.tell()
+    entries = []
+    depth = 0
+    # Offset nel file del primo byte del buffer corrente
+    offset = origin
+    pending = b''
+    entry = None
+    last_key = None
+    messages_depth = None
+    while True:
+        data = fp.read(max(chunk_size, len(pending)))
+        if isinstance(data, str):
+            raise ValueError("L'indice delle conversazioni richiede un file aperto in binario")
+        if not data:
+            break
+        buf = pending + data
+        pending = b''
+        consumed = len(buf)
+        for m in _STRUCTURE_BYTES_RE.finditer(buf):
+            start = m.start()
+            token = buf[start:start + 1]
+            if token == b'"':
+                if m.group(1) is None:
+                    pending = buf[start:]
+                    consumed = start
+                    break
+                if depth == 2 and entry is not None:
+                    length = m.end() - start
+                    if length == len(_CONV_KEY_BYTES) and buf.startswith(_CONV_KEY_BYTES, start):
+                        last_key = 'conv'
+                    elif length == len(_MESSAGES_KEY_BYTES) and buf.startswith(_MESSAGES_KEY_BYTES, start):
+                        last_key = 'messages'
+                    else:
+                        last_key = None
+                continue
+            if token in (b'[', b'{'):
+                if depth == 0 and token != b'[':
+                    raise ValueError("Formato non supportato: ci si aspetta un array di conversazioni")
+                if depth == 1 and token == b'{':
+                    entry = {'offset': offset + start, 'messages': 0, 'conv_range': None}
+                elif depth == 2 and last_key == 'conv' and token == b'{':
+                    entry['conv_range'] = [offset + start, None]
+                elif depth == 2 and last_key == 'messages' and token == b'[':
+                    messages_depth = 3
+                elif depth == messages_depth and token == b'{':
+                    entry['messages'] += 1
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 2 and entry is not None and entry['conv_range'] and entry['conv_range'][1] is None:
+                    entry['conv_range'][1] = offset + start + 1
+                elif depth == 2 and messages_depth is not None and token == b']':
+                    messages_depth = None
+                elif depth == 1 and entry is not None:
+                    entry['length'] = offset + start + 1 - entry['offset']
+                    entries.append(entry)
+                    entry = None
+            last_key = None
+        offset += consumed
+
+    # Solo gli oggetti 'conv' (piccoli) vengono decodificati, leggendoli dal loro intervallo
+    for position, entry in enumerate(entries):
+        conv = {}
+        conv_range = entry.pop('conv_range')
+        if conv_range is not None:
+            fp.seek(conv_range[0])
+            conv = json.loads(fp.read(conv_range[1] - conv_range[0]).decode('utf-8'))
+        entry.update({
+            'index': position,
+            'id': conv.get('id'),
+            'name': conv.get('name'),
+            'last_modified': conv.get('lastModified'),
+        })
+    fp.seek(origin)
+    return entries
+
+
+def select_conversations(entries, selection=None):
+    """
+    Voci dell'indice scelte da selection: id esatti o parti del nome (senza distinzione
+    di maiuscole) separati da virgole. Senza selezione, tutte.
+    """
+    terms = [term.strip() for term in (selection or '').split(',') if term.strip()]
+    if not terms:
+        return list(entries)
+    lowered = [term.lower() for term in terms]
+    return [entry for entry in entries
+            if entry['id'] in terms or any(term in (entry['name'] or '').lower() for term in lowered)]
+
+
+class _SliceReader:
+    # Lettura limitata a length byte a partire dalla posizione corrente di fp
+    def __init__(self, fp, length):
+        self._fp = fp
+        self._remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fp.read(size)
+        self._remaining -= len(data)
+        return data
+
+
+def conversation_slice(fp, entry):
+    """File-like con la sola conversazione di una voce dell'indice, da passare a load_conversation."""
+    fp.seek(entry['offset'])
+    return _SliceReader(fp, entry['length'])
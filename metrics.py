@@ -0,0 +1,234 @@
+import time
+import threading
+from contextlib import nullcontext
+
+# Limiti superiori (secondi / byte) dei bucket degli istogrammi
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2, 1024 ** 3)
+
+# Contatori registrati dai punti di misura del convertitore
+COUNTERS = ('messages', 'tables', 'table_cells', 'runs', 'images', 'unique_images', 'bytes_in', 'bytes_out')
+
+# Contesto condiviso dalle chiamate senza registrazione attiva: nessun costo oltre al lookup
+_NULL_STAGE = nullcontext()
+
+
+class _State(threading.local):
+    recorder = None
+
+
+_state = _State()
+
+
+class Recorder:
+    """
+    Durate delle fasi e contatori di una singola conversione. Le fasi possono essere
+    annidate: il tempo di una fase interna non viene contato in quella che la contiene.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.total = 0.0
+        self._stack = []
+        self._mark = 0.0
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            outer = self._stack[-1]
+            self.durations[outer] = self.durations.get(outer, 0.0) + now - self._mark
+        self._stack.append(name)
+        self._mark = now
+
+    def exit(self):
+        now = time.perf_counter()
+        name = self._stack.pop()
+        self.durations[name] = self.durations.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, iterator, name, counter=None):
+        # Il tempo passato dentro next() (ad esempio la decodifica incrementale del JSON)
+        # viene attribuito alla fase name
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            if counter is not None:
+                self.count(counter)
+            yield item
+
+    def server_timing(self):
+        """
+        Valore dell'header Server-Timing: fasi in millisecondi e contatori come descrizione,
+        con il prefisso count_ perché un nome non compaia due volte (fase e contatore tables).
+        """
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items()]
+        entries.append(f"total;dur={self.total * 1000:.1f}")
+        entries.extend(f'count_{name};desc="{value}"' for name, value in self.counters.items() if value)
+        return ', '.join(entries)
+
+
+class _Stage:
+    __slots__ = ('recorder', 'name')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.recorder.enter(self.name)
+
+    def __exit__(self, *exc):
+        self.recorder.exit()
+
+
+class recording:
+    """
+    Attiva recorder (se non è None) per il thread corrente finché il blocco è in corso
+    e ne misura la durata totale. Con None i punti di misura restano disattivati.
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self._previous = None
+        self._start = 0.0
+
+    def __enter__(self):
+        self._previous = _state.recorder
+        _state.recorder = self.recorder
+        self._start = time.perf_counter()
+        return self.recorder
+
+    def __exit__(self, *exc):
+        if self.recorder is not None:
+            self.recorder.total += time.perf_counter() - self._start
+        _state.recorder = self._previous
+
+
+def active():
+    return _state.recorder is not None
+
+
+def stage(name):
+    """Contesto che misura la fase name, senza effetto se non c'è una registrazione attiva."""
+    recorder = _state.recorder
+    if recorder is None:
+        return _NULL_STAGE
+    return _Stage(recorder, name)
+
+
+def count(name, n=1):
+    recorder = _state.recorder
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+def timed(iterable, name, counter=None):
+    """iterable con il tempo di produzione degli elementi attribuito a name (e contati in counter)."""
+    recorder = _state.recorder
+    if recorder is None:
+        return iterable
+    return recorder.timed(iter(iterable), name, counter)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        # valori delle etichette -> (conteggi per bucket, somma, numero di osservazioni)
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, observations) in sorted(self._series.items()):
+            for bound, value in zip(self.buckets, counts):
+                labels = _format_labels(self.label_names, label_values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {value}")
+            labels = _format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {observations}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {observations}")
+        return lines
+
+
+class MetricsRegistry:
+    """Aggrega le registrazioni delle conversioni e le espone nel formato testuale di Prometheus."""
+
+    def __init__(self, prefix='json2docx'):
+        self.prefix = prefix
+        self.stage_seconds = Histogram(f'{prefix}_stage_seconds', "Durata delle fasi della conversione",
+                                       STAGE_BUCKETS, ('stage',))
+        self.conversion_seconds = Histogram(f'{prefix}_conversion_seconds', "Durata totale delle conversioni",
+                                            STAGE_BUCKETS, ('backend', 'cache'))
+        self.input_bytes = Histogram(f'{prefix}_input_bytes', "Dimensione dei JSON convertiti",
+                                     SIZE_BUCKETS, ('backend',))
+        self.output_bytes = Histogram(f'{prefix}_output_bytes', "Dimensione dei documenti prodotti",
+                                      SIZE_BUCKETS, ('backend',))
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # Funzioni che restituiscono {nome: valore} di grandezze istantanee (gauge)
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def register_gauges(self, callback):
+        """callback() viene letta a ogni render e i suoi valori esposti come gauge."""
+        self._gauges.append(callback)
+
+    def observe(self, recorder, backend, cache):
+        with self._lock:
+            for name, seconds in recorder.durations.items():
+                self.stage_seconds.observe(seconds, name)
+            self.conversion_seconds.observe(recorder.total, backend, cache)
+            if recorder.counters.get('bytes_in'):
+                self.input_bytes.observe(recorder.counters['bytes_in'], backend)
+            if recorder.counters.get('bytes_out'):
+                self.output_bytes.observe(recorder.counters['bytes_out'], backend)
+            for name, value in recorder.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for histogram in (self.stage_seconds, self.conversion_seconds, self.input_bytes, self.output_bytes):
+                lines.extend(histogram.render())
+            for name, value in self.counters.items():
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            for callback in self._gauges:
+                for name, value in callback().items():
+                    metric = f"{self.prefix}_{name}"
+                    lines.append(f"# TYPE {metric} gauge")
+                    lines.append(f"{metric} {_format_value(value)}")
+            return '\n'.join(lines) + '\n'
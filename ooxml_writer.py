@@ -0,0 +1,234 @@
+import re
+import shutil
+import zipfile
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+# Caratteri non ammessi in XML 1.0: Word rifiuta il documento se compaiono nel testo
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+# Tabulazioni e a capo, che in un run diventano elementi a sé
+_RUN_SPECIAL = re.compile(r'([\t\r\n])')
+_RUN_SPECIAL_XML = {'\t': '<w:tab/>', '\r': '<w:br/>', '\n': '<w:br/>'}
+
+# Dimensione minima delle scritture verso lo stream compresso di document.xml
+WRITE_BUFFER_SIZE = 256 * 1024
+
+DOCUMENT_PART = 'word/document.xml'
+DOCUMENT_RELS_PART = 'word/_rels/document.xml.rels'
+CONTENT_TYPES_PART = '[Content_Types].xml'
+
+IMAGE_RELATIONSHIP = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+
+# Namespace del disegno dichiarati sul <w:drawing>: il frammento resta valido anche
+# quando viene analizzato da solo (append_fragment del backend python-docx)
+_DRAWING_NAMESPACES = (
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+)
+
+
+def run_xml(text, style_id=None, rpr=''):
+    """
+    XML di un run <w:r>, identico a quello di paragraph.add_run(text, style): tabulazioni
+    e a capo diventano <w:tab/> e <w:br/> e ogni tratto di testo tra di essi un <w:t>,
+    con xml:space="preserve" solo se inizia o finisce con uno spazio, come in run.text.
+    """
+    if style_id:
+        rpr = f'<w:rStyle w:val="{style_id}"/>{rpr}'
+    props = f'<w:rPr>{rpr}</w:rPr>' if rpr else ''
+    text = escape(_INVALID_XML_CHARS.sub('', text or ''))
+    if '\t' in text or '\n' in text or '\r' in text:
+        content = ''.join(_RUN_SPECIAL_XML.get(piece) or _text_xml(piece)
+                          for piece in _RUN_SPECIAL.split(text) if piece)
+        return f'<w:r>{props}{content}</w:r>'
+    return f'<w:r>{props}{_text_xml(text) if text else ""}</w:r>'
+
+
+def _text_xml(text):
+    # Come CT_R.add_t: xml:space="preserve" solo con spazi iniziali o finali
+    if text[0].isspace() or text[-1].isspace():
+        return f'<w:t xml:space="preserve">{text}</w:t>'
+    return f'<w:t>{text}</w:t>'
+
+
+def paragraph_xml(runs='', style_id=None, spacing=None, indent=None, align=None):
+    """
+    XML di un paragrafo <w:p> con i run già serializzati.
+    spacing (prima/dopo) e indent (rientro sinistro) sono in twip.
+    """
+    # Ordine degli elementi richiesto da CT_PPr: pStyle, spacing, ind, jc
+    props = []
+    if style_id:
+        props.append(f'<w:pStyle w:val="{style_id}"/>')
+    if spacing is not None:
+        props.append(f'<w:spacing w:before="{spacing}" w:after="{spacing}"/>')
+    if indent:
+        props.append(f'<w:ind w:left="{indent}"/>')
+    if align:
+        props.append(f'<w:jc w:val="{align}"/>')
+    if props:
+        return f'<w:p><w:pPr>{"".join(props)}</w:pPr>{runs}</w:p>'
+    return f'<w:p>{runs}</w:p>' if runs else '<w:p/>'
+
+
+def table_start_xml(num_cols, col_width, style_id=None):
+    """Apertura di <w:tbl> con proprietà e griglia, come CT_Tbl.new_tbl più table.style."""
+    style = f'<w:tblStyle w:val="{style_id}"/>' if style_id else ''
+    grid = f'<w:gridCol w:w="{col_width}"/>' * num_cols
+    return (f'<w:tbl><w:tblPr>{style}<w:tblW w:type="auto" w:w="0"/>'
+            f'<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+            f'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr>'
+            f'<w:tblGrid>{grid}</w:tblGrid>')
+
+
+TABLE_END_XML = '</w:tbl>'
+
+
+def drawing_xml(rid, cx, cy, shape_id, name):
+    """
+    Run con un'immagine in linea, come run.add_picture (struttura di CT_Inline.new_pic_inline).
+    rid è la relazione verso la parte dell'immagine, cx e cy le dimensioni in EMU.
+    """
+    name = escape(_INVALID_XML_CHARS.sub('', name), {'"': '&quot;'})
+    return (f'<w:r><w:drawing {_DRAWING_NAMESPACES}><wp:inline>'
+            f'<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{shape_id}" name="Picture {shape_id}"/>'
+            f'<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+            f'<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+            f'<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="{name}"/><pic:cNvPicPr/></pic:nvPicPr>'
+            f'<pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+            f'<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+            f'<a:prstGeom prst="rect"/></pic:spPr></pic:pic>'
+            f'</a:graphicData></a:graphic></wp:inline></w:drawing></w:r>')
+
+
+def cell_prefix_xml(col_width, style_id):
+    # Apertura di cella e paragrafo condivisa da tutte le celle con lo stesso stile
+    return (f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{col_width}"/></w:tcPr>'
+            f'<w:p><w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>')
+
+
+def table_row_xml(cells, num_cols, cell_prefix):
+    parts = ['<w:tr>']
+    for col_idx in range(num_cols):
+        parts.append(cell_prefix)
+        if col_idx < len(cells) and cells[col_idx]:
+            parts.append(run_xml(cells[col_idx]))
+        parts.append('</w:p></w:tc>')
+    parts.append('</w:tr>')
+    return ''.join(parts)
+
+
+class DocxTemplate:
+    """
+    Parti fisse di un .docx (stili, numerazione, tema, impostazioni...) più l'inizio e la
+    fine di word/document.xml. Si ricava una volta da un documento vuoto già configurato.
+    """
+
+    def __init__(self, parts, document_head, document_tail):
+        self.parts = parts
+        self.document_head = document_head
+        self.document_tail = document_tail
+
+    @classmethod
+    def from_document(cls, doc):
+        buffer = BytesIO()
+        doc.save(buffer)
+        parts = []
+        with zipfile.ZipFile(buffer) as package:
+            for name in package.namelist():
+                if name == DOCUMENT_PART:
+                    document = package.read(name).decode('utf-8')
+                else:
+                    parts.append((name, package.read(name)))
+        # Il body di un documento vuoto contiene solo sectPr: il contenuto va inserito prima
+        body_start = document.index('<w:body>') + len('<w:body>')
+        body_end = document.index('<w:sectPr', body_start)
+        return cls(parts, document[:body_start], document[body_end:])
+
+
+class StreamingDocxWriter:
+    """
+    Scrive un .docx direttamente in uno stream zip: le parti fisse del template sono
+    copiate all'apertura, il body di word/document.xml è compresso man mano che arriva.
+    La memoria usata non dipende dalla lunghezza del documento. Le immagini aggiunte con
+    add_image vengono scritte alla chiusura, con le relazioni e i tipi di contenuto che
+    le dichiarano (per questo quelle due parti sono scritte per ultime).
+    """
+
+    def __init__(self, fp, template):
+        self._zip = zipfile.ZipFile(fp, 'w', zipfile.ZIP_DEFLATED)
+        self._deferred = {}
+        for name, data in template.parts:
+            if name in (DOCUMENT_RELS_PART, CONTENT_TYPES_PART):
+                self._deferred[name] = data
+            else:
+                self._zip.writestr(name, data)
+        self._images = []
+        self._tail = template.document_tail
+        # La dimensione finale non è nota: senza ZIP64 la scrittura fallirebbe oltre 2 GiB
+        self._document = self._zip.open(DOCUMENT_PART, 'w', force_zip64=True)
+        self._pending = []
+        self._pending_size = 0
+        self.write(template.document_head)
+
+    def write(self, xml):
+        """Aggiunge XML già serializzato al body del documento."""
+        self._pending.append(xml)
+        self._pending_size += len(xml)
+        if self._pending_size >= WRITE_BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self._document.write(''.join(self._pending).encode('utf-8'))
+        self._pending = []
+        self._pending_size = 0
+
+    def add_image(self, fp, ext, content_type):
+        """
+        Registra un'immagine (file aperto, letto solo alla chiusura) come parte
+        word/media/imageN.ext e restituisce l'rId con cui referenziarla.
+        """
+        number = len(self._images) + 1
+        rid = f'rIdImage{number}'
+        self._images.append((rid, f'word/media/image{number}.{ext}', content_type, fp))
+        return rid
+
+    def _write_images(self):
+        relationships = []
+        overrides = []
+        for rid, name, content_type, fp in self._images:
+            # PNG e JPEG sono già compressi: deflate costerebbe tempo senza ridurli
+            info = zipfile.ZipInfo(name)
+            info.compress_type = zipfile.ZIP_STORED
+            fp.seek(0)
+            with self._zip.open(info, 'w', force_zip64=True) as part:
+                shutil.copyfileobj(fp, part)
+            relationships.append(f'<Relationship Id="{rid}" Type="{IMAGE_RELATIONSHIP}" '
+                                 f'Target="{name[len("word/"):]}"/>')
+            overrides.append(f'<Override PartName="/{name}" ContentType="{content_type}"/>')
+        for name, entries, closing in ((DOCUMENT_RELS_PART, relationships, b'</Relationships>'),
+                                       (CONTENT_TYPES_PART, overrides, b'</Types>')):
+            data = self._deferred[name]
+            if entries:
+                data = data.replace(closing, ''.join(entries).encode('utf-8') + closing)
+            self._zip.writestr(name, data)
+
+    def close(self):
+        self.write(self._tail)
+        self._flush()
+        self._document.close()
+        self._write_images()
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Documento incompleto: si chiude lo zip senza scrivere la coda
+            self._document.close()
+            self._zip.close()
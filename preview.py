@@ -0,0 +1,168 @@
+# Anteprima HTML di una conversione: stessi modelli dei messaggi usati dai backend .docx
+# (build_message_model), resi in HTML solo per la pagina di messaggi richiesta.
+from html import escape
+
+from converter import (conversation_messages, conversation_metadata, get_text, iter_conversations, message_model,
+                       role_labels)
+
+# Messaggi per pagina di anteprima: predefiniti e massimo accettato
+PREVIEW_MESSAGES = 20
+PREVIEW_MAX_MESSAGES = 200
+
+# Classi CSS dei ruoli, dagli stili di intestazione del documento
+_ROLE_CLASSES = {'User Header': 'user', 'Assistant Header': 'assistant', 'Role Header': 'other'}
+
+_LIST_TAGS = {'bullet': 'ul', 'numbered': 'ol'}
+
+PREVIEW_CSS = """
+body { font-family: Calibri, Arial, sans-serif; font-size: 11pt; max-width: 50em; margin: 2em auto; color: #222; }
+h1 { text-align: center; }
+table { border-collapse: collapse; margin: 0.5em 0; }
+td, th { border: 1px solid #999; padding: 2px 6px; text-align: left; }
+.message { margin: 1.5em 0; }
+.number { color: #9e9e9e; }
+.user { color: #2196f3; font-weight: bold; }
+.assistant { color: #4caf50; font-weight: bold; }
+.other { font-weight: bold; }
+.meta, .timing, .model { color: #9e9e9e; font-size: 9pt; }
+.extra { margin-left: 0.3in; font-style: italic; }
+.extra img { max-width: 100%; }
+pre.code { font-family: Consolas, monospace; font-size: 9pt; background: #f2f2f2; padding: 4px 6px; white-space: pre-wrap; }
+.reasoning { color: #757575; font-size: 9pt; white-space: pre-wrap; }
+.divider { border: 0; border-top: 1px solid #9e9e9e; }
+.conversation + .conversation { border-top: 3px double #9e9e9e; margin-top: 2em; }
+"""
+
+
+def runs_html(runs):
+    parts = []
+    for text, bold, italic in runs:
+        text = escape(text)
+        if italic:
+            text = f'<em>{text}</em>'
+        if bold:
+            text = f'<strong>{text}</strong>'
+        parts.append(text)
+    return ''.join(parts)
+
+
+def table_html(table_data):
+    if not table_data:
+        return ''
+    rows = [''.join(f'<th>{escape(cell)}</th>' for cell in table_data[0])]
+    rows.extend(''.join(f'<td>{escape(cell)}</td>' for cell in row) for row in table_data[1:])
+    return '<table>' + ''.join(f'<tr>{row}</tr>' for row in rows) + '</table>'
+
+
+def image_html(block):
+    # Il data URL dell'extra si usa così com'è; con un altro schema resta solo il nome
+    if not block['data'].startswith('data:image/'):
+        return f"<p>🖼️ {escape(block['name'])}</p>"
+    return f"<p><img src=\"{escape(block['data'])}\" alt=\"{escape(block['name'])}\"></p>"
+
+
+def blocks_html(blocks):
+    """HTML dei blocchi già risolti; elementi di elenco consecutivi finiscono nella stessa lista."""
+    parts = []
+    open_list = None
+    for block in blocks:
+        kind = block['type']
+        tag = _LIST_TAGS.get(kind)
+        if tag != open_list:
+            if open_list:
+                parts.append(f'</{open_list}>')
+            if tag:
+                parts.append(f'<{tag}>')
+            open_list = tag
+        if tag:
+            parts.append(f"<li>{runs_html(block['runs'])}</li>")
+        elif kind == 'heading':
+            # h1 è il titolo del documento
+            level = block['level'] + 1
+            parts.append(f"<h{level}>{escape(block['text'])}</h{level}>")
+        elif kind == 'table':
+            parts.append(table_html(block['data']))
+        elif kind == 'separator':
+            parts.append('<hr>')
+        elif kind == 'image':
+            parts.append(image_html(block))
+        elif kind == 'code':
+            parts.append(f"<pre class=\"code\"><code>{escape(block['data'])}</code></pre>")
+        else:
+            parts.append(f"<p>{runs_html(block['runs'])}</p>")
+    if open_list:
+        parts.append(f'</{open_list}>')
+    return ''.join(parts)
+
+
+def message_html(model, lang):
+    """HTML di un messaggio, con la stessa struttura di render_message."""
+    header = ''
+    if model['number']:
+        header += f"<span class=\"number\">{escape(model['number'])}</span>"
+    header += f"<span class=\"{_ROLE_CLASSES.get(model['role_style'], 'other')}\">{escape(model['role'])}</span>"
+    if model['date']:
+        header += f"<span class=\"meta\">{escape(model['date'])}</span>"
+    parts = ['<div class="message">', f'<p>{header}</p>']
+    if model['model']:
+        parts.append(f"<p class=\"model\">{escape(model['model'])}</p>")
+    parts.append(blocks_html(model['blocks']))
+    if model['extra_label']:
+        parts.append(f"<div class=\"extra\"><p><strong>{escape(model['extra_label'])}</strong></p>")
+        parts.append(blocks_html(model['extra_blocks']) + '</div>')
+    if model['reasoning']:
+        # Nel documento il ragionamento va in appendice; nell'anteprima resta chiuso nel messaggio
+        parts.append(f"<details class=\"reasoning\"><summary>{escape(get_text('reasoning_appendix', lang))}</summary>"
+                     f"{escape(model['reasoning'])}</details>")
+    if model['timing']:
+        parts.append(f"<p class=\"timing\">{escape(model['timing'])}</p>")
+    if model['divider']:
+        parts.append('<hr class="divider">')
+    parts.append('</div>')
+    return ''.join(parts)
+
+
+def conversation_header_html(conv, lang):
+    rows = ''.join(f'<tr><td>{escape(label)}</td><td>{escape(str(value))}</td></tr>'
+                   for label, value in conversation_metadata(conv, lang))
+    return f"<p><strong>{escape(get_text('doc_info', lang))}</strong></p><table>{rows}</table>"
+
+
+def render_preview(source, options, lang, offset=0, limit=PREVIEW_MESSAGES, fragments=None):
+    """
+    Pagina di anteprima: i messaggi dalla posizione offset (contando quelli di tutte le
+    conversazioni esportate) fino a limit messaggi, come documento HTML completo.
+    Restituisce (html, offset della pagina successiva o None). Con branch='all' la
+    lettura si ferma dopo la pagina; con il ramo attivo (il default, come nell'export) o
+    un id la scelta del ramo scorre prima una volta tutti i messaggi, tenendo in memoria
+    solo id e parent. Con fragments i modelli costruiti restano in cache per l'export.
+    """
+    labels = role_labels(options, lang)
+    title = escape(get_text('doc_title', lang))
+    parts = [f'<!DOCTYPE html><html lang="{escape(lang)}"><head><meta charset="utf-8"><title>{title}</title>'
+             f'<style>{PREVIEW_CSS}</style></head><body><h1>{title}</h1>']
+    position = 0
+    next_offset = None
+    end = offset + limit
+    for json_data in iter_conversations(source, options):
+        shown = False
+        for idx, msg in enumerate(conversation_messages(json_data, options), 1):
+            if position >= end:
+                next_offset = end
+                break
+            if position >= offset:
+                if not shown:
+                    parts.append('<div class="conversation">')
+                    if idx == 1:
+                        parts.append(conversation_header_html(json_data.get('conv', {}), lang))
+                    shown = True
+                model = message_model(msg, idx, options, lang, labels, fragments)
+                if model is not None:
+                    parts.append(message_html(model, lang))
+            position += 1
+        if shown:
+            parts.append('</div>')
+        if next_offset is not None:
+            break
+    parts.append('</body></html>')
+    return ''.join(parts), next_offset
@@ -0,0 +1,68 @@
+START_MARKER = '<<<reasoning_content_start>>>'
+END_MARKER = '<<<reasoning_content_end>>>'
+
+# Modalità per il ragionamento rimosso dai messaggi: scartato o spostato in appendice
+REASONING_MODES = ('discard', 'appendix')
+
+
+class ReasoningStripper:
+    """
+    Rimuove i blocchi di reasoning dal testo in un'unica passata, anche se il testo arriva
+    a pezzi: feed() restituisce i frammenti di testo visibile già completi, close() quelli
+    rimasti. Un blocco aperto e mai chiuso arriva fino alla fine del testo; un marcatore
+    di chiusura senza apertura resta nel testo. Con keep_reasoning il contenuto rimosso
+    viene raccolto in `reasoning`, altrimenti scartato senza copiarlo.
+    """
+
+    def __init__(self, keep_reasoning=False):
+        self.keep_reasoning = keep_reasoning
+        self.reasoning = []
+        self._inside = False
+        self._carry = ''
+
+    def feed(self, chunk):
+        text = self._carry + chunk if self._carry else chunk
+        visible = []
+        pos = 0
+        while True:
+            marker = END_MARKER if self._inside else START_MARKER
+            found = text.find(marker, pos)
+            if found < 0:
+                break
+            self._emit(visible, text, pos, found)
+            pos = found + len(marker)
+            self._inside = not self._inside
+            if self._inside and self.keep_reasoning and self.reasoning:
+                self.reasoning.append('\n\n')
+        # Un marcatore può essere spezzato tra due chunk: la coda che potrebbe esserne
+        # l'inizio (al più len(marker) - 1 caratteri, a partire da un '<') resta in attesa
+        tail = text.find('<', max(pos, len(text) - len(marker) + 1))
+        if tail < 0:
+            tail = len(text)
+        self._emit(visible, text, pos, tail)
+        self._carry = text[tail:]
+        return visible
+
+    def close(self):
+        visible = []
+        self._emit(visible, self._carry, 0, len(self._carry))
+        self._carry = ''
+        return visible
+
+    def _emit(self, visible, text, start, end):
+        if end <= start:
+            return
+        if not self._inside:
+            visible.append(text[start:end])
+        elif self.keep_reasoning:
+            self.reasoning.append(text[start:end])
+
+
+def split_reasoning(text, keep_reasoning=True):
+    """(testo visibile, ragionamento) di un testo completo, entrambi senza spazi ai bordi."""
+    if START_MARKER not in text:
+        return text.strip(), ''
+    stripper = ReasoningStripper(keep_reasoning)
+    visible = stripper.feed(text)
+    visible.extend(stripper.close())
+    return ''.join(visible).strip(), ''.join(stripper.reasoning).strip()
@@ -0,0 +1,252 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import time
+import zlib
+import uuid
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# Compressioni accettate dopo .json (export.json.gz, ...) e modulo della libreria
+# standard che le decomprime leggendo dallo stream dell'upload
+COMPRESSIONS = {'.gz': gzip, '.bz2': bz2, '.xz': lzma}
+
+JSON_SUFFIXES = ('.json',) + tuple('.json' + suffix for suffix in COMPRESSIONS)
+
+# Dimensione suggerita ai client per i blocchi degli upload riprendibili e massimo accettato
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+UPLOAD_MAX_CHUNK_BYTES = 64 * 1024 * 1024
+
+# Limite predefinito del JSON decompresso da un upload compresso (protezione dalle "zip bomb")
+DECOMPRESSED_MAX_BYTES = 8 * 1024 ** 3
+
+UPLOADING = 'uploading'
+COMPLETE = 'complete'
+
+_DECOMPRESSION_ERRORS = (OSError, EOFError, lzma.LZMAError, zlib.error)
+
+
+def is_json_upload(filename):
+    """True per .json e per .json compresso con uno dei formati di COMPRESSIONS."""
+    return (filename or '').lower().endswith(JSON_SUFFIXES)
+
+
+def compression_of(filename):
+    """Estensione di compressione di filename ('.gz', ...) o None se non è compresso."""
+    lower = (filename or '').lower()
+    for suffix in COMPRESSIONS:
+        if lower.endswith('.json' + suffix):
+            return suffix
+    return None
+
+
+def json_name(filename):
+    """Nome del JSON contenuto: export.json.gz -> export.json."""
+    suffix = compression_of(filename)
+    return filename[:-len(suffix)] if suffix else filename
+
+
+class DecompressedStream:
+    """
+    JSON decompresso al volo da un upload compresso, letto dal parser incrementale come
+    un file binario. Gli errori di decompressione diventano ValueError e la lettura si
+    interrompe oltre max_size byte decompressi. Il riposizionamento all'indietro riparte
+    dall'inizio del file compresso; quello dalla fine non è supportato.
+    """
+
+    def __init__(self, fp, max_size=None, raw=None):
+        self._fp = fp
+        self.max_size = max_size
+        # File compresso da cui legge fp, per stimare il rapporto di compressione
+        self._raw = raw
+
+    def read(self, size=-1):
+        try:
+            data = self._fp.read(size)
+        except _DECOMPRESSION_ERRORS as e:
+            raise ValueError(f"File compresso non valido: {e}") from e
+        if self.max_size is not None and self._fp.tell() > self.max_size:
+            raise ValueError(f"Il JSON decompresso supera il limite di {self.max_size} byte")
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            raise io.UnsupportedOperation("Posizionamento dalla fine non supportato su un file compresso")
+        try:
+            return self._fp.seek(offset, whence)
+        except _DECOMPRESSION_ERRORS as e:
+            raise ValueError(f"File compresso non valido: {e}") from e
+
+    def tell(self):
+        return self._fp.tell()
+
+    def compressed_progress(self):
+        """
+        (byte compressi letti finora, dimensione del file compresso), None se non sono noti:
+        con la posizione decompressa danno il rapporto di compressione del tratto già letto.
+        """
+        try:
+            position = self._raw.tell()
+            size = self._raw.seek(0, io.SEEK_END)
+            self._raw.seek(position)
+        except (AttributeError, OSError, ValueError):
+            return None
+        return position, size
+
+    def close(self):
+        self._fp.close()
+
+
+def open_upload(stream, filename, max_size=DECOMPRESSED_MAX_BYTES):
+    """
+    Stream binario del JSON di un upload: lo stream stesso per un .json, la sua
+    decompressione al volo per .json.gz, .json.bz2 e .json.xz. Chiudere il risultato
+    non chiude stream.
+    """
+    suffix = compression_of(filename)
+    if suffix is None:
+        return stream
+    return DecompressedStream(COMPRESSIONS[suffix].open(stream, 'rb'), max_size, stream)
+
+
+class ChunkOffsetError(ValueError):
+    """Blocco inviato a una posizione diversa da quella attesa: il client deve riprendere da received."""
+
+    def __init__(self, received):
+        super().__init__(f"Posizione non valida: il server ha ricevuto {received} byte")
+        self.received = received
+
+
+class UploadStore:
+    """
+    Upload riprendibili a blocchi: il client dichiara nome, dimensione e sha256 del file
+    e invia i blocchi in ordine, ciascuno alla posizione dei byte già ricevuti. Dopo una
+    disconnessione basta chiedere lo stato e ripartire da 'received'. Il file viene
+    assemblato nella cartella dello store e, quando è completo, confrontato con lo sha256
+    dichiarato prima di poter essere convertito. Gli upload inattivi scadono dopo ttl secondi.
+    """
+
+    def __init__(self, ttl=3600, upload_dir=None, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.upload_dir = upload_dir or tempfile.mkdtemp(prefix='json2docx-uploads-')
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def create(self, filename, size, sha256):
+        """Registra un nuovo upload; filename deve essere un JSON, eventualmente compresso."""
+        self.purge_expired()
+        if not is_json_upload(filename):
+            raise ValueError("Formato file non consentito")
+        if size < 0 or (self.max_size is not None and size > self.max_size):
+            raise ValueError(f"Dimensione non valida (massimo {self.max_size} byte)")
+        sha256 = (sha256 or '').strip().lower()
+        if len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+            raise ValueError("sha256 del file mancante o non valido")
+        upload_id = uuid.uuid4().hex
+        upload = {
+            'id': upload_id,
+            'filename': os.path.basename(filename),
+            'size': size,
+            'sha256': sha256,
+            'received': 0,
+            'status': UPLOADING,
+            'updated': time.time(),
+            'path': os.path.join(self.upload_dir, upload_id),
+            # sha256 dei byte ricevuti finora, aggiornato a ogni blocco
+            '_digest': hashlib.sha256(),
+            '_lock': threading.Lock(),
+        }
+        open(upload['path'], 'wb').close()
+        with self._lock:
+            self._uploads[upload_id] = upload
+        if size == 0:
+            with upload['_lock']:
+                self._verify(upload)
+        return self._public(upload)
+
+    def append(self, upload_id, offset, stream, chunk_sha256=None):
+        """
+        Aggiunge il blocco letto da stream alla posizione offset, che deve coincidere con i
+        byte già ricevuti (altrimenti ChunkOffsetError). Con chunk_sha256 il blocco viene
+        verificato prima di essere scritto; l'ultimo blocco avvia la verifica dell'intero file.
+        """
+        upload = self._get(upload_id)
+        if upload is None:
+            raise KeyError(upload_id)
+        with upload['_lock']:
+            if upload['status'] != UPLOADING:
+                raise ValueError("Upload già completato")
+            if offset != upload['received']:
+                raise ChunkOffsetError(upload['received'])
+            limit = min(UPLOAD_MAX_CHUNK_BYTES, upload['size'] - upload['received'])
+            # Il blocco viene letto per intero prima di scriverlo: una connessione interrotta
+            # a metà non lascia byte parziali nel file
+            data = stream.read(limit + 1)
+            if len(data) > limit:
+                raise ValueError(f"Blocco troppo grande (massimo {limit} byte a questa posizione)")
+            if chunk_sha256 and hashlib.sha256(data).hexdigest() != chunk_sha256.strip().lower():
+                raise ValueError("sha256 del blocco non corrispondente")
+            with open(upload['path'], 'r+b') as f:
+                f.seek(offset)
+                f.write(data)
+                f.truncate()
+            upload['_digest'].update(data)
+            upload['received'] += len(data)
+            upload['updated'] = time.time()
+            if upload['received'] == upload['size']:
+                self._verify(upload)
+            return self._public(upload)
+
+    def _verify(self, upload):
+        if upload['_digest'].hexdigest() != upload['sha256']:
+            self.discard(upload['id'])
+            raise ValueError("sha256 del file non corrispondente: upload scartato")
+        upload['status'] = COMPLETE
+
+    def get(self, upload_id):
+        """Stato dell'upload (copia), None se sconosciuto o scaduto."""
+        upload = self._get(upload_id)
+        return self._public(upload) if upload is not None else None
+
+    def open(self, upload_id):
+        """File binario aperto di un upload completo e verificato, None se non disponibile."""
+        upload = self._get(upload_id)
+        if upload is None or upload['status'] != COMPLETE:
+            return None
+        upload['updated'] = time.time()
+        return open(upload['path'], 'rb')
+
+    def _get(self, upload_id):
+        self.purge_expired()
+        with self._lock:
+            return self._uploads.get(upload_id)
+
+    def discard(self, upload_id):
+        with self._lock:
+            upload = self._uploads.pop(upload_id, None)
+        if upload is not None and os.path.exists(upload['path']):
+            os.remove(upload['path'])
+        return upload is not None
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [upload for upload in self._uploads.values() if now - upload['updated'] > self.ttl]
+            for upload in expired:
+                del self._uploads[upload['id']]
+        for upload in expired:
+            if os.path.exists(upload['path']):
+                os.remove(upload['path'])
+
+    @staticmethod
+    def _public(upload):
+        return {name: value for name, value in upload.items() if not name.startswith('_') and name != 'path'}
+
+    def shutdown(self):
+        shutil.rmtree(self.upload_dir, ignore_errors=True)